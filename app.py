@@ -1,19 +1,60 @@
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import shutil
-import os
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import asyncio
+import orjson
+import time
+import uuid
 
 from backend.llm.robot_girl_agent import RobotGirlAgent
+from backend.llm.agent_pool import get_agent_pool
+from backend.llm.personas import DEFAULT_PERSONA, PERSONAS, UnknownPersonaError, persona_session_id
 from backend.llm.message_reply_advisor import MessageReplyAdvisor
 from backend.llm.agents import DatingAnalyzer, GeneralDatingAdvisor
-from backend.llm.llm_client import call_llm_image
+from backend.llm.advice_service import ADVICE_ASYNC, CANCELLED, FAILED, PENDING, READY, get_advice_service
+from backend.llm.errors import LLMError, LLMOverloadedError
+from backend.llm.photo_analysis import analyze_photo_record
+from backend.llm.batch_analysis import (
+    BATCH_WORKERS, BatchAnalyzer, BatchInputError, Checkpoint, attach_photos, checkpoint_path, parse_items,
+)
+from backend.llm.provider import get_provider
+from backend.llm.resilience import get_resilient_caller
+from backend.llm.response_cache import get_response_cache
+from backend.llm.semantic_cache import get_semantic_cache
+from backend.llm.scheduler import ENDPOINT_PRIORITIES, bind_endpoint, get_scheduler
+from backend.storage.session_store import get_default_store
+from backend.storage.photo_store import PhotoTooLargeError, get_photo_store
+from backend.media.image_preprocess import shutdown_executor
+from backend.observability.metrics import HTTP_REQUEST_SECONDS, REGISTRY, UPLOAD_BYTES, render_metrics, stats_collector
+from backend.observability.tracing import get_tracer
+from backend.web.serving import CachedPage, OrjsonResponse, PhotoFiles, PrecompressedStaticFiles
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Клиент GigaChat и OAuth-токен готовим до первого запроса пользователя
+    await get_provider().warm()
+    # Статика сжимается до первого запроса, страница читается в память
+    await asyncio.to_thread(static_files.assets.warm, static_files.directory)
+    await asyncio.to_thread(index_page.asset)
+    # Вытесненные из пула агенты сбрасываются в фоне, а не в запросе, который их вытеснил
+    pool_flusher = asyncio.create_task(get_agent_pool().run_flusher())
+    yield
+    pool_flusher.cancel()
+    await asyncio.gather(pool_flusher, return_exceptions=True)
+    await get_advice_service().aclose()
+    get_agent_pool().flush_all()
+    await get_provider().aclose()
+    shutdown_executor()
+    get_tracer().close()
 
-app = FastAPI()
-app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/uploaded_photos", StaticFiles(directory="uploaded_photos"), name="uploaded_photos")
+app = FastAPI(lifespan=lifespan, default_response_class=OrjsonResponse)
+static_files = PrecompressedStaticFiles(directory="static")
+index_page = CachedPage("static/index.html", static_files)
+app.mount("/static", static_files, name="static")
+app.mount("/uploaded_photos", PhotoFiles(directory="uploaded_photos"), name="uploaded_photos")
 
 origins = ["*"]
 app.add_middleware(
@@ -23,52 +64,343 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-girl = RobotGirlAgent()
+def _llm_error_response(e: LLMError) -> OrjsonResponse:
+    headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+    return OrjsonResponse(status_code=e.status_code, content={"detail": str(e)}, headers=headers)
+
+@app.exception_handler(LLMError)
+async def llm_error_handler(request: Request, e: LLMError):
+    return _llm_error_response(e)
+
+@app.middleware("http")
+async def llm_admission(request: Request, call_next):
+    """
+    Привязывает вызовы GigaChat к эндпоинту (лимит и приоритет в планировщике)
+    и сразу отвечает 429, если очередь к GigaChat уже заполнена.
+    """
+    endpoint = request.url.path.strip("/").removesuffix("/stream")
+    if endpoint not in ENDPOINT_PRIORITIES:
+        return await call_next(request)
+    try:
+        get_scheduler().check_admission(endpoint)
+    except LLMOverloadedError as e:
+        return _llm_error_response(e)
+    bind_endpoint(endpoint)
+    return await call_next(request)
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    """
+    Гистограмма длительности запросов и корневой спан, к которому привязываются
+    вызовы GigaChat. Запрос считается завершенным, когда отдано все тело
+    ответа, — для SSE это конец стрима, а не отправка заголовков.
+    """
+    tracer = get_tracer()
+    start = time.perf_counter()
+    span = tracer.start_span(f"{request.method} {request.url.path}", traceparent=request.headers.get("traceparent"),
+                             **{"http.method": request.method, "http.path": request.url.path})
+    token = tracer.activate(span)
+    try:
+        response = await call_next(request)
+    except Exception as e:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=_route_label(request),
+                                     method=request.method, status="500")
+        tracer.end_span(span, e)
+        raise
+    finally:
+        tracer.deactivate(token)
+    if span is not None:
+        span.set_attribute("http.status_code", response.status_code)
+        response.headers["X-Trace-Id"] = span.trace_id
+
+    body = response.body_iterator
+
+    async def observed_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=_route_label(request),
+                                         method=request.method, status=str(response.status_code))
+            tracer.end_span(span)
+
+    response.body_iterator = observed_body()
+    return response
+
+def _route_label(request: Request) -> str:
+    """Шаблон пути маршрута, а не сам путь: число значений метки не растет с запросами"""
+    route = request.scope.get("route")
+    if route is not None:
+        return route.path
+    # Смонтированные приложения (статика) оставляют в scope только префикс монтирования
+    if request.scope.get("root_path"):
+        return request.scope["root_path"]
+    # Запрос отклонен планировщиком еще до маршрутизации
+    if request.url.path.strip("/").removesuffix("/stream") in ENDPOINT_PRIORITIES:
+        return request.url.path
+    return "unmatched"
+
+# Счетчики, которые уже ведут сами компоненты, читаются при каждом запросе /metrics
+REGISTRY.register_collector(stats_collector(
+    "llm_scheduler", lambda: get_scheduler().stats(), gauges=["active", "queue_depth"],
+    documentation="Планировщик вызовов GigaChat",
+))
+REGISTRY.register_collector(stats_collector(
+    "llm_resilience", lambda: get_resilient_caller().stats(), gauges=["latency_p95"],
+    documentation="Повторы, хеджирование и circuit breaker вызовов GigaChat",
+))
+REGISTRY.register_collector(stats_collector(
+    "llm_response_cache", lambda: get_response_cache().stats(), gauges=["memory_entries", "hit_rate"],
+    documentation="Кэш ответов LLM",
+))
+REGISTRY.register_collector(stats_collector(
+    "coach_semantic_cache", lambda: get_semantic_cache().stats(), gauges=["entries", "hit_rate"],
+    documentation="Семантический кэш ответов коуча на первые вопросы",
+))
+REGISTRY.register_collector(stats_collector(
+    "agent_pool", lambda: get_agent_pool().stats(), gauges=["size", "retired"],
+    documentation="Пул агентов RobotGirlAgent",
+))
+
+# Состояние диалогов живет в хранилище сессий; агенты-собеседницы берутся из пула, остальные создаются на запрос
+session_store = get_default_store()
+photo_store = get_photo_store()
 advisor = MessageReplyAdvisor()
+advice_service = get_advice_service()
+agent_pool = get_agent_pool()
 profile_analyzer = DatingAnalyzer()
-dating_coach = GeneralDatingAdvisor()
+
+def _session_id(session_id: Optional[str]) -> str:
+    return session_id or uuid.uuid4().hex
+
+def _girl_session_id(session_id: str, persona: Optional[str] = None) -> str:
+    try:
+        return persona_session_id(persona or DEFAULT_PERSONA, session_id)
+    except UnknownPersonaError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+def _girl(session_id: str, persona: Optional[str] = None) -> RobotGirlAgent:
+    try:
+        return agent_pool.get(persona or DEFAULT_PERSONA, session_id)
+    except UnknownPersonaError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+def _dating_coach(session_id: str) -> GeneralDatingAdvisor:
+    return GeneralDatingAdvisor(session_id=f"coach:{session_id}", store=session_store)
 
 class Message(BaseModel):
     user_message: str
+    session_id: Optional[str] = None
+    # Персонаж из /personas; по умолчанию Анна
+    persona: Optional[str] = None
+    # True — не ждать совета: он считается в фоне и забирается через /advice/{message_id}
+    async_advice: Optional[bool] = None
 
 class ProfileBio(BaseModel):
     bio: str
 
 class CoachQuestion(BaseModel):
     question: str
+    session_id: Optional[str] = None
 
 @app.post("/chat")
-def chat(msg: Message):
-    reply = girl.respond_to_message(msg.user_message)
-    suggestion = advisor.suggest_reply(girl.conversation_history, reply)
-    return {"reply": reply, "advice": suggestion}
+async def chat(msg: Message):
+    session_id = _session_id(msg.session_id)
+    girl = _girl(session_id, msg.persona)
+    # Совет к предыдущему ответу больше не нужен — пользователь уже ответил сам
+    await advice_service.cancel_pending(girl.session_id)
+    reply, message_id = await girl.arespond_to_message(msg.user_message)
+    async_advice = ADVICE_ASYNC if msg.async_advice is None else msg.async_advice
+    if async_advice:
+        await advice_service.schedule(girl.session_id, message_id, await girl.acontext_messages(), reply)
+        return {"reply": reply, "advice": None, "advice_status": PENDING, "message_id": message_id,
+                "session_id": session_id}
+    try:
+        suggestion = await advisor.asuggest_reply(await girl.acontext_messages(), reply)
+    except LLMError as e:
+        # Ответ девушки уже сохранен в сессии — отдаем его и без совета
+        print(f"[СОВЕТ] Не удалось получить совет к {message_id}: {e}")
+        await advice_service.save_failed(girl.session_id, message_id)
+        return {"reply": reply, "advice": None, "advice_status": FAILED, "message_id": message_id,
+                "session_id": session_id}
+    await advice_service.save(girl.session_id, message_id, suggestion)
+    return {"reply": reply, "advice": suggestion, "advice_status": READY, "message_id": message_id,
+            "session_id": session_id}
+
+async def _advice_record(session_id: str, message_id: int, persona: Optional[str]) -> dict:
+    record = await advice_service.get(_girl_session_id(session_id, persona), message_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Совета к этому сообщению нет")
+    return record
+
+@app.get("/advice/{message_id}")
+async def get_advice(message_id: int, session_id: str, persona: Optional[str] = None):
+    """Совет к ответу из /chat: status pending, ready, cancelled или failed"""
+    return await _advice_record(session_id, message_id, persona)
+
+@app.get("/advice/{message_id}/stream")
+async def advice_stream(message_id: int, session_id: str, persona: Optional[str] = None):
+    """SSE: событие advice, когда совет готов, или error, если он отменен или не удался"""
+    await _advice_record(session_id, message_id, persona)
+
+    async def events():
+        record = await advice_service.wait(_girl_session_id(session_id, persona), message_id)
+        if record["status"] == READY:
+            yield _sse("advice", record)
+        else:
+            detail = {PENDING: "Совет не готов", CANCELLED: "Совет отменен", FAILED: "Не удалось получить совет"}
+            yield _sse("error", {**record, "detail": detail[record["status"]]})
+    return _sse_response(events())
 
 @app.post("/analyze-profile")
-def analyze_profile(bio: ProfileBio):
-    feedback = profile_analyzer.profile_bio_advisor(bio.bio)
+async def analyze_profile(bio: ProfileBio):
+    feedback = await profile_analyzer.aprofile_bio_advisor(bio.bio)
     return {"feedback": feedback}
 
 @app.post("/ask-coach")
-def ask_coach(q: CoachQuestion):
-    answer = dating_coach.ask_question(q.question)
-    return {"answer": answer}
+async def ask_coach(q: CoachQuestion):
+    session_id = _session_id(q.session_id)
+    answer = await _dating_coach(session_id).aask_question(q.question)
+    return {"answer": answer, "session_id": session_id}
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+async def _sse_errors(events):
+    """
+    Заголовки SSE-ответа уже отправлены, поэтому ошибку GigaChat посреди
+    потока передаем отдельным событием error
+    """
+    try:
+        async for event in events:
+            yield event
+    except LLMError as e:
+        yield _sse("error", {"detail": str(e), "retry_after": e.retry_after})
+
+def _sse_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        _sse_errors(events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/chat/stream")
+async def chat_stream(msg: Message):
+    session_id = _session_id(msg.session_id)
+    girl = _girl(session_id, msg.persona)
+    await advice_service.cancel_pending(girl.session_id)
+
+    async def events():
+        reply = []
+        saved = {}
+        async for token in girl.astream_response(msg.user_message, saved):
+            reply.append(token)
+            yield _sse("reply", {"token": token})
+        reply = "".join(reply).strip()
+        advice = []
+        async for token in advisor.astream_reply(await girl.acontext_messages(), reply):
+            advice.append(token)
+            yield _sse("advice", {"token": token})
+        advice = "".join(advice).strip()
+        await advice_service.save(girl.session_id, saved["id"], advice)
+        yield _sse("done", {"reply": reply, "advice": advice, "message_id": saved["id"],
+                            "session_id": session_id})
+    return _sse_response(events())
+
+@app.post("/analyze-profile/stream")
+async def analyze_profile_stream(bio: ProfileBio):
+    async def events():
+        feedback = []
+        async for token in profile_analyzer.astream_profile_bio_advisor(bio.bio):
+            feedback.append(token)
+            yield _sse("feedback", {"token": token})
+        yield _sse("done", {"feedback": "".join(feedback).strip()})
+    return _sse_response(events())
+
+@app.post("/analyze-profile/batch")
+async def analyze_profile_batch(file: UploadFile = File(...), photos: List[UploadFile] = File(default=[]),
+                                batch_id: Optional[str] = Form(None), workers: Optional[int] = Form(None)):
+    """
+    Пакет анкет из JSONL/CSV; фото передаются отдельными файлами, в колонке
+    photo — имя файла. Результаты идут NDJSON по мере готовности, последней
+    строкой — сводка. Повторный запрос с тем же batch_id (он же в заголовке
+    X-Batch-Id) не разбирает уже готовые анкеты, а отдает их с resumed=true.
+    """
+    batch_id = batch_id or uuid.uuid4().hex
+    try:
+        items = parse_items((await file.read()).decode("utf-8-sig"), file.filename or "")
+        path = checkpoint_path(batch_id)
+        records = {}
+        for photo in photos:
+            records[photo.filename] = await photo_store.save_upload(photo)
+            UPLOAD_BYTES.observe(records[photo.filename]["size"], kind="photo")
+        items = attach_photos(items, records)
+    except (BatchInputError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PhotoTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    runner = BatchAnalyzer(profile_analyzer, photo_store, min(workers or BATCH_WORKERS, BATCH_WORKERS))
+    checkpoint = Checkpoint(path)
+
+    async def lines():
+        try:
+            async for result in runner.run(items, checkpoint, batch_id=batch_id):
+                yield orjson.dumps(result) + b"\n"
+        finally:
+            checkpoint.close()
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"X-Batch-Id": batch_id})
+
+@app.post("/ask-coach/stream")
+async def ask_coach_stream(q: CoachQuestion):
+    session_id = _session_id(q.session_id)
+    dating_coach = _dating_coach(session_id)
+
+    async def events():
+        answer = []
+        async for token in dating_coach.astream_question(q.question):
+            answer.append(token)
+            yield _sse("answer", {"token": token})
+        yield _sse("done", {"answer": "".join(answer).strip(), "session_id": session_id})
+    return _sse_response(events())
 
 @app.post("/analyze-photo")
-def analyze_photo(photo: UploadFile = File(...)):
-    os.makedirs("uploaded_photos", exist_ok=True)
-    file_path = f"uploaded_photos/{photo.filename}"
-    with open(file_path, "wb") as f:
-        shutil.copyfileobj(photo.file, f)
-    feedback = call_llm_image(file_path)
-    return {
-        "photo_feedback": feedback,
-        "photo_url": f"/uploaded_photos/{photo.filename}"
-    }
+async def analyze_photo(photo: UploadFile = File(...)):
+    try:
+        record = await photo_store.save_upload(photo)
+    except PhotoTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    UPLOAD_BYTES.observe(record["size"], kind="photo")
+    return await analyze_photo_record(photo_store, record)
+
+@app.get("/personas")
+def personas():
+    return [persona.describe() for persona in PERSONAS.values()]
+
+@app.get("/agents/stats")
+def agents_stats():
+    return get_agent_pool().stats()
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {**get_response_cache().stats(), "semantic": get_semantic_cache().stats()}
+
+@app.get("/scheduler/stats")
+def scheduler_stats():
+    return {**get_scheduler().stats(), "llm": get_resilient_caller().stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/traces")
+def traces(trace_id: Optional[str] = None, limit: int = 200):
+    """Последние завершенные спаны (нужен TRACING_ENABLED=1)"""
+    return {"enabled": get_tracer().enabled, "spans": get_tracer().recent(trace_id, limit)}
 
 @app.get("/", response_class=HTMLResponse)
-def index():
-    with open("static/index.html", encoding="utf-8") as f:
-        return f.read()
+def index(request: Request):
+    return index_page.response(request)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,155 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from backend.storage.session_store import SessionStore, get_default_store
+
+from .errors import LLMError
+from .message_reply_advisor import MessageReplyAdvisor
+from .scheduler import bind_endpoint
+
+# 1 — /chat по умолчанию отдает ответ сразу, а совет считается в фоне
+ADVICE_ASYNC = os.environ.get("ADVICE_ASYNC", "0") == "1"
+# Сколько ждать готовности совета в GET /advice/{id}/stream
+ADVICE_WAIT_TIMEOUT = float(os.environ.get("ADVICE_WAIT_TIMEOUT", 60))
+# Как часто перечитывать статус из хранилища, если совет считает другой воркер
+ADVICE_POLL_INTERVAL = 0.5
+
+PENDING = "pending"
+READY = "ready"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+
+class AdviceService:
+    """
+    Фоновая генерация советов MessageReplyAdvisor к ответам девушки.
+
+    /chat возвращает ответ сразу, а совет считается отдельной задачей и
+    сохраняется в хранилище сессий по (сессия, id ответа) — повторные запросы
+    совета к тому же ответу не обращаются к GigaChat. Когда пользователь
+    отправляет новое сообщение, незаконченный совет к предыдущему ответу
+    отменяется: он уже никому не нужен, а слот GigaChat освобождается.
+    Вызовы идут в планировщик как эндпоинт "advice" с пакетным приоритетом,
+    чтобы не задерживать интерактивные ответы.
+    """
+
+    def __init__(self, store: SessionStore, advisor: Optional[MessageReplyAdvisor] = None):
+        self.store = store
+        self.advisor = advisor or MessageReplyAdvisor()
+        # Незаконченный совет сессии: (id ответа, задача)
+        self._pending: Dict[str, Tuple[int, asyncio.Task]] = {}
+        self._done_events: Dict[Tuple[str, int], asyncio.Event] = {}
+
+    async def get(self, session_id: str, message_id: int) -> Optional[Dict]:
+        return await self.store.arun(self.store.get_advice, session_id, message_id)
+
+    async def save(self, session_id: str, message_id: int, advice: str):
+        """Сохраняет совет, посчитанный синхронно, чтобы его можно было получить повторно"""
+        await self.store.arun(self.store.set_advice, session_id, message_id, READY, advice)
+
+    async def save_failed(self, session_id: str, message_id: int):
+        """Отмечает, что синхронный совет получить не удалось"""
+        await self.store.arun(self.store.set_advice, session_id, message_id, FAILED)
+
+    def _cancel(self, session_id: str) -> Optional[asyncio.Future]:
+        """Отменяет незаконченный совет сессии; возвращает future записи статуса cancelled"""
+        pending = self._pending.pop(session_id, None)
+        if pending is None:
+            return None
+        message_id, task = pending
+        if task.done():
+            return None
+        task.cancel()
+        written = self.store.arun(self.store.set_advice, session_id, message_id, CANCELLED)
+        # Задача могла не успеть стартовать — тогда ее finally не выполнится.
+        # Проснувшийся wait прочитает статус уже после записи cancelled: у хранилища один поток
+        event = self._done_events.pop((session_id, message_id), None)
+        if event is not None:
+            event.set()
+        return written
+
+    async def cancel_pending(self, session_id: str):
+        """Отменяет незаконченный совет сессии (пришло новое сообщение пользователя)"""
+        written = self._cancel(session_id)
+        if written is not None:
+            await written
+
+    async def schedule(self, session_id: str, message_id: int, conversation_history: List[Dict],
+                       last_message: str):
+        """Запускает фоновый расчет совета, если для этого ответа его еще нет"""
+        if self._pending.get(session_id, (None,))[0] == message_id:
+            return
+        existing = await self.get(session_id, message_id)
+        if existing is not None and existing["status"] == READY:
+            return
+        # Пока читали статус, этот же совет мог запустить параллельный запрос
+        if self._pending.get(session_id, (None,))[0] == message_id:
+            return
+        cancelled = self._cancel(session_id)
+        # Запись pending уходит в поток хранилища раньше любой записи из задачи
+        written = self.store.arun(self.store.set_advice, session_id, message_id, PENDING)
+        self._done_events[(session_id, message_id)] = asyncio.Event()
+        task = asyncio.create_task(self._run(session_id, message_id, conversation_history, last_message))
+        self._pending[session_id] = (message_id, task)
+        await asyncio.gather(*[f for f in (cancelled, written) if f is not None])
+
+    async def _run(self, session_id: str, message_id: int, conversation_history: List[Dict], last_message: str):
+        bind_endpoint("advice")
+        try:
+            advice = await self.advisor.asuggest_reply(conversation_history, last_message)
+        except asyncio.CancelledError:
+            await self.store.arun(self.store.set_advice, session_id, message_id, CANCELLED)
+            raise
+        except LLMError as e:
+            print(f"[СОВЕТ] Не удалось получить совет к {message_id}: {e}")
+            await self.store.arun(self.store.set_advice, session_id, message_id, FAILED)
+        else:
+            await self.store.arun(self.store.set_advice, session_id, message_id, READY, advice)
+        finally:
+            if self._pending.get(session_id, (None,))[0] == message_id:
+                del self._pending[session_id]
+            event = self._done_events.pop((session_id, message_id), None)
+            if event is not None:
+                event.set()
+
+    async def wait(self, session_id: str, message_id: int, timeout: float = ADVICE_WAIT_TIMEOUT) -> Optional[Dict]:
+        """
+        Ждет, пока совет перестанет быть pending, и возвращает его запись.
+        Если совет считает этот процесс, ждем событие, иначе перечитываем хранилище.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            record = await self.get(session_id, message_id)
+            remaining = deadline - time.monotonic()
+            if record is None or record["status"] != PENDING or remaining <= 0:
+                return record
+            event = self._done_events.get((session_id, message_id))
+            try:
+                if event is not None:
+                    await asyncio.wait_for(event.wait(), remaining)
+                else:
+                    await asyncio.sleep(min(ADVICE_POLL_INTERVAL, remaining))
+            except asyncio.TimeoutError:
+                pass
+
+    async def aclose(self):
+        """Отменяет все незаконченные советы (при остановке приложения)"""
+        tasks = [task for _, task in self._pending.values()]
+        written = [self._cancel(session_id) for session_id in list(self._pending)]
+        await asyncio.gather(*tasks, *[f for f in written if f is not None], return_exceptions=True)
+
+
+_advice_service: Optional[AdviceService] = None
+_advice_service_lock = threading.Lock()
+
+
+def get_advice_service() -> AdviceService:
+    """Общий для процесса сервис фоновых советов поверх хранилища сессий по умолчанию"""
+    global _advice_service
+    with _advice_service_lock:
+        if _advice_service is None:
+            _advice_service = AdviceService(get_default_store())
+        return _advice_service
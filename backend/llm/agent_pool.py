@@ -0,0 +1,158 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from backend.storage.session_store import SessionStore, get_default_store
+
+from .personas import get_persona
+from .robot_girl_agent import RobotGirlAgent
+
+# Сколько агентов держать в памяти (около 0.8 КБ на агента, см. benchmarks/bench_agent_pool.py)
+AGENT_POOL_MAX_AGENTS = int(os.environ.get("AGENT_POOL_MAX_AGENTS", 10_000))
+# Через сколько секунд без сообщений агент вытесняется
+AGENT_POOL_IDLE_TTL = float(os.environ.get("AGENT_POOL_IDLE_TTL", 1800))
+# Как часто (в секундах) при выдаче агента проверять простаивающих
+AGENT_POOL_SWEEP_INTERVAL = 60
+# Как часто (в секундах) фоновая задача сбрасывает вытесненных агентов и сколько за раз
+AGENT_POOL_FLUSH_INTERVAL = float(os.environ.get("AGENT_POOL_FLUSH_INTERVAL", 1.0))
+AGENT_POOL_FLUSH_BATCH = int(os.environ.get("AGENT_POOL_FLUSH_BATCH", 100))
+
+
+class AgentPool:
+    """
+    Пул агентов RobotGirlAgent по ключу (персона, пользователь).
+
+    Агент создается при первом сообщении пользователя персоне, историю из
+    хранилища читает по мере надобности, а системный промпт у всех агентов
+    одной персоны общий. Агенты упорядочены по последнему использованию: сверх
+    max_agents и после idle_ttl без сообщений они вытесняются. Отложенное
+    состояние вытесненных (flush — транзакция индекса долговременной памяти)
+    сбрасывает не запрос, вытеснивший их, а фоновая задача run_flusher в
+    потоке, пачками по AGENT_POOL_FLUSH_BATCH. Сама история живет в хранилище
+    сессий, поэтому вытесненный агент при следующем сообщении берется из
+    ожидающих сброса или создается заново.
+    """
+
+    def __init__(self, store: Optional[SessionStore] = None, max_agents: int = AGENT_POOL_MAX_AGENTS,
+                 idle_ttl: float = AGENT_POOL_IDLE_TTL, sweep_interval: float = AGENT_POOL_SWEEP_INTERVAL):
+        self.store = store or get_default_store()
+        self.max_agents = max_agents
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        # (персона, пользователь) -> (агент, время последнего использования)
+        self._agents: "OrderedDict[Tuple[str, str], Tuple[RobotGirlAgent, float]]" = OrderedDict()
+        # Вытесненные агенты, ожидающие сброса состояния
+        self._retired: "OrderedDict[Tuple[str, str], RobotGirlAgent]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._swept_at = time.monotonic()
+        self._stats = {"hits": 0, "misses": 0, "evicted": 0, "expired": 0}
+
+    def get(self, persona_id: str, user_id: str) -> RobotGirlAgent:
+        """
+        Агент персоны для пользователя.
+
+        Raises:
+            UnknownPersonaError: если такой персоны нет
+        """
+        persona = get_persona(persona_id)
+        key = (persona_id, user_id)
+        now = time.monotonic()
+        with self._lock:
+            item = self._agents.get(key)
+            if item is not None:
+                agent = item[0]
+                self._agents.move_to_end(key)
+                self._stats["hits"] += 1
+            elif key in self._retired:
+                # Вытеснен, но еще не сброшен — возвращается в пул без сброса
+                agent = self._retired.pop(key)
+                self._stats["hits"] += 1
+            else:
+                agent = persona.create_agent(user_id, self.store)
+                self._stats["misses"] += 1
+            self._agents[key] = (agent, now)
+            while len(self._agents) > self.max_agents:
+                old_key, (old, _) = self._agents.popitem(last=False)
+                self._retired[old_key] = old
+                self._stats["evicted"] += 1
+            sweep = now - self._swept_at >= self.sweep_interval
+        if sweep:
+            self.evict_idle()
+        return agent
+
+    def evict_idle(self) -> int:
+        """
+        Вытесняет агентов, простаивающих дольше idle_ttl, в ожидающие сброса;
+        возвращает их число
+        """
+        now = time.monotonic()
+        expired = 0
+        with self._lock:
+            self._swept_at = now
+            # Порядок словаря — порядок использования, поэтому простаивающие в начале
+            while self._agents:
+                key, (agent, used_at) = next(iter(self._agents.items()))
+                if now - used_at < self.idle_ttl:
+                    break
+                del self._agents[key]
+                self._retired[key] = agent
+                expired += 1
+            self._stats["expired"] += expired
+        return expired
+
+    def flush_retired(self, max_batch: int = AGENT_POOL_FLUSH_BATCH) -> int:
+        """Сбрасывает состояние не более max_batch вытесненных агентов; возвращает их число"""
+        with self._lock:
+            batch = [self._retired.popitem(last=False)[1] for _ in range(min(max_batch, len(self._retired)))]
+        for agent in batch:
+            self._flush(agent)
+        return len(batch)
+
+    async def run_flusher(self, interval: float = AGENT_POOL_FLUSH_INTERVAL,
+                          max_batch: int = AGENT_POOL_FLUSH_BATCH):
+        """Фоновая задача: раз в interval секунд сбрасывает вытесненных агентов в потоке"""
+        while True:
+            while self._retired:
+                await asyncio.to_thread(self.flush_retired, max_batch)
+            await asyncio.sleep(interval)
+
+    @staticmethod
+    def _flush(agent: RobotGirlAgent):
+        try:
+            agent.flush()
+        except Exception as e:
+            print(f"[ПУЛ] Не удалось сохранить состояние {agent.session_id}: {e}")
+
+    def flush_all(self):
+        """Сбрасывает состояние всех агентов, включая вытесненных (при остановке приложения)"""
+        with self._lock:
+            agents = [agent for agent, _ in self._agents.values()] + list(self._retired.values())
+            self._retired.clear()
+        for agent in agents:
+            self._flush(agent)
+
+    def __len__(self) -> int:
+        return len(self._agents)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._agents)
+            stats["retired"] = len(self._retired)
+        return stats
+
+
+_agent_pool: Optional[AgentPool] = None
+_agent_pool_lock = threading.Lock()
+
+
+def get_agent_pool() -> AgentPool:
+    """Общий для процесса пул агентов поверх хранилища сессий по умолчанию"""
+    global _agent_pool
+    with _agent_pool_lock:
+        if _agent_pool is None:
+            _agent_pool = AgentPool()
+        return _agent_pool
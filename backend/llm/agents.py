@@ -1,18 +1,42 @@
-from typing import List, Dict
-from .llm_client import call_llm
+from typing import AsyncIterator, List, Dict, Optional
+from .llm_client import call_llm, acall_llm, astream_llm
+from .context_manager import ContextManager
+from .semantic_cache import SEMANTIC_CACHE_ENABLED, SemanticCache, get_semantic_cache
+from backend.observability.metrics import LLM_CACHE_LOOKUPS
+from backend.storage.session_store import SessionStore, get_default_store
 
 
 class LLMClient:
     """Базовый класс для взаимодействия с LLM."""
 
+    # Агенты с памятью выключают кэш ответов: один и тот же промпт у них не означает тот же ответ
+    use_cache = True
+
     def __init__(self, system_instruction: str):
         self.system_instruction = system_instruction
 
-    def call_llm(self, prompt_text: str, history: List[Dict[str, str]] = None) -> str:
+    @staticmethod
+    def _build_prompt(prompt_text: str, history: List[Dict[str, str]] = None) -> str:
         if history is None:
             history = []
-        full_prompt = "\n".join([msg['content'] for msg in history]) + "\n" + prompt_text
-        return call_llm(full_prompt, self.system_instruction)
+        return "\n".join([msg['content'] for msg in history]) + "\n" + prompt_text
+
+    @property
+    def agent_name(self) -> str:
+        """Метка агента в метриках и трейсах."""
+        return type(self).__name__
+
+    def call_llm(self, prompt_text: str, history: List[Dict[str, str]] = None) -> str:
+        return call_llm(self._build_prompt(prompt_text, history), self.system_instruction, self.use_cache,
+                        agent=self.agent_name)
+
+    async def acall_llm(self, prompt_text: str, history: List[Dict[str, str]] = None) -> str:
+        return await acall_llm(self._build_prompt(prompt_text, history), self.system_instruction, self.use_cache,
+                               agent=self.agent_name)
+
+    def astream_llm(self, prompt_text: str, history: List[Dict[str, str]] = None) -> AsyncIterator[str]:
+        return astream_llm(self._build_prompt(prompt_text, history), self.system_instruction, self.use_cache,
+                           agent=self.agent_name)
 
 
 class DatingAnalyzer(LLMClient):
@@ -53,15 +77,32 @@ class DatingAnalyzer(LLMClient):
         prompt_text = profile_bio
         return self.call_llm(prompt_text)
 
+    async def aprofile_bio_advisor(self, profile_bio: str) -> str:
+        """Асинхронная версия profile_bio_advisor."""
+        return await self.acall_llm(profile_bio)
+
+    def astream_profile_bio_advisor(self, profile_bio: str) -> AsyncIterator[str]:
+        """Потоковая версия profile_bio_advisor."""
+        return self.astream_llm(profile_bio)
+
     def profile_photo_advisor(self, profile_photo) -> None:
         """Анализирует фото анкеты (заглушка)."""
         pass
 
 
 class GeneralDatingAdvisor(LLMClient):
-    """Класс для ответов на общие вопросы по дейтингу с памятью."""
+    """
+    Класс для ответов на общие вопросы по дейтингу с памятью.
 
-    def __init__(self):
+    Первый вопрос сессии задается без контекста, и большинство таких вопросов —
+    переформулировки одних и тех же, поэтому ответ на него ищется в
+    семантическом кэше (см. semantic_cache) и попадает туда после вызова LLM.
+    """
+
+    use_cache = False
+
+    def __init__(self, session_id: str = "coach", store: SessionStore = None,
+                 semantic_cache: Optional[SemanticCache] = None):
         general_dating_advisor_system_instruction = (
             "Ты — опытный дейтинг-коуч и психолог, который помогает людям с вопросами о знакомствах и отношениях. "
             "Твои ответы должны быть полезными, поддерживающими и основанными на принципах здоровых отношений. "
@@ -70,15 +111,98 @@ class GeneralDatingAdvisor(LLMClient):
         )
 
         super().__init__(general_dating_advisor_system_instruction)
-        self.history: List[Dict[str, str]] = []
+        self.session_id = session_id
+        self.store = store or get_default_store()
+        self.context = ContextManager(self.store, session_id,
+                                      speaker_names={"user": "Пользователь", "assistant": "Коуч"})
+        if semantic_cache is None and SEMANTIC_CACHE_ENABLED:
+            semantic_cache = get_semantic_cache()
+        self.semantic_cache = semantic_cache
+
+    @property
+    def history(self) -> List[Dict[str, str]]:
+        """История вопросов и ответов сессии из хранилища."""
+        return [{"role": m["role"], "content": m["message"]} for m in self.store.history(self.session_id)]
+
+    @staticmethod
+    def _context_history(summary: str, recent: List[Dict]) -> List[Dict[str, str]]:
+        """Конспект ранней части разговора и последние сообщения в формате истории LLMClient."""
+        history = [{"role": m["role"], "content": m["message"]} for m in recent]
+        if summary:
+            history.insert(0, {"role": "system", "content": f"Краткое содержание предыдущего разговора: {summary}"})
+        return history
+
+    def _add_to_history(self, role: str, content: str):
+        self.context.add(role, content)
+
+    async def _aadd_to_history(self, role: str, content: str):
+        await self.context.aadd(role, content)
+
+    def _first_turn(self) -> bool:
+        """Вопрос первый в сессии и не зависит от контекста — его ответ можно брать из семантического кэша."""
+        return self.semantic_cache is not None and self.store.count(self.session_id) == 0
+
+    async def _afirst_turn(self) -> bool:
+        """Асинхронная версия _first_turn."""
+        return self.semantic_cache is not None and await self.store.arun(self.store.count, self.session_id) == 0
+
+    def _semantic_lookup(self, question: str) -> Optional[str]:
+        answer = self.semantic_cache.get(question)
+        LLM_CACHE_LOOKUPS.inc(agent=self.agent_name, result="semantic_miss" if answer is None else "semantic_hit")
+        return answer
 
     def ask_question(self, question: str) -> str:
-        """Отвечает на вопрос, сохраняя историю сообщений."""
-        self.history.append({"role": "user", "content": question})
-        response = self.call_llm("", self.history)
-        self.history.append({"role": "assistant", "content": response})
+        """
+        Отвечает на вопрос, сохраняя историю сообщений. Вопрос попадает в историю
+        вместе с ответом: при ошибке LLM в ней не остается вопроса без ответа.
+        """
+        first_turn = self._first_turn()
+        response = self._semantic_lookup(question) if first_turn else None
+        if response is None:
+            history = self._context_history(*self.context.build()) + [{"role": "user", "content": question}]
+            response = self.call_llm("", history)
+            if first_turn:
+                self.semantic_cache.set(question, response)
+        self._add_to_history("user", question)
+        self._add_to_history("assistant", response)
+        return response
+
+    async def aask_question(self, question: str) -> str:
+        """Асинхронная версия ask_question."""
+        first_turn = await self._afirst_turn()
+        response = self._semantic_lookup(question) if first_turn else None
+        if response is None:
+            history = self._context_history(*await self.context.abuild()) + [{"role": "user", "content": question}]
+            response = await self.acall_llm("", history)
+            if first_turn:
+                self.semantic_cache.set(question, response)
+        await self._aadd_to_history("user", question)
+        await self._aadd_to_history("assistant", response)
         return response
 
+    async def astream_question(self, question: str) -> AsyncIterator[str]:
+        """
+        Потоковая версия ask_question. История обновляется только после завершения ответа.
+        Ответ из семантического кэша отдается одним куском.
+        """
+        first_turn = await self._afirst_turn()
+        cached = self._semantic_lookup(question) if first_turn else None
+        if cached is not None:
+            yield cached
+            answer = cached
+        else:
+            user_entry = {"role": "user", "content": question}
+            history = self._context_history(*await self.context.abuild()) + [user_entry]
+            chunks = []
+            async for chunk in self.astream_llm("", history):
+                chunks.append(chunk)
+                yield chunk
+            answer = "".join(chunks).strip()
+            if first_turn:
+                self.semantic_cache.set(question, answer)
+        await self._aadd_to_history("user", question)
+        await self._aadd_to_history("assistant", answer)
+
 
 if __name__ == "__main__":
     # Иницализируем агентов
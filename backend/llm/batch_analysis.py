@@ -0,0 +1,359 @@
+"""
+Пакетный разбор анкет: DatingAnalyzer.profile_bio_advisor (и разбор фото) по
+файлу JSONL/CSV.
+
+Одинаковые анкеты разбираются один раз, разборы идут параллельно в
+ограниченном числе воркеров, и каждый результат отдается строкой NDJSON, как
+только готов. Готовые результаты дописываются в файл контрольной точки, и
+повторный запуск с тем же файлом не разбирает их заново. Последней строкой
+идет сводка с достигнутой пропускной способностью.
+
+Тот же разбор доступен как POST /analyze-profile/batch. Запуск из CLI:
+    python -m backend.llm.batch_analysis bios.jsonl -o results.ndjson [--resume] [--workers 3]
+"""
+import argparse
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+from backend.storage.photo_store import PhotoStore, get_photo_store
+
+from .agents import DatingAnalyzer
+from .errors import LLMOverloadedError
+from .photo_analysis import analyze_photo_record
+from .scheduler import bind_endpoint
+
+# Эндпоинт планировщика: свой лимит, чтобы пакет не занимал слоты /analyze-profile
+BATCH_ENDPOINT = "analyze-batch"
+# Сколько анкет разбирать одновременно; больше лимита analyze-batch в планировщике смысла нет
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", 3))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 10_000))
+# Где API хранит контрольные точки пакетов
+BATCH_CHECKPOINT_DIR = os.environ.get("BATCH_CHECKPOINT_DIR", "data/batches")
+# Сколько раз повторять анкету, если планировщик ответил, что очередь полна
+BATCH_OVERLOAD_RETRIES = 3
+
+OK = "ok"
+ERROR = "error"
+
+_BATCH_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class BatchInputError(Exception):
+    """Файл пакета не разобран: неизвестный формат, пустая анкета, нет фото"""
+
+
+def parse_items(text: str, filename: str = "") -> List[Dict]:
+    """
+    Анкеты из JSONL или CSV с полями id, bio и photo (id и photo необязательны).
+    Формат определяется по расширению, без него — по первому символу: JSONL
+    начинается с "{". Без id (поля нет или null) анкете присваивается номер
+    строки; пустой id и 0 — обычные id.
+
+    Raises:
+        BatchInputError: если файл не разобран, id повторяется или анкет больше BATCH_MAX_ITEMS
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    is_jsonl = ext in (".jsonl", ".ndjson", ".json") or (ext != ".csv" and text.lstrip().startswith("{"))
+    rows = []
+    if is_jsonl:
+        for number, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise BatchInputError(f"Строка {number}: не JSON ({e})")
+            if not isinstance(row, dict):
+                raise BatchInputError(f"Строка {number}: ожидается объект с полем bio")
+            rows.append((number, row))
+    else:
+        reader = csv.DictReader(io.StringIO(text))
+        if not reader.fieldnames or not {"bio", "photo"} & set(reader.fieldnames):
+            raise BatchInputError("В CSV нужна строка заголовка с колонкой bio или photo")
+        # Номер строки файла с учетом заголовка
+        rows = [(number, row) for number, row in enumerate(reader, 2)]
+
+    if len(rows) > BATCH_MAX_ITEMS:
+        raise BatchInputError(f"В пакете больше {BATCH_MAX_ITEMS} анкет")
+    items = []
+    seen = set()
+    for number, row in rows:
+        item_id = row.get("id")
+        item = {
+            "id": str(number if item_id is None else item_id),
+            "bio": str(row.get("bio") or "").strip(),
+            "photo": str(row.get("photo") or "").strip() or None,
+        }
+        if not item["bio"] and not item["photo"]:
+            raise BatchInputError(f"Анкета {item['id']}: нет ни bio, ни photo")
+        # По id различаются результаты и отметки в чекпоинте, поэтому повторы недопустимы
+        if item["id"] in seen:
+            raise BatchInputError(f"Строка {number}: id {item['id']!r} уже встречался")
+        seen.add(item["id"])
+        items.append(item)
+    return items
+
+
+def attach_photos(items: List[Dict], photos: Dict[str, Dict]) -> List[Dict]:
+    """
+    Заменяет имена фото записями хранилища и считает ключ дедупликации:
+    анкеты с одинаковым текстом и одинаковым (по содержимому) фото совпадают.
+
+    Raises:
+        BatchInputError: если фото анкеты нет среди photos
+    """
+    prepared = []
+    for item in items:
+        record = None
+        if item["photo"] is not None:
+            record = photos.get(item["photo"])
+            if record is None:
+                raise BatchInputError(f"Анкета {item['id']}: фото {item['photo']} не передано")
+        key = hashlib.sha256(f"{item['bio']}\0{record['hash'] if record else ''}".encode("utf-8")).hexdigest()
+        prepared.append({**item, "photo": record, "key": key})
+    return prepared
+
+
+def checkpoint_path(batch_id: str, directory: str = BATCH_CHECKPOINT_DIR) -> str:
+    """
+    Raises:
+        BatchInputError: если batch_id не подходит для имени файла
+    """
+    if not _BATCH_ID_RE.match(batch_id):
+        raise BatchInputError("batch_id: только латиница, цифры, _ и -, до 64 символов")
+    return os.path.join(directory, f"{batch_id}.ndjson")
+
+
+class Checkpoint:
+    """
+    NDJSON-файл со строками результатов. Успешные результаты из него
+    считаются готовыми при повторном запуске; анкеты с ошибкой разбираются
+    снова, и по id актуальна последняя строка.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Ключ анкеты -> результат разбора и id, строки которых уже записаны
+        self.done: Dict[str, Dict] = {}
+        self.ids = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        result = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Недописанная строка после падения
+                        continue
+                    if result.get("status") == OK and result.get("key"):
+                        self.done[result["key"]] = _outcome(result)
+                        self.ids.add(result["id"])
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = None
+
+    def write(self, results: List[Dict]):
+        if self._file is None:
+            self._file = open(self.path, "a+b")
+            # После падения файл может кончаться недописанной строкой — новые строки начинаем с новой
+            if self._file.tell() > 0:
+                self._file.seek(-1, os.SEEK_END)
+                if self._file.read(1) != b"\n":
+                    self._file.write(b"\n")
+        for result in results:
+            self._file.write((json.dumps(result, ensure_ascii=False) + "\n").encode("utf-8"))
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _outcome(result: Dict) -> Dict:
+    """Результат разбора без полей конкретной строки пакета"""
+    return {k: v for k, v in result.items() if k not in ("type", "id", "duplicate_of", "resumed")}
+
+
+class BatchAnalyzer:
+    """Разбор пакета анкет пулом из workers корутин поверх общего планировщика GigaChat"""
+
+    def __init__(self, analyzer: Optional[DatingAnalyzer] = None, photo_store: Optional[PhotoStore] = None,
+                 workers: int = BATCH_WORKERS):
+        self.analyzer = analyzer or DatingAnalyzer()
+        self.photo_store = photo_store or get_photo_store()
+        self.workers = max(1, workers)
+
+    async def run(self, items: List[Dict], checkpoint: Optional[Checkpoint] = None,
+                  emit_resumed: bool = True, batch_id: Optional[str] = None) -> AsyncIterator[Dict]:
+        """
+        Результаты по мере готовности, затем сводка (type=summary).
+
+        items — результат attach_photos. Анкеты, готовые в checkpoint, не
+        разбираются; с emit_resumed они отдаются сразу с resumed=true. Новые
+        результаты дописываются в checkpoint.
+        """
+        start = time.perf_counter()
+        groups: Dict[str, List[Dict]] = {}
+        for item in items:
+            groups.setdefault(item["key"], []).append(item)
+        done = checkpoint.done if checkpoint is not None else {}
+        written = checkpoint.ids if checkpoint is not None else set()
+        stats = {"items": len(items), "unique": len(groups), "resumed": 0, "analyzed": 0, "errors": 0}
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for key, group in groups.items():
+            if key in done:
+                stats["resumed"] += len(group)
+                results = self._results(group, done[key], resumed=True)
+                # Запуск мог упасть посреди записи группы дубликатов — недостающие строки дописываем
+                missing = [result for result in results if result["id"] not in written]
+                if missing:
+                    checkpoint.write(missing)
+                for result in results if emit_resumed else missing:
+                    yield result
+            else:
+                queue.put_nowait(group)
+
+        pending = queue.qsize()
+        finished: asyncio.Queue = asyncio.Queue()
+
+        async def worker():
+            bind_endpoint(BATCH_ENDPOINT)
+            while not queue.empty():
+                group = queue.get_nowait()
+                await finished.put((group, await self._analyze(group[0])))
+
+        tasks = [asyncio.create_task(worker()) for _ in range(min(self.workers, pending))]
+        try:
+            for _ in range(pending):
+                group, outcome = await finished.get()
+                results = self._results(group, outcome)
+                if checkpoint is not None:
+                    checkpoint.write(results)
+                stats["analyzed" if outcome["status"] == OK else "errors"] += len(group)
+                for result in results:
+                    yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        elapsed = time.perf_counter() - start
+        yield {
+            "type": "summary", "batch_id": batch_id, **stats, "workers": len(tasks),
+            "elapsed": round(elapsed, 3),
+            # Новые разборы в секунду (без готовых из контрольной точки) и уникальные вызовы в секунду
+            "items_per_second": round((stats["analyzed"] + stats["errors"]) / elapsed, 2) if elapsed else 0,
+            "unique_per_second": round(pending / elapsed, 2) if elapsed else 0,
+        }
+
+    @staticmethod
+    def _results(group: List[Dict], outcome: Dict, resumed: bool = False) -> List[Dict]:
+        results = []
+        for item in group:
+            result = {"type": "result", "id": item["id"], **outcome}
+            if item is not group[0]:
+                result["duplicate_of"] = group[0]["id"]
+            if resumed:
+                result["resumed"] = True
+            results.append(result)
+        return results
+
+    async def _analyze(self, item: Dict) -> Dict:
+        """Разбор одной анкеты; ошибка не прерывает пакет, а попадает в результат"""
+        start = time.perf_counter()
+        outcome = {"key": item["key"]}
+        try:
+            if item["bio"]:
+                outcome["feedback"] = await self._retrying(lambda: self.analyzer.aprofile_bio_advisor(item["bio"]))
+            if item["photo"] is not None:
+                outcome.update(await self._retrying(lambda: analyze_photo_record(self.photo_store, item["photo"])))
+            outcome["status"] = OK
+        except Exception as e:
+            print(f"[ПАКЕТ] Не удалось разобрать анкету {item['id']}: {e}")
+            outcome = {"key": item["key"], "status": ERROR, "error": str(e)}
+        outcome["elapsed"] = round(time.perf_counter() - start, 3)
+        return outcome
+
+    @staticmethod
+    async def _retrying(call):
+        for attempt in range(BATCH_OVERLOAD_RETRIES + 1):
+            try:
+                return await call()
+            except LLMOverloadedError as e:
+                if attempt == BATCH_OVERLOAD_RETRIES:
+                    raise
+                await asyncio.sleep(e.retry_after or 1)
+
+
+def _load_photos(items: List[Dict], base_dir: str, store: PhotoStore) -> Dict[str, Dict]:
+    """Фото из CLI — пути к файлам относительно каталога входного файла"""
+    photos = {}
+    for name in {item["photo"] for item in items if item["photo"] is not None}:
+        path = os.path.join(base_dir, name)
+        if os.path.exists(path):
+            photos[name] = store.save_file(path)
+    return photos
+
+
+async def _main(args):
+    from backend.media.image_preprocess import shutdown_executor
+    from .provider import get_provider
+
+    with open(args.input, encoding="utf-8-sig") as f:
+        items = parse_items(f.read(), args.input)
+    store = get_photo_store()
+    items = attach_photos(items, _load_photos(items, os.path.dirname(os.path.abspath(args.input)), store))
+
+    # С --resume выходной файл сам служит контрольной точкой: готовое в нем не разбирается и не дублируется
+    checkpoint = Checkpoint(args.output) if args.output and args.resume else None
+    if args.output and not args.resume:
+        open(args.output, "w").close()
+    out = None if checkpoint is not None else (open(args.output, "a", encoding="utf-8") if args.output else sys.stdout)
+    try:
+        runner = BatchAnalyzer(photo_store=store, workers=args.workers)
+        async for result in runner.run(items, checkpoint, emit_resumed=False):
+            if result["type"] == "summary":
+                print(f"Анкет {result['items']} (уникальных {result['unique']}), из контрольной точки "
+                      f"{result['resumed']}, разобрано {result['analyzed']}, ошибок {result['errors']} "
+                      f"за {result['elapsed']:.1f} с: {result['items_per_second']} анкет/с, "
+                      f"{result['unique_per_second']} вызовов/с при {result['workers']} воркерах", file=sys.stderr)
+            elif out is not None:
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+        if out is not None and out is not sys.stdout:
+            out.close()
+        await get_provider().aclose()
+        shutdown_executor()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL или CSV с полями id, bio, photo (путь к фото относительно файла)")
+    parser.add_argument("-o", "--output", help="Файл NDJSON с результатами (по умолчанию stdout)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Продолжить прерванный запуск: пропустить анкеты, уже разобранные в --output")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    args = parser.parse_args()
+    if args.resume and not args.output:
+        parser.error("--resume работает только с --output")
+    try:
+        asyncio.run(_main(args))
+    except BatchInputError as e:
+        sys.exit(f"Ошибка во входном файле: {e}")
+
+
+if __name__ == "__main__":
+    main()
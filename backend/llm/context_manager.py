@@ -0,0 +1,136 @@
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+
+from .errors import LLMError
+from .llm_client import call_llm, acall_llm
+from backend.storage.session_store import SessionStore
+
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 1500))
+# После сжатия дословно остается такая доля бюджета: сжимаем пачками, а не на каждом сообщении
+CONTEXT_KEEP_RATIO = float(os.environ.get("CONTEXT_KEEP_RATIO", 0.6))
+
+# Метка вызовов сжатия контекста в метриках
+SUMMARY_AGENT = "ContextSummary"
+
+SUMMARY_SYSTEM_INSTRUCTION = (
+    "Ты ведешь краткий конспект переписки. Тебе дают прежний конспект и новые сообщения. "
+    "Обнови конспект: сохрани имена, факты о собеседниках, договоренности, интересы и важные "
+    "эмоциональные моменты, убери повторы и мелочи. Пиши связным текстом в третьем лице, "
+    "не длиннее 120 слов, только на русском языке."
+)
+
+
+def count_tokens(text: str) -> int:
+    """
+    Приблизительное число токенов GigaChat: для русского текста в среднем около 3 символов на токен.
+    Точный подсчет требует запроса к API, а здесь важна только оценка размера промпта.
+    """
+    return max(1, math.ceil(len(text) / 3))
+
+
+def entry_tokens(entry: Dict) -> int:
+    tokens = entry.get("tokens")
+    return tokens if tokens is not None else count_tokens(entry.get("message") or entry.get("content") or "")
+
+
+def trim_to_budget(entries: List[Dict], budget_tokens: int) -> List[Dict]:
+    """Последние сообщения списка, суммарно укладывающиеся в бюджет (хотя бы одно)"""
+    kept = []
+    used = 0
+    for entry in reversed(entries):
+        tokens = entry_tokens(entry)
+        if kept and used + tokens > budget_tokens:
+            break
+        kept.append(entry)
+        used += tokens
+    kept.reverse()
+    return kept
+
+
+class ContextManager:
+    """
+    Ограниченный по токенам контекст разговора, хранящегося в SessionStore.
+
+    Токены каждого сообщения считаются один раз при записи. Пока несжатая часть
+    истории укладывается в бюджет, она уходит в промпт дословно. Когда бюджет
+    превышен, самые старые сообщения сворачиваются в конспект, который хранится
+    рядом с историей и обновляется инкрементально: в LLM отправляется только
+    прежний конспект и новая порция сообщений.
+    """
+
+    def __init__(self, store: SessionStore, session_id: str, budget_tokens: int = CONTEXT_TOKEN_BUDGET,
+                 keep_ratio: float = CONTEXT_KEEP_RATIO, speaker_names: Optional[Dict[str, str]] = None):
+        self.store = store
+        self.session_id = session_id
+        self.budget_tokens = budget_tokens
+        self.keep_ratio = keep_ratio
+        self.speaker_names = speaker_names or {"user": "Пользователь", "assistant": "Ассистент"}
+
+    def add(self, role: str, message: str, timestamp: str = None) -> Dict:
+        """Записывает сообщение в историю вместе с его размером в токенах"""
+        return self.store.append(self.session_id, role, message, timestamp, tokens=count_tokens(message))
+
+    async def aadd(self, role: str, message: str, timestamp: str = None) -> Dict:
+        """Асинхронная версия add"""
+        return await self.store.arun(self.add, role, message, timestamp)
+
+    def _plan(self) -> Tuple[str, List[Dict], List[Dict]]:
+        """Конспект, сообщения для досжатия и сообщения, идущие в промпт дословно"""
+        summary, upto_id = self.store.get_summary(self.session_id)
+        entries = self.store.after(self.session_id, upto_id)
+        for entry in entries:
+            if entry["tokens"] is None:
+                # Сообщения, импортированные без подсчета, считаем один раз и запоминаем
+                entry["tokens"] = count_tokens(entry["message"])
+                self.store.set_tokens(entry["id"], entry["tokens"])
+
+        total = sum(entry["tokens"] for entry in entries)
+        if total <= self.budget_tokens:
+            return summary, [], entries
+
+        keep = trim_to_budget(entries, int(self.budget_tokens * self.keep_ratio))
+        return summary, entries[:len(entries) - len(keep)], keep
+
+    def _summary_prompt(self, summary: str, entries: List[Dict]) -> str:
+        lines = "\n".join(f"{self.speaker_names.get(e['role'], e['role'])}: {e['message']}" for e in entries)
+        return f"ПРЕЖНИЙ КОНСПЕКТ:\n{summary or '(пусто)'}\n\nНОВЫЕ СООБЩЕНИЯ:\n{lines}"
+
+    def _commit(self, new_summary: str, folded: List[Dict], recent: List[Dict]) -> Tuple[str, List[Dict]]:
+        self.store.set_summary(self.session_id, new_summary, folded[-1]["id"])
+        return new_summary, recent
+
+    def build(self) -> Tuple[str, List[Dict]]:
+        """Конспект ранней части разговора и последние сообщения в пределах бюджета"""
+        summary, to_fold, recent = self._plan()
+        if not to_fold:
+            return summary, recent
+        try:
+            new_summary = call_llm(self._summary_prompt(summary, to_fold), SUMMARY_SYSTEM_INSTRUCTION,
+                                   agent=SUMMARY_AGENT)
+        except LLMError as e:
+            # Конспект не обновился — в этот раз отправляем несжатую часть целиком
+            print(f"[КОНТЕКСТ] Не удалось обновить конспект: {e}")
+            return summary, to_fold + recent
+        return self._commit(new_summary, to_fold, recent)
+
+    async def abuild(self) -> Tuple[str, List[Dict]]:
+        """Асинхронная версия build: чтение и запись хранилища идут в его потоке"""
+        summary, to_fold, recent = await self.store.arun(self._plan)
+        if not to_fold:
+            return summary, recent
+        try:
+            new_summary = await acall_llm(self._summary_prompt(summary, to_fold), SUMMARY_SYSTEM_INSTRUCTION,
+                                         agent=SUMMARY_AGENT)
+        except LLMError as e:
+            print(f"[КОНТЕКСТ] Не удалось обновить конспект: {e}")
+            return summary, to_fold + recent
+        return await self.store.arun(self._commit, new_summary, to_fold, recent)
+
+    def recent(self) -> List[Dict]:
+        """Несжатый хвост разговора без обращения к LLM"""
+        return self._plan()[2]
+
+    async def arecent(self) -> List[Dict]:
+        """Асинхронная версия recent"""
+        return (await self.store.arun(self._plan))[2]
@@ -0,0 +1,55 @@
+from typing import Optional
+
+
+class LLMError(Exception):
+    """
+    Базовая ошибка вызова GigaChat.
+
+    status_code — HTTP-статус, которым ошибку отдает API приложения,
+    retry_after — через сколько секунд имеет смысл повторить запрос,
+    retryable — стоит ли повторять вызов сразу (сбой сети, таймаут, 5xx).
+    """
+
+    status_code = 502
+    retryable = False
+
+    def __init__(self, message: str, retry_after: Optional[int] = None, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        if status_code is not None:
+            self.status_code = status_code
+
+
+class LLMNotConfiguredError(LLMError):
+    """Клиент GigaChat не инициализирован (нет токена или ошибка при создании)"""
+
+    status_code = 503
+
+
+class LLMTimeoutError(LLMError):
+    """GigaChat не ответил за отведенное время"""
+
+    status_code = 504
+    retryable = True
+
+
+class LLMUpstreamError(LLMError):
+    """GigaChat вернул ошибку или соединение оборвалось"""
+
+    def __init__(self, message: str, upstream_status: Optional[int] = None, retryable: bool = False):
+        super().__init__(message)
+        self.upstream_status = upstream_status
+        self.retryable = retryable
+
+
+class LLMCircuitOpenError(LLMError):
+    """GigaChat недавно стабильно отказывал, вызовы временно не выполняются"""
+
+    status_code = 503
+
+
+class LLMOverloadedError(LLMError):
+    """Очередь к GigaChat переполнена или ожидание в ней превысило бюджет"""
+
+    def __init__(self, message: str, retry_after: int, status_code: int = 429):
+        super().__init__(message, retry_after, status_code)
@@ -1,50 +1,266 @@
-from langchain_gigachat.chat_models import GigaChat
-from langchain_core.messages import HumanMessage, SystemMessage
-from dotenv import load_dotenv
+import asyncio
+import contextlib
+import hashlib
+import mimetypes
 import os
-import requests
+import time
 
-load_dotenv(override=True)
+from backend.observability.metrics import (
+    LLM_CACHE_LOOKUPS, LLM_CALL_SECONDS, LLM_FIRST_TOKEN_SECONDS, LLM_TOKENS, UPLOAD_BYTES,
+)
+from backend.observability.tracing import get_tracer
+
+from .provider import get_provider
+from .resilience import get_resilient_caller
+from .response_cache import ResponseCache, get_response_cache
 
 # --- Настройка GigaChat ---
-GIGA_CREDENTIALS = os.environ.get("GIGACHAT_TOKEN")
-giga_client = None
-
-try:
-    giga_client = GigaChat(credentials=GIGA_CREDENTIALS, verify_ssl_certs=False, model="GigaChat-2-Max")
-except Exception as e:
-    print(f"[ОШИБКА GigaChat Init] {e}")
-
-def call_llm(prompt_text, system_instruction):
-    if giga_client is None: return "[ОШИБКА API] Клиент GigaChat не инициализирован."
-    # print(f"\nВызов GigaChat: Системная инструкция (начало): {system_instruction[:100]}... Промпт: {prompt_text[:100]}...")
-    try:
-        messages = [SystemMessage(content=system_instruction), HumanMessage(content=prompt_text)]
-        res = giga_client.invoke(messages)
-        # print(f"GigaChat ответ (начало): {res.content[:100]}...")
-        return res.content.strip()
-    except Exception as e:
-        print(f"Ошибка вызова GigaChat API: {e}")
-        return f"[ОШИБКА API] {e}"
-
-def call_llm_image(image_path):
-    if giga_client is None: return "[ОШИБКА API] Клиент GigaChat не инициализирован."
-
-    file = giga_client.upload_file(open(image_path, "rb"), purpose="general")
-    print(file)
-
-    system_instruction = (
-            "Ты — опытный дейтинг-коуч и психолог, который помогает людям с вопросами о знакомствах и отношениях. "
-            "Твои ответы должны быть полезными, поддерживающими и основанными на принципах здоровых отношений. "
-            "Оцени, насколько привлекательна эта фотка для анкеты на сайте знакомств, "
-            "Опиши сильные и слабые стороны и дай рекомендации по улучшению. Сделай это максимально кратко и лаконично."
-        )
-
-    result = giga_client.invoke([HumanMessage(content=system_instruction,
-                                              additional_kwargs={"attachments": [file.id_]})])
+# Клиент создает провайдер при первом вызове: импорт модуля не тянет langchain и не ходит в сеть
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "1") != "0"
+# Метка agent для вызовов, у которых нет агента
+DEFAULT_AGENT = "default"
+IMAGE_AGENT = "image"
+
+
+def _client():
+    return get_provider().get()
+
+
+def _messages(system_instruction, prompt_text):
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    return [SystemMessage(content=system_instruction), HumanMessage(content=prompt_text)]
+
+
+def _cache_key(prompt_text, system_instruction, use_cache):
+    """Ключ кэша или None, если кэш для вызова выключен"""
+    if not (use_cache and LLM_CACHE_ENABLED):
+        return None
+    return ResponseCache.make_key(prompt_text, system_instruction, get_provider().model)
+
+
+def _cache_lookup(key, agent):
+    """Ответ из кэша или None; попадания и промахи считаются по агентам"""
+    if key is None:
+        return None
+    cached = get_response_cache().get(key)
+    LLM_CACHE_LOOKUPS.inc(agent=agent, result="miss" if cached is None else "hit")
+    return cached
+
+
+async def _acache_lookup(key, agent):
+    """Асинхронная версия _cache_lookup: дисковый уровень кэша читается в потоке"""
+    if key is None:
+        return None
+    cached = await get_response_cache().aget(key)
+    LLM_CACHE_LOOKUPS.inc(agent=agent, result="miss" if cached is None else "hit")
+    return cached
+
+
+def _cache_store(key, response):
+    if key is not None:
+        get_response_cache().set(key, response)
+
+
+async def _acache_store(key, response):
+    if key is not None:
+        await get_response_cache().aset(key, response)
+
+
+def _record_usage(agent, message, span=None):
+    """Токены из usage_metadata ответа langchain (у кусков стрима он есть только в последнем)"""
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return
+    LLM_TOKENS.inc(usage.get("input_tokens", 0), agent=agent, type="prompt")
+    LLM_TOKENS.inc(usage.get("output_tokens", 0), agent=agent, type="completion")
+    if span is not None:
+        span.set_attribute("llm.prompt_tokens", usage.get("input_tokens", 0))
+        span.set_attribute("llm.completion_tokens", usage.get("output_tokens", 0))
+
+
+@contextlib.contextmanager
+def _observed(agent, kind, **attributes):
+    """
+    Длительность вызова GigaChat (с очередью планировщика и повторами) в
+    гистограмму и дочерний спан HTTP-запроса. Спан не становится текущим,
+    поэтому обертка годится и для тела асинхронного генератора.
+    """
+    start = time.perf_counter()
+    outcome = "ok"
+    with get_tracer().span(f"llm.{kind}", activate=False, agent=agent, **attributes) as span:
+        try:
+            yield span
+        except (GeneratorExit, asyncio.CancelledError):
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            LLM_CALL_SECONDS.observe(time.perf_counter() - start, agent=agent, kind=kind, outcome=outcome)
+
+
+def call_llm(prompt_text, system_instruction, use_cache=True, agent=DEFAULT_AGENT):
+    """
+    Синхронный вызов GigaChat. Ответы кэшируются по (промпт, инструкция, модель);
+    агенты с состоянием передают use_cache=False. agent — метка в метриках.
+
+    Raises:
+        LLMError: если GigaChat недоступен, не ответил вовремя или вернул ошибку
+            (LLMOverloadedError — если планировщик не допустил вызов)
+    """
+    client = _client()
+    key = _cache_key(prompt_text, system_instruction, use_cache)
+    cached = _cache_lookup(key, agent)
+    if cached is not None:
+        return cached
+    messages = _messages(system_instruction, prompt_text)
+    with _observed(agent, "chat") as span:
+        res = get_resilient_caller().call(lambda: client.invoke(messages))
+        _record_usage(agent, res, span)
+    response = res.content.strip()
+    _cache_store(key, response)
+    return response
+
+IMAGE_SYSTEM_INSTRUCTION = (
+    "Ты — опытный дейтинг-коуч и психолог, который помогает людям с вопросами о знакомствах и отношениях. "
+    "Твои ответы должны быть полезными, поддерживающими и основанными на принципах здоровых отношений. "
+    "Оцени, насколько привлекательна эта фотка для анкеты на сайте знакомств, "
+    "Опиши сильные и слабые стороны и дай рекомендации по улучшению. Сделай это максимально кратко и лаконично."
+)
+
+
+def _image_messages(file_id):
+    from langchain_core.messages import HumanMessage
 
+    return [HumanMessage(content=IMAGE_SYSTEM_INSTRUCTION, additional_kwargs={"attachments": [file_id]})]
+
+
+def _read_image(image_path):
+    """Читает картинку и считает ключ кэша по ее содержимому"""
+    with open(image_path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    content_type = mimetypes.guess_type(image_path)[0] or "image/jpeg"
+    return (os.path.basename(image_path), data, content_type), digest
+
+
+def _upload_file(client, upload):
+    UPLOAD_BYTES.observe(len(upload[1]), kind="llm")
+    with _observed(IMAGE_AGENT, "upload", bytes=len(upload[1])):
+        return get_resilient_caller().call(lambda: client.upload_file(upload, purpose="general")).id_
+
+
+async def _aupload_file(client, upload):
+    UPLOAD_BYTES.observe(len(upload[1]), kind="llm")
+    with _observed(IMAGE_AGENT, "upload", bytes=len(upload[1])):
+        file = await get_resilient_caller().acall(lambda: client.aupload_file(upload, purpose="general"))
+    return file.id_
+
+
+def upload_image(image_path):
+    """Загружает картинку в хранилище GigaChat и возвращает id файла"""
+    upload, _ = _read_image(image_path)
+    return _upload_file(_client(), upload)
+
+
+def describe_image(file_id):
+    """Разбирает уже загруженную в GigaChat фотографию"""
+    client = _client()
+    with _observed(IMAGE_AGENT, "describe") as span:
+        result = get_resilient_caller().call(lambda: client.invoke(_image_messages(file_id)))
+        _record_usage(IMAGE_AGENT, result, span)
     return result.content.strip()
-    # print(result.content.strip())
+
+
+def call_llm_image(image_path, use_cache=True):
+    client = _client()
+    upload, digest = _read_image(image_path)
+    key = _cache_key(digest, IMAGE_SYSTEM_INSTRUCTION, use_cache)
+    cached = _cache_lookup(key, IMAGE_AGENT)
+    if cached is not None:
+        return cached
+
+    response = describe_image(_upload_file(client, upload))
+    _cache_store(key, response)
+    return response
+
+
+async def acall_llm(prompt_text, system_instruction, use_cache=True, agent=DEFAULT_AGENT):
+    """Асинхронная версия call_llm: не занимает поток на время ожидания GigaChat."""
+    client = _client()
+    key = _cache_key(prompt_text, system_instruction, use_cache)
+    cached = await _acache_lookup(key, agent)
+    if cached is not None:
+        return cached
+    messages = _messages(system_instruction, prompt_text)
+    with _observed(agent, "chat") as span:
+        # Повтор того же промпта не меняет состояния, поэтому запрос можно хеджировать
+        res = await get_resilient_caller().acall(lambda: client.ainvoke(messages), hedge=True)
+        _record_usage(agent, res, span)
+    response = res.content.strip()
+    await _acache_store(key, response)
+    return response
+
+
+async def aupload_image(image_path):
+    """Асинхронная версия upload_image."""
+    upload, _ = await asyncio.to_thread(_read_image, image_path)
+    return await _aupload_file(_client(), upload)
+
+
+async def adescribe_image(file_id):
+    """Асинхронная версия describe_image."""
+    client = _client()
+    with _observed(IMAGE_AGENT, "describe") as span:
+        result = await get_resilient_caller().acall(lambda: client.ainvoke(_image_messages(file_id)), hedge=True)
+        _record_usage(IMAGE_AGENT, result, span)
+    return result.content.strip()
+
+
+async def acall_llm_image(image_path, use_cache=True):
+    """Асинхронная версия call_llm_image."""
+    client = _client()
+    # Оригинал фото — до MAX_PHOTO_BYTES: чтение и SHA-256 не должны держать event loop
+    upload, digest = await asyncio.to_thread(_read_image, image_path)
+    key = _cache_key(digest, IMAGE_SYSTEM_INSTRUCTION, use_cache)
+    cached = await _acache_lookup(key, IMAGE_AGENT)
+    if cached is not None:
+        return cached
+
+    response = await adescribe_image(await _aupload_file(client, upload))
+    await _acache_store(key, response)
+    return response
+
+
+async def astream_llm(prompt_text, system_instruction, use_cache=True, agent=DEFAULT_AGENT):
+    """
+    Потоковая версия acall_llm: отдает куски ответа по мере генерации.
+    Закэшированный ответ отдается одним куском, новый попадает в кэш после конца стрима.
+    Слот планировщика занят до конца стрима. Ошибка может прийти и после
+    первых кусков — тогда ответ в кэш не попадает.
+    """
+    client = _client()
+    key = _cache_key(prompt_text, system_instruction, use_cache)
+    cached = await _acache_lookup(key, agent)
+    if cached is not None:
+        yield cached
+        return
+    messages = _messages(system_instruction, prompt_text)
+    chunks = []
+    with _observed(agent, "stream") as span:
+        start = time.perf_counter()
+        # aclosing: если потребитель бросит стрим, слот планировщика освободится сразу, а не при сборке мусора
+        async with contextlib.aclosing(get_resilient_caller().astream(lambda: client.astream(messages))) as stream:
+            async for chunk in stream:
+                _record_usage(agent, chunk, span)
+                if chunk.content:
+                    if not chunks:
+                        LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start, agent=agent)
+                    chunks.append(chunk.content)
+                    yield chunk.content
+    await _acache_store(key, "".join(chunks).strip())
 
 if __name__ == "__main__":
     # Пример системной инструкции и промпта
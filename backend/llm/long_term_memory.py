@@ -0,0 +1,166 @@
+import hashlib
+import os
+import threading
+from typing import Dict, List, Optional, Set
+
+from .russian_stemmer import normalize_tokens
+from backend.storage.session_store import SessionStore
+from backend.storage.sqlite import ThreadLocalConnections
+
+MEMORY_TOP_K = int(os.environ.get("MEMORY_TOP_K", 3))
+# Слова запроса, встречающиеся чаще чем в такой доле сообщений сессии, не участвуют
+# в поиске: по смыслу они почти ничего не дают, а ранжировать их совпадения дорого.
+# Столько совпадений ранжируется быстро при любом размере сессии
+MEMORY_MAX_DF_RATIO = float(os.environ.get("MEMORY_MAX_DF_RATIO", 0.03))
+MEMORY_DF_FLOOR = 200
+# Сколько самых редких слов запроса остается, даже если все они частые
+MEMORY_MIN_TERMS = 2
+
+
+class LongTermMemory:
+    """
+    Полнотекстовый индекс всей истории сессий (BM25 поверх SQLite FTS5).
+
+    В индекс попадают основы слов (см. russian_stemmer), поэтому «путешествую»
+    находит «путешествия». Индекс лежит в той же базе, что и SessionStore, и
+    дополняется инкрементально: после каждой записи индексируются сообщения
+    сессии, которых в нем еще нет. rowid строки индекса совпадает с id сообщения.
+    """
+
+    def __init__(self, store: SessionStore):
+        self.store = store
+        self._conn = ThreadLocalConnections(store.path).get
+        conn = self._conn()
+        # session — служебный токен сессии, его вес в BM25 нулевой
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(session, stems)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages_fts_state (
+                session_id TEXT PRIMARY KEY,
+                last_id INTEGER NOT NULL,
+                indexed INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        # Частоты основ по всему индексу: по ним отбрасываются неинформативные слова запроса
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts_vocab USING fts5vocab(messages_fts, 'row')")
+
+    @staticmethod
+    def _session_token(session_id: str) -> str:
+        return "s" + hashlib.sha1(session_id.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def _query_prefix(term: str) -> str:
+        """
+        Стеммер не всегда сводит однокоренные слова к одной основе
+        («путешеств» и «путешествова»), поэтому длинные основы ищем по префиксу
+        без последних букв.
+        """
+        return term[:max(5, len(term) - 3)]
+
+    def index_new(self, session_id: str) -> int:
+        """Индексирует еще не проиндексированные сообщения сессии, возвращает их число"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT last_id FROM messages_fts_state WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            entries = self.store.after(session_id, row["last_id"] if row is not None else 0)
+            if entries:
+                token = self._session_token(session_id)
+                conn.executemany(
+                    "INSERT INTO messages_fts (rowid, session, stems) VALUES (?, ?, ?)",
+                    [(e["id"], token, " ".join(normalize_tokens(e["message"]))) for e in entries],
+                )
+                conn.execute(
+                    "INSERT INTO messages_fts_state (session_id, last_id, indexed) VALUES (?, ?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET last_id = excluded.last_id, "
+                    "indexed = indexed + excluded.indexed",
+                    (session_id, entries[-1]["id"], len(entries)),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return len(entries)
+
+    def _session_df(self, token: str, term: str, limit: int) -> int:
+        """
+        В скольких сообщениях сессии встречается основа (по префиксу); счет
+        останавливается на limit — дальше точное число не нужно
+        """
+        return self._conn().execute(
+            "SELECT count(*) FROM (SELECT 1 FROM messages_fts WHERE messages_fts MATCH ? LIMIT ?)",
+            (f'session : {token} AND stems : "{term}"*', limit),
+        ).fetchone()[0]
+
+    def _select_terms(self, session_id: str, terms: Set[str]) -> List[str]:
+        """
+        Отбрасывает слова запроса, частые в этой сессии, оставляя хотя бы
+        MEMORY_MIN_TERMS самых редких. Время BM25 растет с числом совпавших
+        документов, поэтому частые основы вроде «нрав» или «расскаж» делают
+        поиск медленным и ничего не добавляют к релевантности.
+
+        Частота считается по сообщениям самой сессии: слово, частое у других
+        пользователей, в этой переписке может быть как раз отличительным.
+        Частоту по всему индексу (fts5vocab, дешево) используем как верхнюю
+        оценку — точный подсчет по сессии нужен только для частых в индексе слов.
+        """
+        if not terms:
+            return []
+        conn = self._conn()
+        row = conn.execute("SELECT indexed FROM messages_fts_state WHERE session_id = ?", (session_id,)).fetchone()
+        cutoff = max(MEMORY_DF_FLOOR, (row["indexed"] if row is not None else 0) * MEMORY_MAX_DF_RATIO)
+        token = self._session_token(session_id)
+        ranked = []
+        for term in terms:
+            global_df = conn.execute(
+                "SELECT coalesce(sum(doc), 0) FROM messages_fts_vocab WHERE term >= ? AND term < ?",
+                (term, term + "\uffff"),
+            ).fetchone()[0]
+            df = global_df if global_df <= cutoff else self._session_df(token, term, int(cutoff) + 1)
+            # Среди частых в сессии (счет обрезан на cutoff + 1) раньше идут более редкие в индексе
+            ranked.append((df, global_df, term))
+        ranked = [(df, term) for df, _, term in sorted(ranked) if df > 0]
+        return [term for i, (df, term) in enumerate(ranked) if df <= cutoff or i < MEMORY_MIN_TERMS]
+
+    def search(self, session_id: str, query: str, limit: int = MEMORY_TOP_K,
+               before_id: Optional[int] = None) -> List[Dict]:
+        """
+        Самые релевантные запросу сообщения сессии с id меньше before_id,
+        в хронологическом порядке.
+        """
+        terms = self._select_terms(session_id, {self._query_prefix(t) for t in normalize_tokens(query)})
+        if not terms:
+            return []
+        any_term = " OR ".join(f'"{t}"*' for t in terms)
+        match = f"session : {self._session_token(session_id)} AND stems : ({any_term})"
+        rows = self._conn().execute(
+            "SELECT rowid FROM messages_fts WHERE messages_fts MATCH ? AND rowid < ? "
+            "ORDER BY bm25(messages_fts, 0.0, 1.0) LIMIT ?",
+            (match, before_id if before_id is not None else 2 ** 62, limit),
+        ).fetchall()
+        if not rows:
+            return []
+        ids = sorted(row["rowid"] for row in rows)
+        return self.store.get_many(ids)
+
+    def clear(self, session_id: str):
+        conn = self._conn()
+        conn.execute(
+            "DELETE FROM messages_fts WHERE messages_fts MATCH ?",
+            (f"session : {self._session_token(session_id)}",),
+        )
+        conn.execute("DELETE FROM messages_fts_state WHERE session_id = ?", (session_id,))
+
+
+_memories: Dict[str, LongTermMemory] = {}
+_memories_lock = threading.Lock()
+
+
+def get_long_term_memory(store: SessionStore) -> LongTermMemory:
+    """Один индекс (и один набор соединений) на файл базы"""
+    with _memories_lock:
+        memory = _memories.get(store.path)
+        if memory is None:
+            memory = _memories[store.path] = LongTermMemory(store)
+        return memory
@@ -1,11 +1,19 @@
 # backend/llm/message_reply_advisor.py
-from .llm_client import call_llm
+from typing import AsyncIterator
+from .llm_client import call_llm, acall_llm, astream_llm
+from .context_manager import CONTEXT_TOKEN_BUDGET, trim_to_budget
+
+AGENT_NAME = "MessageReplyAdvisor"
 
 class MessageReplyAdvisor:
-    def suggest_reply(self, conversation_history: list, last_message: str) -> str:
+    def __init__(self, budget_tokens: int = CONTEXT_TOKEN_BUDGET):
+        # Сколько токенов истории показывать модели
+        self.budget_tokens = budget_tokens
+
+    def _build_prompt(self, conversation_history: list, last_message: str):
         context = "\n".join([
             f"Парень: {m['message']}" if m['role'] == 'user' else f"Девушка: {m['message']}"
-            for m in conversation_history[-10:]
+            for m in trim_to_budget(conversation_history, self.budget_tokens)
         ])
 
         system_instruction = f"""
@@ -19,4 +27,16 @@ class MessageReplyAdvisor:
         prompt = f"""
         Последнее сообщение от девушки: {last_message}
         """
-        return call_llm(prompt, system_instruction)
+        return prompt, system_instruction
+
+    def suggest_reply(self, conversation_history: list, last_message: str) -> str:
+        prompt, system_instruction = self._build_prompt(conversation_history, last_message)
+        return call_llm(prompt, system_instruction, agent=AGENT_NAME)
+
+    async def asuggest_reply(self, conversation_history: list, last_message: str) -> str:
+        prompt, system_instruction = self._build_prompt(conversation_history, last_message)
+        return await acall_llm(prompt, system_instruction, agent=AGENT_NAME)
+
+    def astream_reply(self, conversation_history: list, last_message: str) -> AsyncIterator[str]:
+        prompt, system_instruction = self._build_prompt(conversation_history, last_message)
+        return astream_llm(prompt, system_instruction, agent=AGENT_NAME)
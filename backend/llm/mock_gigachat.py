@@ -0,0 +1,281 @@
+"""
+Локальная замена GigaChat для нагрузочных тестов и разработки без квоты.
+
+Два варианта с общей моделью поведения (MockBehavior):
+  * MockGigaChat — клиент в процессе, тот же интерфейс, что у langchain GigaChat
+    (invoke/ainvoke/astream/upload_file/aupload_file). Включается LLM_BACKEND=mock.
+  * HTTP-сервер, повторяющий REST API GigaChat (/api/v2/oauth,
+    /api/v1/chat/completions, /api/v1/files). Настоящий клиент ходит в него,
+    если задать GIGACHAT_BASE_URL и GIGACHAT_AUTH_URL:
+        python -m backend.llm.mock_gigachat --port 8090
+        GIGACHAT_BASE_URL=http://127.0.0.1:8090/api/v1 \\
+        GIGACHAT_AUTH_URL=http://127.0.0.1:8090/api/v2/oauth GIGACHAT_TOKEN=bW9jaw== python app.py
+
+Задержка до первого токена распределена логнормально (медиана и sigma),
+дальше ответ идет со скоростью tokens_per_second. Ошибки 500/503 внедряются
+с вероятностью error_rate, «зависшие» вызовы — с вероятностью hang_rate,
+а при превышении rate_limit запросов в секунду возвращается 429.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+from typing import List, Optional
+
+WORDS = (
+    "конечно интересно расскажи подробнее мне нравится это звучит здорово кстати я тоже люблю "
+    "путешествия музыку кино книги кофе прогулки выходные вечером давай попробуем обязательно"
+).split()
+
+MOCK_URL = "http://mock-gigachat/api/v1/chat/completions"
+
+
+class MockBehavior:
+    """Задержки, скорость генерации, ошибки и лимит запросов заглушки"""
+
+    def __init__(self, latency_median: float = 0.5, latency_sigma: float = 0.4, tokens_per_second: float = 50,
+                 reply_words: int = 30, error_rate: float = 0.0, hang_rate: float = 0.0,
+                 rate_limit: float = 0.0, upload_latency: float = 0.2, seed: Optional[int] = None):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.tokens_per_second = tokens_per_second
+        self.reply_words = reply_words
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.rate_limit = rate_limit
+        self.upload_latency = upload_latency
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = rate_limit
+        self._refilled_at = time.monotonic()
+
+    @classmethod
+    def from_env(cls) -> "MockBehavior":
+        env = os.environ.get
+        return cls(
+            latency_median=float(env("MOCK_LLM_LATENCY_MEDIAN", 0.5)),
+            latency_sigma=float(env("MOCK_LLM_LATENCY_SIGMA", 0.4)),
+            tokens_per_second=float(env("MOCK_LLM_TOKENS_PER_SECOND", 50)),
+            reply_words=int(env("MOCK_LLM_REPLY_WORDS", 30)),
+            error_rate=float(env("MOCK_LLM_ERROR_RATE", 0)),
+            hang_rate=float(env("MOCK_LLM_HANG_RATE", 0)),
+            rate_limit=float(env("MOCK_LLM_RATE_LIMIT", 0)),
+            upload_latency=float(env("MOCK_LLM_UPLOAD_LATENCY", 0.2)),
+        )
+
+    def first_token_delay(self) -> float:
+        """Задержка до первого токена; для зависшего вызова — час"""
+        with self._lock:
+            if self._rng.random() < self.hang_rate:
+                return 3600.0
+            return self.latency_median * math.exp(self._rng.gauss(0, self.latency_sigma))
+
+    def failure(self) -> Optional[int]:
+        """HTTP-статус внедренной ошибки или None"""
+        with self._lock:
+            if self.rate_limit > 0:
+                now = time.monotonic()
+                self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled_at) * self.rate_limit)
+                self._refilled_at = now
+                if self._tokens < 1:
+                    return 429
+                self._tokens -= 1
+            if self._rng.random() < self.error_rate:
+                return self._rng.choice([500, 503])
+        return None
+
+    def reply(self, prompt: str) -> List[str]:
+        """Слова ответа; начало промпта попадает в ответ, чтобы разные запросы отличались"""
+        with self._lock:
+            words = [self._rng.choice(WORDS) for _ in range(self.reply_words)]
+        return prompt.split()[:3] + words
+
+    @property
+    def token_interval(self) -> float:
+        return 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+
+def _prompt(messages) -> str:
+    return " ".join(str(getattr(m, "content", m)) for m in messages[-1:])
+
+
+def _usage(messages, words) -> dict:
+    """usage_metadata как у langchain GigaChat; токены считаем по словам"""
+    prompt_tokens = sum(len(str(getattr(m, "content", m)).split()) for m in messages)
+    return {"input_tokens": prompt_tokens, "output_tokens": len(words), "total_tokens": prompt_tokens + len(words)}
+
+
+def _response_error(status: int):
+    from gigachat.exceptions import ResponseError
+
+    return ResponseError(MOCK_URL, status, b'{"message": "mock error"}', {})
+
+
+class _MockTokenClient:
+    """Аналог gigachat.GigaChat для прогрева провайдера"""
+
+    async def aget_token(self):
+        return SimpleNamespace(access_token=uuid.uuid4().hex, expires_at=(time.time() + 1800) * 1000)
+
+    async def aclose(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MockGigaChat:
+    """Клиент-заглушка с интерфейсом langchain GigaChat"""
+
+    def __init__(self, behavior: Optional[MockBehavior] = None):
+        self.behavior = behavior or MockBehavior.from_env()
+        self._client = _MockTokenClient()
+
+    def _check(self):
+        status = self.behavior.failure()
+        if status is not None:
+            raise _response_error(status)
+
+    async def ainvoke(self, messages):
+        self._check()
+        words = self.behavior.reply(_prompt(messages))
+        await asyncio.sleep(self.behavior.first_token_delay() + len(words) * self.behavior.token_interval)
+        return SimpleNamespace(content=" ".join(words), usage_metadata=_usage(messages, words))
+
+    def invoke(self, messages):
+        self._check()
+        words = self.behavior.reply(_prompt(messages))
+        time.sleep(self.behavior.first_token_delay() + len(words) * self.behavior.token_interval)
+        return SimpleNamespace(content=" ".join(words), usage_metadata=_usage(messages, words))
+
+    async def astream(self, messages):
+        self._check()
+        words = self.behavior.reply(_prompt(messages))
+        await asyncio.sleep(self.behavior.first_token_delay())
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.behavior.token_interval)
+            yield SimpleNamespace(content=word + " ", usage_metadata=None)
+        yield SimpleNamespace(content="", usage_metadata=_usage(messages, words))
+
+    async def aupload_file(self, file, purpose: str = "general"):
+        self._check()
+        await asyncio.sleep(self.behavior.upload_latency)
+        return SimpleNamespace(id_=uuid.uuid4().hex)
+
+    def upload_file(self, file, purpose: str = "general"):
+        self._check()
+        time.sleep(self.behavior.upload_latency)
+        return SimpleNamespace(id_=uuid.uuid4().hex)
+
+
+def create_app(behavior: Optional[MockBehavior] = None):
+    """FastAPI-приложение с подмножеством REST API GigaChat"""
+    from fastapi import FastAPI, Request, UploadFile
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    behavior = behavior or MockBehavior.from_env()
+    app = FastAPI(title="Mock GigaChat")
+
+    def _error(status: int) -> JSONResponse:
+        headers = {"Retry-After": "1"} if status == 429 else None
+        return JSONResponse(status_code=status, content={"status": status, "message": "mock error"}, headers=headers)
+
+    @app.post("/api/v2/oauth")
+    async def oauth():
+        return {"access_token": uuid.uuid4().hex, "expires_at": int((time.time() + 1800) * 1000)}
+
+    @app.post("/api/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        status = behavior.failure()
+        if status is not None:
+            return _error(status)
+        messages = body.get("messages") or [{}]
+        words = behavior.reply(messages[-1].get("content") or "")
+        model = body.get("model", "mock")
+        prompt_tokens = sum(len((m.get("content") or "").split()) for m in messages)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                 "total_tokens": prompt_tokens + len(words), "precached_prompt_tokens": 0}
+        delay = behavior.first_token_delay()
+
+        if not body.get("stream"):
+            await asyncio.sleep(delay + len(words) * behavior.token_interval)
+            return {
+                "choices": [{"message": {"role": "assistant", "content": " ".join(words)},
+                             "index": 0, "finish_reason": "stop"}],
+                "created": int(time.time()),
+                "model": model,
+                "object": "chat.completion",
+                "usage": usage,
+            }
+
+        async def events():
+            await asyncio.sleep(delay)
+            for i, word in enumerate(words):
+                if i:
+                    await asyncio.sleep(behavior.token_interval)
+                chunk = {
+                    "choices": [{"delta": {"role": "assistant", "content": word + " "}, "index": 0}],
+                    "created": int(time.time()),
+                    "model": model,
+                    "object": "chat.completion",
+                }
+                if i == len(words) - 1:
+                    chunk["choices"][0]["finish_reason"] = "stop"
+                    chunk["usage"] = usage
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/api/v1/files")
+    async def upload(file: UploadFile):
+        status = behavior.failure()
+        if status is not None:
+            return _error(status)
+        data = await file.read()
+        await asyncio.sleep(behavior.upload_latency)
+        return {
+            "id": uuid.uuid4().hex,
+            "object": "file",
+            "bytes": len(data),
+            "created_at": int(time.time()),
+            "filename": file.filename,
+            "purpose": "general",
+            "access_policy": "private",
+        }
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    defaults = MockBehavior.from_env()
+    parser.add_argument("--latency-median", type=float, default=defaults.latency_median)
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma)
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second)
+    parser.add_argument("--reply-words", type=int, default=defaults.reply_words)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--hang-rate", type=float, default=defaults.hang_rate)
+    parser.add_argument("--rate-limit", type=float, default=defaults.rate_limit)
+    parser.add_argument("--upload-latency", type=float, default=defaults.upload_latency)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    behavior = MockBehavior(args.latency_median, args.latency_sigma, args.tokens_per_second, args.reply_words,
+                            args.error_rate, args.hang_rate, args.rate_limit, args.upload_latency)
+    uvicorn.run(create_app(behavior), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+from typing import Dict, List
+
+from backend.storage.session_store import SessionStore
+
+from .robot_girl_agent import RobotGirlAgent
+
+DEFAULT_PERSONA = "anna"
+
+
+class UnknownPersonaError(Exception):
+    pass
+
+
+class Persona:
+    """Параметры персонажа RobotGirlAgent; один объект на персону, общий для всех ее сессий"""
+
+    def __init__(self, persona_id: str, name: str, age: int, interests: List[str], personality: str):
+        self.persona_id = persona_id
+        self.name = name
+        self.age = age
+        self.interests = interests
+        self.personality = personality
+
+    def session_id(self, user_id: str) -> str:
+        """Ключ диалога в хранилище; у персоны по умолчанию — прежний формат girl:<user>"""
+        if self.persona_id == DEFAULT_PERSONA:
+            return f"girl:{user_id}"
+        return f"girl:{self.persona_id}:{user_id}"
+
+    def create_agent(self, user_id: str, store: SessionStore) -> RobotGirlAgent:
+        return RobotGirlAgent(name=self.name, age=self.age, interests=self.interests,
+                              personality=self.personality, session_id=self.session_id(user_id), store=store)
+
+    def describe(self) -> Dict:
+        return {"id": self.persona_id, "name": self.name, "age": self.age,
+                "interests": self.interests, "personality": self.personality}
+
+
+PERSONAS: Dict[str, Persona] = {p.persona_id: p for p in [
+    Persona("anna", "Анна", 21, ["фотография", "путешествия", "чтение", "йога", "кулинария"], "дружелюбная"),
+    Persona("masha", "Маша", 24, ["танцы", "сериалы", "кошки", "настольные игры"], "игривая"),
+    Persona("vera", "Вера", 27, ["книги", "театр", "психология", "бег"], "серьезная"),
+    Persona("liza", "Лиза", 22, ["поэзия", "кино", "закаты", "путешествия"], "романтичная"),
+]}
+
+
+def get_persona(persona_id: str) -> Persona:
+    """
+    Raises:
+        UnknownPersonaError: если такой персоны нет
+    """
+    persona = PERSONAS.get(persona_id)
+    if persona is None:
+        raise UnknownPersonaError(f"Неизвестный персонаж: {persona_id}")
+    return persona
+
+
+def persona_session_id(persona_id: str, user_id: str) -> str:
+    """Ключ диалога пользователя с персоной в хранилище"""
+    return get_persona(persona_id).session_id(user_id)
@@ -0,0 +1,60 @@
+import os
+from typing import Dict
+
+from backend.media.image_preprocess import PREPROCESS_ENABLED, apreprocess_image, output_extension
+from backend.storage.photo_store import PhotoStore
+
+from .errors import LLMUpstreamError
+from .llm_client import adescribe_image, aupload_image
+
+
+async def prepare_photo(store: PhotoStore, record: Dict) -> Dict:
+    """
+    Уменьшенная копия без EXIF для GigaChat и превью для анкеты.
+    Если фото не удалось декодировать, работаем с оригиналом.
+    """
+    original = {"path": record["path"], "photo_url": f"/uploaded_photos/{record['filename']}"}
+    if not PREPROCESS_ENABLED:
+        return original
+    ext = output_extension()
+    path = store.derived_path(record["hash"], "prep", ext)
+    thumb_path = store.derived_path(record["hash"], "thumb", ext)
+    if not (os.path.exists(path) and os.path.exists(thumb_path)):
+        try:
+            await apreprocess_image(record["path"], path, thumb_path)
+        except Exception as e:
+            print(f"[ФОТО] Не удалось обработать {record['filename']}: {e}")
+            return original
+    return {"path": path, "photo_url": f"/uploaded_photos/{os.path.basename(thumb_path)}"}
+
+
+async def analyze_photo_record(store: PhotoStore, record: Dict) -> Dict:
+    """
+    Разбор фото из хранилища: готовый разбор берется из индекса, файл
+    загружается в GigaChat только если его id неизвестен или устарел.
+
+    Returns:
+        {"photo_feedback": ..., "photo_url": ...}
+    """
+    prepared = await prepare_photo(store, record)
+    photo_url = prepared["photo_url"]
+
+    # Это фото уже разбирали — не загружаем и не анализируем повторно
+    if record["feedback"]:
+        return {"photo_feedback": record["feedback"], "photo_url": photo_url}
+
+    file_id = record["file_id"]
+    feedback = None
+    if file_id:
+        try:
+            feedback = await adescribe_image(file_id)
+        except LLMUpstreamError as e:
+            # Файл мог пропасть из хранилища GigaChat — загрузим заново
+            print(f"[ФОТО] Не удалось разобрать {file_id}: {e}")
+    if feedback is None:
+        file_id = await aupload_image(prepared["path"])
+        store.set_file_id(record["hash"], file_id)
+        feedback = await adescribe_image(file_id)
+
+    store.set_feedback(record["hash"], feedback)
+    return {"photo_feedback": feedback, "photo_url": photo_url}
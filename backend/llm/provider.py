@@ -0,0 +1,157 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Optional
+
+from .errors import LLMNotConfiguredError
+from .resilience import LLM_TIMEOUT
+
+# Реализация клиента: gigachat — настоящий API (или его HTTP-заглушка по GIGACHAT_BASE_URL),
+# mock — заглушка в процессе (см. mock_gigachat)
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "gigachat")
+# За сколько секунд до истечения OAuth-токена обновлять его в фоне
+TOKEN_REFRESH_MARGIN = int(os.environ.get("GIGACHAT_TOKEN_REFRESH_MARGIN", 120))
+# Пауза перед повторной попыткой, если обновить токен не удалось
+TOKEN_RETRY_DELAY = 30
+
+
+class GigaChatProvider:
+    """
+    Владелец единственного клиента GigaChat в процессе.
+
+    Клиент (и тяжелые импорты langchain_gigachat) создается при первом
+    обращении, поэтому импорт агентов ничего не стоит, пока LLM не нужна.
+    Все агенты получают один и тот же экземпляр, а значит общий пул
+    HTTP-соединений. warm() заранее получает OAuth-токен и запускает фоновое
+    обновление токена до его истечения — первый запрос пользователя не ждет
+    обмена токена. Вызывается из lifespan FastAPI.
+    """
+
+    def __init__(self, backend: str = LLM_BACKEND, timeout: float = LLM_TIMEOUT):
+        self.backend = backend
+        self.timeout = timeout
+        self._client = None
+        self._lock = threading.Lock()
+        self._env_loaded = False
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._token_expires_at: Optional[float] = None
+
+    def _load_env(self):
+        if not self._env_loaded:
+            from dotenv import load_dotenv
+
+            load_dotenv(override=True)
+            self._env_loaded = True
+
+    @property
+    def model(self) -> str:
+        self._load_env()
+        return os.environ.get("GIGACHAT_MODEL", "GigaChat-2-Max")
+
+    def get(self):
+        """
+        Клиент langchain GigaChat, созданный при первом вызове.
+
+        Raises:
+            LLMNotConfiguredError: если клиент не удалось создать
+        """
+        with self._lock:
+            if self._client is None:
+                self._load_env()
+                factory = BACKENDS.get(self.backend)
+                if factory is None:
+                    raise LLMNotConfiguredError(f"Неизвестный LLM_BACKEND: {self.backend}")
+                try:
+                    self._client = factory(self)
+                except Exception as e:
+                    print(f"[ОШИБКА GigaChat Init] {e}")
+                    raise LLMNotConfiguredError("Клиент GigaChat не инициализирован") from e
+            return self._client
+
+    def set_client(self, client):
+        """Подменяет клиент (например, тестовым); фоновое обновление токена к нему не применяется"""
+        with self._lock:
+            self._client = client
+
+    async def _refresh_token(self):
+        token = await self.get()._client.aget_token()
+        if token is None:
+            raise LLMNotConfiguredError("Не задан GIGACHAT_TOKEN")
+        # expires_at в ответе GigaChat — миллисекунды unix-времени
+        self._token_expires_at = token.expires_at / 1000
+
+    async def _refresh_loop(self):
+        while True:
+            delay = self._token_expires_at - TOKEN_REFRESH_MARGIN - time.time()
+            await asyncio.sleep(max(1.0, delay))
+            try:
+                await self._refresh_token()
+            except Exception as e:
+                print(f"[GigaChat] Не удалось обновить токен: {e}")
+                self._token_expires_at = time.time() + TOKEN_REFRESH_MARGIN + TOKEN_RETRY_DELAY
+
+    async def warm(self) -> bool:
+        """
+        Создает клиент, получает токен и запускает его фоновое обновление.
+        Ошибки не пробрасываются: приложение должно стартовать и без GigaChat.
+
+        Returns:
+            True, если токен получен
+        """
+        start = time.perf_counter()
+        try:
+            self.get()
+            await self._refresh_token()
+        except Exception as e:
+            print(f"[GigaChat] Прогрев не удался, токен будет получен при первом запросе: {e}")
+            return False
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+        print(f"[GigaChat] Клиент и токен готовы за {(time.perf_counter() - start) * 1000:.0f} мс")
+        return True
+
+    async def aclose(self):
+        """Останавливает обновление токена и закрывает HTTP-соединения"""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        with self._lock:
+            client, self._client = self._client, None
+        api = getattr(client, "_client", None) if client is not None else None
+        if api is not None and hasattr(api, "aclose"):
+            await api.aclose()
+            api.close()
+
+
+def _gigachat_client(provider: GigaChatProvider):
+    from langchain_gigachat.chat_models import GigaChat
+
+    return GigaChat(credentials=os.environ.get("GIGACHAT_TOKEN"), verify_ssl_certs=False,
+                    model=provider.model, timeout=provider.timeout)
+
+
+def _mock_client(provider: GigaChatProvider):
+    from .mock_gigachat import MockGigaChat
+
+    return MockGigaChat()
+
+
+# Фабрики клиентов по значению LLM_BACKEND; клиент должен поддерживать
+# invoke/ainvoke/astream/upload_file/aupload_file, как langchain GigaChat
+BACKENDS = {
+    "gigachat": _gigachat_client,
+    "mock": _mock_client,
+}
+
+_provider: Optional[GigaChatProvider] = None
+_provider_lock = threading.Lock()
+
+
+def get_provider() -> GigaChatProvider:
+    """Общий для процесса провайдер клиента GigaChat"""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = GigaChatProvider()
+        return _provider
@@ -0,0 +1,315 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, TypeVar
+
+from tenacity import AsyncRetrying, Retrying, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+
+from .errors import LLMCircuitOpenError, LLMError, LLMTimeoutError, LLMUpstreamError
+from .scheduler import LLMScheduler, get_scheduler
+
+T = TypeVar("T")
+
+# Дедлайн одной попытки; для стрима — время до первого куска ответа
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 30))
+# Сколько стрим может молчать между кусками ответа
+LLM_STREAM_IDLE_TIMEOUT = float(os.environ.get("LLM_STREAM_IDLE_TIMEOUT", 15))
+LLM_MAX_ATTEMPTS = int(os.environ.get("LLM_MAX_ATTEMPTS", 3))
+LLM_RETRY_INITIAL = float(os.environ.get("LLM_RETRY_INITIAL", 0.5))
+LLM_RETRY_MAX = float(os.environ.get("LLM_RETRY_MAX", 8))
+# Дублирующий запрос, если первый не ответил за p95 недавних вызовов
+LLM_HEDGE_ENABLED = os.environ.get("LLM_HEDGE_ENABLED", "0") == "1"
+LLM_HEDGE_MIN_DELAY = float(os.environ.get("LLM_HEDGE_MIN_DELAY", 1))
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", 5))
+LLM_BREAKER_COOLDOWN = float(os.environ.get("LLM_BREAKER_COOLDOWN", 30))
+
+
+def to_llm_error(exc: BaseException) -> LLMError:
+    """Переводит исключение клиента GigaChat в типизированную ошибку приложения"""
+    if isinstance(exc, LLMError):
+        return exc
+    # Импорт здесь: модуль gigachat тяжелый, а ошибка — редкий путь
+    import httpx
+    from gigachat.exceptions import AuthenticationError, ResponseError
+
+    if isinstance(exc, (asyncio.TimeoutError, httpx.TimeoutException)):
+        return LLMTimeoutError("GigaChat не ответил вовремя")
+    if isinstance(exc, AuthenticationError):
+        return LLMUpstreamError("Ошибка авторизации в GigaChat", upstream_status=401)
+    if isinstance(exc, ResponseError):
+        status = exc.args[1] if len(exc.args) > 1 and isinstance(exc.args[1], int) else None
+        retryable = status is None or status == 429 or status >= 500
+        return LLMUpstreamError(f"GigaChat вернул ошибку {status}", upstream_status=status, retryable=retryable)
+    if isinstance(exc, httpx.TransportError):
+        return LLMUpstreamError(f"Нет соединения с GigaChat: {exc}", retryable=True)
+    return LLMUpstreamError(f"Ошибка вызова GigaChat: {exc}")
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    return isinstance(exc, LLMError) and exc.retryable
+
+
+class LatencyTracker:
+    """Скользящее окно длительностей успешных вызовов"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self._samples = deque(maxlen=window)
+        self._min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Перцентиль окна или None, пока наблюдений слишком мало"""
+        with self._lock:
+            if len(self._samples) < self._min_samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class CircuitBreaker:
+    """
+    Размыкается после failure_threshold сбоев подряд и cooldown секунд сразу
+    отклоняет вызовы. Затем пропускает один пробный вызов: успех замыкает цепь,
+    сбой снова размыкает ее.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Raises:
+            LLMCircuitOpenError: если цепь разомкнута
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            now = time.monotonic()
+            remaining = self._opened_at + self.cooldown - now
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN
+            # Пробный вызов, не отчитавшийся за cooldown (отменен, отклонен очередью), не считается
+            if self.state == self.HALF_OPEN and (
+                    self._probe_started is None or now - self._probe_started > self.cooldown):
+                self._probe_started = now
+                return
+            raise LLMCircuitOpenError("GigaChat временно недоступен", retry_after=max(1, int(remaining) + 1))
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_started = None
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class ResilientCaller:
+    """
+    Обертка вызовов GigaChat: слот планировщика, дедлайн на попытку, повторы
+    с экспоненциальной задержкой и джиттером, необязательный хеджированный
+    запрос и circuit breaker. Наружу выходят только исключения LLMError.
+    """
+
+    def __init__(self, scheduler: Optional[LLMScheduler] = None, breaker: Optional[CircuitBreaker] = None,
+                 timeout: float = LLM_TIMEOUT, stream_idle_timeout: float = LLM_STREAM_IDLE_TIMEOUT,
+                 max_attempts: int = LLM_MAX_ATTEMPTS, hedge: bool = LLM_HEDGE_ENABLED,
+                 hedge_min_delay: float = LLM_HEDGE_MIN_DELAY):
+        self.scheduler = scheduler
+        self.breaker = breaker or CircuitBreaker()
+        self.timeout = timeout
+        self.stream_idle_timeout = stream_idle_timeout
+        self.max_attempts = max_attempts
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.latency = LatencyTracker()
+        self._stats = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "failures": 0}
+        self._stats_lock = threading.Lock()
+
+    def _scheduler(self) -> LLMScheduler:
+        return self.scheduler or get_scheduler()
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def _retry_kwargs(self, retry=_is_retryable) -> Dict:
+        return {
+            "stop": stop_after_attempt(self.max_attempts),
+            "wait": wait_exponential_jitter(initial=LLM_RETRY_INITIAL, max=LLM_RETRY_MAX),
+            "retry": retry_if_exception(retry),
+            "before_sleep": lambda _: self._count("retries"),
+            "reraise": True,
+        }
+
+    def _record(self, started: float, error: Optional[LLMError] = None):
+        if error is not None and error.retryable:
+            # Размыкаем цепь только на сбоях самого GigaChat, а не на ошибках запроса
+            self._count("failures")
+            self.breaker.record_failure()
+            return
+        if error is None:
+            self.latency.record(time.monotonic() - started)
+        self.breaker.record_success()
+
+    async def _once(self, call: Callable[[], Awaitable[T]], admitted: Optional[asyncio.Event] = None) -> T:
+        async with self._scheduler().slot():
+            if admitted is not None:
+                admitted.set()
+            started = time.monotonic()
+            try:
+                result = await asyncio.wait_for(call(), self.timeout)
+            except Exception as e:
+                error = to_llm_error(e)
+                self._record(started, error)
+                raise error from e
+            self._record(started)
+            return result
+
+    async def _hedged(self, call: Callable[[], Awaitable[T]]) -> T:
+        p95 = self.latency.percentile(0.95)
+        if p95 is None:
+            return await self._once(call)
+        # Время до хеджа отсчитываем с момента, когда первый запрос вышел из очереди планировщика
+        admitted = asyncio.Event()
+        first = asyncio.ensure_future(self._once(call, admitted))
+        admitted_wait = asyncio.ensure_future(admitted.wait())
+        tasks = [first, admitted_wait]
+        try:
+            await asyncio.wait({first, admitted_wait}, return_when=asyncio.FIRST_COMPLETED)
+            admitted_wait.cancel()
+            if not first.done():
+                await asyncio.wait({first}, timeout=max(self.hedge_min_delay, p95))
+            if first.done():
+                return first.result()
+
+            self._count("hedges")
+            second = asyncio.ensure_future(self._once(call))
+            tasks.append(second)
+            pending = {first, second}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # И при выигрыше, и при отмене самого вызова (разрыв соединения, wait_for,
+            # отмена совета) оставшиеся запросы отменяются и дожидаются, чтобы сразу
+            # освободить слоты планировщика; ошибки проигравших забираются gather
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def acall(self, call: Callable[[], Awaitable[T]], hedge: bool = False) -> T:
+        """
+        Выполняет корутину call() с повторами. hedge=True разрешает дублирующий
+        запрос — только для идемпотентных вызовов.
+
+        Raises:
+            LLMError: если вызов не удался после всех попыток
+        """
+        self.breaker.before_call()
+        self._count("calls")
+        attempt_once = self._hedged if hedge and self.hedge else self._once
+        async for attempt in AsyncRetrying(**self._retry_kwargs()):
+            with attempt:
+                return await attempt_once(call)
+
+    def call(self, call: Callable[[], T]) -> T:
+        """
+        Синхронная версия acall (без хеджирования). Дедлайн задает таймаут
+        HTTP-клиента GigaChat.
+        """
+        self.breaker.before_call()
+        self._count("calls")
+        for attempt in Retrying(**self._retry_kwargs()):
+            with attempt:
+                with self._scheduler().slot_sync():
+                    started = time.monotonic()
+                    try:
+                        result = call()
+                    except Exception as e:
+                        error = to_llm_error(e)
+                        self._record(started, error)
+                        raise error from e
+                    self._record(started)
+                    return result
+
+    async def astream(self, open_stream: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+        """
+        Стрим с дедлайном на первый кусок и на паузы между кусками. Повтор
+        возможен, только пока клиенту еще ничего не отдано.
+        """
+        self.breaker.before_call()
+        self._count("calls")
+        started_output = False
+        retry = lambda e: not started_output and _is_retryable(e)
+        async for attempt in AsyncRetrying(**self._retry_kwargs(retry)):
+            with attempt:
+                async with self._scheduler().slot():
+                    started = time.monotonic()
+                    stream = open_stream()
+                    timeout = self.timeout
+                    try:
+                        while True:
+                            try:
+                                chunk = await asyncio.wait_for(stream.__anext__(), timeout)
+                            except StopAsyncIteration:
+                                break
+                            started_output = True
+                            timeout = self.stream_idle_timeout
+                            yield chunk
+                    except Exception as e:
+                        error = to_llm_error(e)
+                        self._record(started, error)
+                        raise error from e
+                    finally:
+                        await stream.aclose()
+                    self._record(started)
+                    return
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        p95 = self.latency.percentile(0.95)
+        stats["latency_p95"] = round(p95, 3) if p95 is not None else None
+        stats["breaker_state"] = self.breaker.state
+        return stats
+
+
+_caller: Optional[ResilientCaller] = None
+_caller_lock = threading.Lock()
+
+
+def get_resilient_caller() -> ResilientCaller:
+    """Общая для процесса обертка вызовов GigaChat (одно окно задержек и один breaker)"""
+    global _caller
+    with _caller_lock:
+        if _caller is None:
+            _caller = ResilientCaller()
+        return _caller
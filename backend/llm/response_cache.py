@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from backend.storage.sqlite import ThreadLocalConnections
+
+DEFAULT_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "data/llm_cache.db")
+DEFAULT_TTL_SECONDS = int(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600))
+DEFAULT_MEMORY_ENTRIES = int(os.environ.get("LLM_CACHE_MEMORY_ENTRIES", 1024))
+DEFAULT_DISK_ENTRIES = int(os.environ.get("LLM_CACHE_DISK_ENTRIES", 50_000))
+
+
+def normalize_text(text: str) -> str:
+    """Схлопывает пробельные символы, чтобы косметические отличия не ломали попадания в кэш"""
+    return " ".join(text.split())
+
+
+class ResponseCache:
+    """
+    Двухуровневый кэш ответов LLM: LRU в памяти процесса и SQLite на диске.
+
+    Ключ — хэш от нормализованного промпта, системной инструкции и имени модели.
+    Записи вытесняются по TTL и по количеству (из памяти — LRU, с диска — самые
+    давно использованные). Дисковый уровень переживает перезапуск и общий для
+    всех воркеров.
+    """
+
+    # Как часто (в записях) чистить дисковый уровень от просроченных и лишних строк
+    PRUNE_EVERY = 256
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl_seconds: int = DEFAULT_TTL_SECONDS,
+                 max_memory_entries: int = DEFAULT_MEMORY_ENTRIES,
+                 max_disk_entries: int = DEFAULT_DISK_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = ThreadLocalConnections(path).get
+        self._writes = 0
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "sets": 0, "evictions": 0}
+
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn().execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses (last_access)")
+
+    @staticmethod
+    def make_key(prompt_text: str, system_instruction: str, model: str) -> str:
+        payload = "\x1f".join([model, normalize_text(system_instruction), normalize_text(prompt_text)])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        value = self._memory_get(key, now)
+        if value is not None:
+            return value
+        return self._disk_get(key, now)
+
+    async def aget(self, key: str) -> Optional[str]:
+        """
+        Асинхронная версия get: LRU-уровень проверяется сразу, а дисковый — в
+        потоке (обновление last_access может ждать блокировку другого воркера)
+        """
+        now = time.time()
+        value = self._memory_get(key, now)
+        if value is not None:
+            return value
+        return await asyncio.to_thread(self._disk_get, key, now)
+
+    def _memory_get(self, key: str, now: float) -> Optional[str]:
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+        return None
+
+    def _disk_get(self, key: str, now: float) -> Optional[str]:
+        row = self._conn().execute(
+            "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None and row["created_at"] + self.ttl_seconds > now:
+            self._conn().execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            with self._lock:
+                self._stats["disk_hits"] += 1
+                self._remember(key, row["value"], row["created_at"] + self.ttl_seconds)
+            return row["value"]
+        if row is not None:
+            self._conn().execute("DELETE FROM responses WHERE key = ?", (key,))
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO responses (key, value, created_at, last_access) VALUES (?, ?, ?, ?)",
+            (key, value, now, now),
+        )
+        with self._lock:
+            self._stats["sets"] += 1
+            self._remember(key, value, now + self.ttl_seconds)
+            self._writes += 1
+            prune = self._writes % self.PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    async def aset(self, key: str, value: str):
+        """Асинхронная версия set"""
+        await asyncio.to_thread(self.set, key, value)
+
+    def _remember(self, key: str, value: str, expires_at: float):
+        """Кладет запись в LRU-уровень (вызывается под self._lock)"""
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def prune(self):
+        """Удаляет с диска просроченные записи и самые старые сверх лимита"""
+        conn = self._conn()
+        conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,),
+        )
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        self._conn().execute("DELETE FROM responses")
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        total = hits + stats["misses"]
+        stats["hit_rate"] = hits / total if total else 0.0
+        return stats
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Общий для процесса кэш ответов по пути из LLM_CACHE_PATH"""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache()
+        return _response_cache
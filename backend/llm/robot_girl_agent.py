@@ -1,13 +1,22 @@
-from .llm_client import call_llm
-import json
+from .llm_client import call_llm, acall_llm, astream_llm
+from .context_manager import ContextManager
+from .long_term_memory import get_long_term_memory
+from backend.storage.session_store import SessionStore, get_default_store
+import asyncio
 import os
 from datetime import datetime
-from typing import List, Dict
+from typing import AsyncIterator, List, Dict, Optional, Tuple
+
+AGENT_NAME = "RobotGirlAgent"
+
+# Системные промпты по параметрам персонажа: одна строка на персону, общая для всех ее сессий
+_system_prompts: Dict[tuple, str] = {}
 
 
 class RobotGirlAgent:
     def __init__(self, name: str = "Анна", age: int = 21, interests: List[str] = None,
-                 personality: str = "дружелюбная"):
+                 personality: str = "дружелюбная", session_id: str = None,
+                 store: SessionStore = None):
         """
         Инициализация агента женщины для дейтинг приложения
 
@@ -16,6 +25,9 @@ class RobotGirlAgent:
             age: Возраст
             interests: Список интересов
             personality: Тип личности (дружелюбная, игривая, серьезная, романтичная)
+            session_id: Ключ сессии в хранилище (по умолчанию — имя персонажа; только
+                у такой сессии есть старый JSON-файл памяти, см. _load_memory)
+            store: Хранилище истории диалогов (по умолчанию — общее для процесса)
         """
         self.name = name
         self.age = age
@@ -23,14 +35,31 @@ class RobotGirlAgent:
         self.personality = personality
 
         # Память диалогов
-        self.conversation_history: List[Dict] = []
-        self.memory_file = f"conversation_memory_{name.lower()}.json"
-
-        # Загружаем историю из файла, если существует
-        self._load_memory()
+        self.session_id = session_id or name.lower()
+        # Сессия по умолчанию (CLI, chat_loop) — единственная, к которой относится старый JSON-файл
+        self._legacy_session = session_id is None
+        self.store = store or get_default_store()
+        self.context = ContextManager(self.store, self.session_id,
+                                      speaker_names={"user": "Парень", "assistant": self.name})
+        self.long_term_memory = get_long_term_memory(self.store)
+        # История из старого JSON-файла переносится при первом обращении к памяти (только в сессии по умолчанию)
+        self._memory_loaded = False
+        # Есть сообщения, еще не попавшие в индекс долговременной памяти (см. flush)
+        self._unindexed = True
 
         # Системный промпт
-        self.system_prompt = self._create_system_prompt()
+        self.system_prompt = self._shared_system_prompt()
+
+    @property
+    def memory_file(self) -> str:
+        return f"conversation_memory_{self.name.lower()}.json"
+
+    def _shared_system_prompt(self) -> str:
+        key = (self.name, self.age, tuple(self.interests), self.personality)
+        prompt = _system_prompts.get(key)
+        if prompt is None:
+            prompt = _system_prompts.setdefault(key, self._create_system_prompt())
+        return prompt
 
     def _create_system_prompt(self) -> str:
         """Создает системный промпт для персонажа"""
@@ -67,48 +96,139 @@ class RobotGirlAgent:
 ВАЖНО: Ты настоящая девушка с чувствами и эмоциями. Веди себя естественно!"""
 
     def _load_memory(self):
-        """Загружает историю разговора из файла"""
-        if os.path.exists(self.memory_file):
-            try:
-                with open(self.memory_file, 'r', encoding='utf-8') as f:
-                    self.conversation_history = json.load(f)
-                print(f"[ПАМЯТЬ] Загружено {len(self.conversation_history)} сообщений из памяти")
-            except Exception as e:
-                print(f"[ОШИБКА] Не удалось загрузить память: {e}")
-                self.conversation_history = []
+        """
+        Импортирует историю из старого JSON-файла памяти в хранилище (один раз за жизнь агента).
 
-    def _save_memory(self):
-        """Сохраняет историю разговора в файл"""
+        Старый файл — одна общая память на персонажа, без пользователя, поэтому
+        он переносится только в сессию по умолчанию, которой пользуется CLI
+        (chat_loop). Сессии API (girl:<пользователь>) его не получают: иначе
+        чужая переписка досталась бы каждому новому пользователю.
+        """
+        if self._memory_loaded:
+            return
+        self._memory_loaded = True
+        if not self._legacy_session or not os.path.exists(self.memory_file):
+            return
+        if self.store.count(self.session_id) > 0:
+            return
         try:
-            with open(self.memory_file, 'w', encoding='utf-8') as f:
-                json.dump(self.conversation_history, f, ensure_ascii=False, indent=2)
+            imported = self.store.import_json(self.session_id, self.memory_file)
+            print(f"[ПАМЯТЬ] Импортировано {imported} сообщений из {self.memory_file}")
         except Exception as e:
-            print(f"[ОШИБКА] Не удалось сохранить память: {e}")
+            print(f"[ОШИБКА] Не удалось загрузить память: {e}")
 
-    def _add_to_memory(self, role: str, message: str):
-        """Добавляет сообщение в память"""
-        self.conversation_history.append({
+    async def _aload_memory(self):
+        """_load_memory в потоке хранилища"""
+        if not self._memory_loaded:
+            await self.store.arun(self._load_memory)
+
+    @property
+    def conversation_history(self) -> List[Dict]:
+        """Вся история разговора (читается из хранилища целиком)"""
+        self._load_memory()
+        return self.store.history(self.session_id)
+
+    @staticmethod
+    def _make_entry(role: str, message: str) -> Dict:
+        return {
             "role": role,
             "message": message,
             "timestamp": datetime.now().isoformat()
-        })
-        self._save_memory()
+        }
 
-    def _get_conversation_context(self) -> str:
-        """Формирует контекст разговора из истории"""
-        if not self.conversation_history:
-            return "Это начало вашего разговора."
+    def context_messages(self) -> List[Dict]:
+        """Несжатый хвост разговора, который идет в промпт дословно"""
+        self._load_memory()
+        return self.context.recent()
 
-        context = "ИСТОРИЯ РАЗГОВОРА:\n"
-        # Берем последние 10 сообщений для контекста
-        recent_messages = self.conversation_history[-10:]
+    async def acontext_messages(self) -> List[Dict]:
+        """Асинхронная версия context_messages"""
+        await self._aload_memory()
+        return await self.context.arecent()
+
+    def _add_to_memory(self, role: str, message: str, timestamp: str = None) -> Dict:
+        """Добавляет сообщение в память"""
+        self._load_memory()
+        entry = self.context.add(role, message, timestamp)
+        self._unindexed = True
+        return entry
+
+    async def _aadd_to_memory(self, role: str, message: str, timestamp: str = None) -> Dict:
+        """Асинхронная версия _add_to_memory"""
+        await self._aload_memory()
+        entry = await self.context.aadd(role, message, timestamp)
+        self._unindexed = True
+        return entry
+
+    def flush(self):
+        """
+        Дописывает в индекс долговременной памяти сообщения, добавленные после
+        прошлого поиска. Индекс нужен только для сообщений старше последних,
+        поэтому индексация откладывается до следующего поиска или до
+        вытеснения агента из пула.
+        """
+        if self._unindexed:
+            # Флаг снимается до индексации: сообщение, добавленное во время нее
+            # (flush идет в потоке), снова поднимет его
+            self._unindexed = False
+            try:
+                self.long_term_memory.index_new(self.session_id)
+            except BaseException:
+                self._unindexed = True
+                raise
+
+    def _recall(self, user_message: str, recent: List[Dict]) -> List[Dict]:
+        """Старые сообщения, релевантные новому, которых нет в последних"""
+        self.flush()
+        before_id = recent[0]["id"] if recent else None
+        return self.long_term_memory.search(self.session_id, user_message, before_id=before_id)
+
+    async def _arecall(self, user_message: str, recent: List[Dict]) -> List[Dict]:
+        """
+        _recall в потоке: транзакция индекса может ждать блокировку базы, занятую
+        другим процессом, а поиск по большому индексу занимает миллисекунды —
+        ни то, ни другое не должно держать event loop
+        """
+        return await asyncio.to_thread(self._recall, user_message, recent)
+
+    def _format_messages(self, messages: List[Dict]) -> str:
+        return "".join(
+            f"{'Парень' if msg['role'] == 'user' else self.name}: {msg['message']}\n" for msg in messages
+        )
+
+    def _get_conversation_context(self, summary: str, recent: List[Dict], pending: List[Dict] = None,
+                                  recalled: List[Dict] = None) -> str:
+        """Формирует контекст разговора: конспект, вспомненные старые сообщения и последние сообщения"""
+        recent_messages = recent + (pending or [])
+        if not recent_messages and not summary:
+            return "Это начало вашего разговора."
 
-        for msg in recent_messages:
-            role_name = "Парень" if msg["role"] == "user" else self.name
-            context += f"{role_name}: {msg['message']}\n"
+        context = ""
+        if summary:
+            context += f"КРАТКО О ЧЕМ ВЫ ГОВОРИЛИ РАНЬШЕ:\n{summary}\n\n"
+        if recalled:
+            context += f"ИЗ ДАВНИХ СООБЩЕНИЙ (ПО ТЕМЕ):\n{self._format_messages(recalled)}\n"
+        context += "ИСТОРИЯ РАЗГОВОРА:\n"
+        context += self._format_messages(recent_messages)
 
         return context
 
+    def _build_prompt(self, user_message: str, summary: str, recent: List[Dict],
+                      pending: List[Dict] = None, recalled: Optional[List[Dict]] = None) -> str:
+        """
+        Формирует промпт с контекстом разговора для нового сообщения.
+        recalled — заранее найденные давние сообщения (иначе ищутся здесь же).
+        """
+        if recalled is None:
+            recalled = self._recall(user_message, recent)
+        conversation_context = self._get_conversation_context(summary, recent, pending, recalled)
+
+        return f"""{conversation_context}
+
+НОВОЕ СООБЩЕНИЕ ОТ ПАРНЯ: {user_message}
+
+Ответь как {self.name}, учитывая всю историю разговора выше."""
+
     def respond_to_message(self, user_message: str) -> str:
         """
         Отвечает на сообщение пользователя
@@ -119,34 +239,82 @@ class RobotGirlAgent:
         Returns:
             Ответ девушки
         """
-        # Добавляем сообщение пользователя в память
-        self._add_to_memory("user", user_message)
-
-        # Формируем контекст
-        conversation_context = self._get_conversation_context()
+        # Сообщение пользователя сохраняется вместе с ответом: при ошибке LLM
+        # в истории не остается реплики без ответа
+        self._load_memory()
+        user_entry = self._make_entry("user", user_message)
 
         # Создаем промпт с контекстом
-        prompt = f"""{conversation_context}
-
-НОВОЕ СООБЩЕНИЕ ОТ ПАРНЯ: {user_message}
-
-Ответь как {self.name}, учитывая всю историю разговора выше."""
+        summary, recent = self.context.build()
+        prompt = self._build_prompt(user_message, summary, recent, pending=[user_entry])
 
         # Получаем ответ от LLM
-        response = call_llm(prompt, self.system_prompt)
+        response = call_llm(prompt, self.system_prompt, use_cache=False, agent=AGENT_NAME)
 
-        # Добавляем ответ в память
+        # Добавляем обе реплики в память
+        self._add_to_memory("user", user_message, user_entry["timestamp"])
         self._add_to_memory("assistant", response)
 
         return response
 
+    async def arespond_to_message(self, user_message: str) -> Tuple[str, int]:
+        """
+        Асинхронная версия respond_to_message.
+
+        Returns:
+            (ответ девушки, id ответа в хранилище) — к id привязывается совет
+            MessageReplyAdvisor; агент общий для запросов сессии, поэтому id
+            возвращается каждому вызову, а не хранится в агенте
+        """
+        await self._aload_memory()
+        user_entry = self._make_entry("user", user_message)
+        summary, recent = await self.context.abuild()
+        recalled = await self._arecall(user_message, recent)
+        prompt = self._build_prompt(user_message, summary, recent, pending=[user_entry], recalled=recalled)
+        response = await acall_llm(prompt, self.system_prompt, use_cache=False, agent=AGENT_NAME)
+        await self._aadd_to_memory("user", user_message, user_entry["timestamp"])
+        return response, (await self._aadd_to_memory("assistant", response))["id"]
+
+    async def astream_response(self, user_message: str, saved: Optional[Dict] = None) -> AsyncIterator[str]:
+        """
+        Потоковая версия respond_to_message.
+
+        Оба сообщения попадают в память только после того, как ответ сгенерирован
+        полностью: оборванный стрим не оставляет в истории половину реплики.
+        В словарь saved (если передан) кладется сохраненная запись ответа, в том
+        числе ее id.
+        """
+        await self._aload_memory()
+        user_entry = self._make_entry("user", user_message)
+        summary, recent = await self.context.abuild()
+        recalled = await self._arecall(user_message, recent)
+        prompt = self._build_prompt(user_message, summary, recent, pending=[user_entry], recalled=recalled)
+        chunks = []
+        async for chunk in astream_llm(prompt, self.system_prompt, use_cache=False, agent=AGENT_NAME):
+            chunks.append(chunk)
+            yield chunk
+        await self._aadd_to_memory("user", user_message, user_entry["timestamp"])
+        entry = await self._aadd_to_memory("assistant", "".join(chunks).strip())
+        if saved is not None:
+            saved.update(entry)
+
     def clear_memory(self):
         """Очищает память разговора"""
-        self.conversation_history = []
-        if os.path.exists(self.memory_file):
+        self.store.clear(self.session_id)
+        self.long_term_memory.clear(self.session_id)
+        if self._legacy_session and os.path.exists(self.memory_file):
             os.remove(self.memory_file)
         print(f"[ПАМЯТЬ] Память {self.name} очищена")
 
+    def get_conversation_stats(self) -> Dict[str, int]:
+        """Статистика разговора"""
+        self._load_memory()
+        return {
+            "total_messages": self.store.count(self.session_id),
+            "user_messages": self.store.count(self.session_id, "user"),
+            "assistant_messages": self.store.count(self.session_id, "assistant"),
+        }
+
     def __str__(self):
         return f"RobotGirlAgent(name='{self.name}', age={self.age}, personality='{self.personality}')"
 
@@ -168,7 +336,7 @@ class RobotGirlAgent:
                 if user_input.lower() in ["пока", "bye", "exit", "quit"]:
                     # Генерируем прощальное сообщение
                     farewell_prompt = f"Парень прощается с тобой, написав: '{user_input}'. Попрощайся с ним тепло и мило, как {self.name}."
-                    farewell_response = call_llm(farewell_prompt, self.system_prompt)
+                    farewell_response = call_llm(farewell_prompt, self.system_prompt, use_cache=False)
                     print(f"💕 {self.name}: {farewell_response}")
 
                     # Сохраняем прощальные сообщения в память
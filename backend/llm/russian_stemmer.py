@@ -0,0 +1,106 @@
+import re
+from functools import lru_cache
+from typing import List
+
+# Алгоритм Snowball для русского языка (https://snowballstem.org/algorithms/russian/stemmer.html).
+# Полноценная лемматизация требует словаря, а для поиска по истории переписки
+# достаточно сводить словоформы к общей основе.
+
+VOWELS = "аеиоуыэюя"
+
+PERFECTIVE_GERUND = re.compile(r"((?<=[ая])(в|вши|вшись)|(ив|ивши|ившись|ыв|ывши|ывшись))$")
+REFLEXIVE = re.compile(r"(ся|сь)$")
+ADJECTIVE = r"(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)"
+PARTICIPLE = r"((?<=[ая])(ем|нн|вш|ющ|щ)|(ивш|ывш|ующ))"
+ADJECTIVAL = re.compile(rf"({PARTICIPLE}?{ADJECTIVE})$")
+VERB = re.compile(
+    r"((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)|"
+    r"(ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю))$"
+)
+NOUN = re.compile(
+    r"(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$"
+)
+SUPERLATIVE = re.compile(r"(ейше|ейш)$")
+DERIVATIONAL = re.compile(r"(ость|ост)$")
+
+WORD_RE = re.compile(r"[а-яёa-z0-9]+")
+
+STOPWORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было вот
+от меня еще нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до вас нибудь опять
+уж вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их чем была сам чтоб без
+будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой совсем ним здесь этом один
+почти мой тем чтобы нее сейчас были куда зачем всех никогда можно при наконец два об другой хоть после
+над больше тот через эти нас про всего них какая много разве три эту моя впрочем хорошо свою этой перед
+иногда лучше чуть том нельзя такой им более всегда конечно всю между это мы ты тебе меня
+""".split())
+
+
+def _regions(word: str):
+    """Границы областей RV и R2 (индексы начала)"""
+    rv = len(word)
+    for i, ch in enumerate(word):
+        if ch in VOWELS:
+            rv = i + 1
+            break
+
+    def next_region(start):
+        for i in range(start + 1, len(word)):
+            if word[i] not in VOWELS and word[i - 1] in VOWELS:
+                return i + 1
+        return len(word)
+
+    r1 = next_region(0)
+    r2 = next_region(r1)
+    return rv, r2
+
+
+def _strip(rv_part: str, pattern: re.Pattern):
+    match = pattern.search(rv_part)
+    if match is None:
+        return rv_part, False
+    return rv_part[:match.start()], True
+
+
+@lru_cache(maxsize=100_000)
+def stem(word: str) -> str:
+    word = word.lower().replace("ё", "е")
+    rv, r2 = _regions(word)
+    prefix, rv_part = word[:rv], word[rv:]
+
+    # Шаг 1
+    rv_part, found = _strip(rv_part, PERFECTIVE_GERUND)
+    if not found:
+        rv_part, _ = _strip(rv_part, REFLEXIVE)
+        rv_part, found = _strip(rv_part, ADJECTIVAL)
+        if not found:
+            rv_part, found = _strip(rv_part, VERB)
+            if not found:
+                rv_part, _ = _strip(rv_part, NOUN)
+
+    # Шаг 2
+    if rv_part.endswith("и"):
+        rv_part = rv_part[:-1]
+
+    # Шаг 3: словообразовательный суффикс должен целиком лежать в R2
+    match = DERIVATIONAL.search(rv_part)
+    if match is not None and rv + match.start() >= r2:
+        rv_part = rv_part[:match.start()]
+
+    # Шаг 4
+    if rv_part.endswith("нн"):
+        rv_part = rv_part[:-1]
+    else:
+        rv_part, found = _strip(rv_part, SUPERLATIVE)
+        if found and rv_part.endswith("нн"):
+            rv_part = rv_part[:-1]
+        elif rv_part.endswith("ь"):
+            rv_part = rv_part[:-1]
+
+    return prefix + rv_part
+
+
+def normalize_tokens(text: str) -> List[str]:
+    """Основы значимых слов текста: нижний регистр, без стоп-слов, со стеммингом"""
+    words = WORD_RE.findall(text.lower().replace("ё", "е"))
+    return [stem(w) for w in words if w not in STOPWORDS and len(w) > 1]
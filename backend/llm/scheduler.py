@@ -0,0 +1,330 @@
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import itertools
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+
+from backend.observability.metrics import LLM_QUEUE_WAIT_SECONDS
+
+from .errors import LLMOverloadedError
+
+# Классы приоритета: чем меньше число, тем раньше запрос выходит из очереди
+INTERACTIVE = 0
+BATCH = 1
+
+# Эндпоинты приложения и их классы; вызовы вне HTTP-запроса (CLI, скрипты) идут как "default"
+ENDPOINT_PRIORITIES = {
+    "chat": INTERACTIVE,
+    "ask-coach": INTERACTIVE,
+    "analyze-profile": BATCH,
+    "analyze-photo": BATCH,
+    # Фоновые советы к ответам в /chat (см. advice_service)
+    "advice": BATCH,
+    # Пакетный разбор анкет (см. batch_analysis)
+    "analyze-batch": BATCH,
+}
+DEFAULT_ENDPOINT = "default"
+
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 8))
+# Лимиты одновременных вызовов по эндпоинтам, формат "chat=6,analyze-profile=2"
+LLM_ENDPOINT_CONCURRENCY = os.environ.get(
+    "LLM_ENDPOINT_CONCURRENCY", "chat=6,ask-coach=4,analyze-profile=3,analyze-photo=2,advice=3,analyze-batch=3"
+)
+# Число процессов uvicorn, делящих квоту (по умолчанию — WEB_CONCURRENCY, из него uvicorn берет --workers)
+LLM_WORKERS = max(1, int(os.environ.get("LLM_WORKERS", os.environ.get("WEB_CONCURRENCY", 1))))
+# Квота GigaChat на все воркеры: запросов в секунду и допустимый всплеск.
+# Token bucket у каждого процесса свой, поэтому каждый получает свою долю квоты
+LLM_RATE_PER_SECOND = float(os.environ.get("LLM_RATE_PER_SECOND", 5))
+LLM_RATE_BURST = int(os.environ.get("LLM_RATE_BURST", 10))
+LLM_MAX_QUEUE = int(os.environ.get("LLM_MAX_QUEUE", 64))
+LLM_MAX_QUEUE_WAIT = float(os.environ.get("LLM_MAX_QUEUE_WAIT", 15))
+
+_current_endpoint = contextvars.ContextVar("llm_endpoint", default=DEFAULT_ENDPOINT)
+
+
+def parse_limits(spec: str) -> Dict[str, int]:
+    limits = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            limits[name.strip()] = int(value)
+    return limits
+
+
+def bind_endpoint(endpoint: str) -> contextvars.Token:
+    """Привязывает вызовы LLM текущего запроса к эндпоинту (его лимиту и приоритету)"""
+    return _current_endpoint.set(endpoint)
+
+
+def current_endpoint() -> str:
+    return _current_endpoint.get()
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "endpoint", "loop", "future", "event", "granted", "error")
+
+    def __init__(self, priority: int, seq: int, endpoint: str, loop=None):
+        self.priority = priority
+        self.seq = seq
+        self.endpoint = endpoint
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+        self.event = threading.Event() if loop is None else None
+        self.granted = False
+        # Ошибка, с которой ожидающего вытеснили из очереди
+        self.error: Optional[LLMOverloadedError] = None
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _fail(future: asyncio.Future, error: BaseException):
+    if not future.done():
+        future.set_exception(error)
+
+
+class LLMScheduler:
+    """
+    Допуск запросов к GigaChat: общий лимит одновременных вызовов, лимиты по
+    эндпоинтам, token bucket под квоту API и очередь с приоритетами.
+
+    Если вызов нельзя выполнить сразу, он встает в очередь; интерактивные
+    запросы (/chat, /ask-coach) обслуживаются раньше пакетных. Когда очередь
+    заполнена (max_queue), новый вызов вытесняет из нее самого нового ожидающего
+    с более низким приоритетом (тот получает LLMOverloadedError, 429), а если
+    таких нет — сам сразу получает 429. Ждавший дольше max_wait получает
+    LLMOverloadedError со статусом 503. Состояние
+    защищено threading.Lock, поэтому планировщик обслуживает и корутины, и
+    синхронные вызовы из потоков.
+
+    Планировщик живет в процессе, поэтому rate_per_second и burst — квота на
+    все workers процессов: каждый процесс берет себе 1/workers ее часть.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 endpoint_limits: Optional[Dict[str, int]] = None,
+                 rate_per_second: float = LLM_RATE_PER_SECOND, burst: int = LLM_RATE_BURST,
+                 max_queue: int = LLM_MAX_QUEUE, max_wait: float = LLM_MAX_QUEUE_WAIT,
+                 workers: int = LLM_WORKERS):
+        self.max_concurrency = max_concurrency
+        self.endpoint_limits = endpoint_limits if endpoint_limits is not None else parse_limits(LLM_ENDPOINT_CONCURRENCY)
+        self.rate_per_second = rate_per_second / workers
+        # Хотя бы один токен, иначе вызов не пройдет никогда
+        self.burst = max(1, burst // workers)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._lock = threading.Lock()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._active = 0
+        self._endpoint_active: Dict[str, int] = defaultdict(int)
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._timer: Optional[threading.Timer] = None
+        self._stats = {"admitted": 0, "queued": 0, "rejected": 0, "shed": 0, "timed_out": 0}
+
+    # --- Учет слотов (все методы с подчеркиванием вызываются под self._lock) ---
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate_per_second)
+        self._refilled_at = now
+
+    def _take(self, endpoint: str) -> bool:
+        if self._active >= self.max_concurrency:
+            return False
+        if self._endpoint_active[endpoint] >= self.endpoint_limits.get(endpoint, self.max_concurrency):
+            return False
+        self._refill()
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        self._active += 1
+        self._endpoint_active[endpoint] += 1
+        self._stats["admitted"] += 1
+        return True
+
+    def _release(self, endpoint: str):
+        self._active -= 1
+        self._endpoint_active[endpoint] -= 1
+        self._dispatch()
+
+    def _grant(self, waiter: _Waiter):
+        waiter.granted = True
+        if waiter.loop is not None:
+            waiter.loop.call_soon_threadsafe(_resolve, waiter.future)
+        else:
+            waiter.event.set()
+
+    def _dispatch(self):
+        """Выдает освободившиеся слоты ожидающим в порядке приоритета"""
+        self._refill()
+        for waiter in list(self._waiters):
+            if self._active >= self.max_concurrency:
+                return
+            if self._tokens < 1:
+                # Уперлись в квоту: разбудим очередь, когда накопится токен
+                self._schedule_refill()
+                return
+            if self._take(waiter.endpoint):
+                self._waiters.remove(waiter)
+                self._grant(waiter)
+            # Иначе ожидающий уперся в лимит своего эндпоинта — слот может достаться следующему
+
+    def _schedule_refill(self):
+        if self._timer is not None:
+            return
+        delay = max(0.001, (1 - self._tokens) / self.rate_per_second)
+        self._timer = threading.Timer(delay, self._on_refill)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_refill(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil((len(self._waiters) + 1) / self.rate_per_second))
+
+    def _overloaded(self) -> LLMOverloadedError:
+        return LLMOverloadedError("Слишком много запросов к GigaChat, попробуйте позже", self._retry_after())
+
+    def _can_queue(self, priority: int) -> bool:
+        """Есть место в очереди или ожидающий с более низким приоритетом, которого можно вытеснить"""
+        # Очередь отсортирована по (приоритет, порядок): в конце самый новый из наименее приоритетных
+        return len(self._waiters) < self.max_queue or self._waiters[-1].priority > priority
+
+    def _shed(self):
+        """Вытесняет из очереди самого нового ожидающего с наименьшим приоритетом"""
+        waiter = self._waiters.pop()
+        waiter.error = self._overloaded()
+        self._stats["shed"] += 1
+        if waiter.loop is not None:
+            waiter.loop.call_soon_threadsafe(_fail, waiter.future, waiter.error)
+        else:
+            waiter.event.set()
+
+    def _enqueue(self, endpoint: str, loop=None) -> Optional[_Waiter]:
+        """Сразу занимает слот (возвращает None) или ставит вызов в очередь"""
+        priority = ENDPOINT_PRIORITIES.get(endpoint, INTERACTIVE)
+        ahead = any(w.priority <= priority for w in self._waiters)
+        if not ahead and self._take(endpoint):
+            return None
+        if not self._can_queue(priority):
+            self._stats["rejected"] += 1
+            raise self._overloaded()
+        if len(self._waiters) >= self.max_queue:
+            self._shed()
+        waiter = _Waiter(priority, next(self._seq), endpoint, loop)
+        bisect.insort(self._waiters, waiter)
+        self._stats["queued"] += 1
+        if self._tokens < 1:
+            self._schedule_refill()
+        return waiter
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Убирает ожидающего из очереди; True, если слот ему уже выдан"""
+        if waiter.granted:
+            return True
+        if waiter.error is None:
+            self._waiters.remove(waiter)
+        return False
+
+    def _timeout_error(self) -> LLMOverloadedError:
+        self._stats["timed_out"] += 1
+        return LLMOverloadedError("GigaChat перегружен, попробуйте позже", self._retry_after(), status_code=503)
+
+    # --- Публичный интерфейс ---
+
+    def check_admission(self, endpoint: str):
+        """
+        Быстрая проверка до начала обработки запроса (например, до открытия SSE-потока).
+
+        Raises:
+            LLMOverloadedError: если очередь заполнена и вытеснить из нее некого
+                (все ожидающие не ниже по приоритету, чем endpoint)
+        """
+        priority = ENDPOINT_PRIORITIES.get(endpoint, INTERACTIVE)
+        with self._lock:
+            if not self._can_queue(priority):
+                self._stats["rejected"] += 1
+                raise self._overloaded()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, endpoint: Optional[str] = None):
+        """Слот на один вызов GigaChat (на все время стрима, если ответ потоковый)"""
+        endpoint = endpoint or current_endpoint()
+        started = time.perf_counter()
+        with self._lock:
+            waiter = self._enqueue(endpoint, asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(waiter.future, timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                with self._lock:
+                    if not self._abandon(waiter):
+                        raise self._timeout_error()
+            except BaseException:
+                with self._lock:
+                    if self._abandon(waiter):
+                        self._release(endpoint)
+                raise
+        LLM_QUEUE_WAIT_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._release(endpoint)
+
+    @contextlib.contextmanager
+    def slot_sync(self, endpoint: Optional[str] = None):
+        """Синхронная версия slot для вызовов из потоков"""
+        endpoint = endpoint or current_endpoint()
+        started = time.perf_counter()
+        with self._lock:
+            waiter = self._enqueue(endpoint)
+        if waiter is not None and not waiter.event.wait(self.max_wait):
+            with self._lock:
+                if not self._abandon(waiter):
+                    raise self._timeout_error()
+        if waiter is not None and waiter.error is not None:
+            raise waiter.error
+        LLM_QUEUE_WAIT_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._release(endpoint)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["active"] = self._active
+            stats["queue_depth"] = len(self._waiters)
+        return stats
+
+
+_scheduler: Optional[LLMScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    """Общий для процесса планировщик вызовов GigaChat"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
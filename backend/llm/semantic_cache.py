@@ -0,0 +1,192 @@
+import os
+import random
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from .russian_stemmer import WORD_RE, normalize_tokens, stem
+
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "1") == "1"
+# Минимальное сходство (Жаккар по символьным n-граммам основ) вопроса с закэшированным;
+# подобрано по benchmarks/eval_semantic_cache.py
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.45))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", 5000))
+SEMANTIC_CACHE_TTL = int(os.environ.get("SEMANTIC_CACHE_TTL", 7 * 24 * 3600))
+
+NGRAM = 3
+# 64 хэш-функции MinHash = 16 полос LSH по 4 строки: пара с Жаккаром 0.7 попадает
+# в кандидаты с вероятностью ~0.98, с 0.45 — ~0.5, с 0.3 — ~0.12. Пограничные пары
+# LSH отсеивает наполовину, и на выборке это точнее, чем 20 или 32 полосы с более
+# высоким порогом при той же доле попаданий
+NUM_PERM = 64
+BANDS = 16
+QUESTION_WORDS = frozenset("как какой какая какое какие куда где когда почему зачем сколько чем".split())
+NEGATIONS = frozenset(["не", "нет", "без"])
+# Вес вопросительного слова и отрицания в n-граммах (по оценке на выборке 4 лучше 0, 2 и 6)
+QUESTION_WEIGHT = 4
+# Простое число Мерсенна для универсального хэширования (a * x + b) mod p
+_PRIME = (1 << 61) - 1
+
+
+def shingles(text: str, n: int = NGRAM) -> FrozenSet[str]:
+    """
+    Символьные n-граммы основ значимых слов: перестановка слов, словоформы и
+    опечатки меняют лишь часть n-грамм. Если в вопросе одни стоп-слова,
+    берутся сами слова.
+
+    Вопросительные слова и отрицания для поиска по истории — стоп-слова, но
+    здесь они и задают смысл вопроса («куда пойти» и «о чем говорить», «куда
+    не ходить» на первом свидании), поэтому добавляются QUESTION_WEIGHT
+    отдельными метками каждое.
+    """
+    raw = WORD_RE.findall(text.lower().replace("ё", "е"))
+    words = normalize_tokens(text) or raw
+    grams = set()
+    for word in words:
+        padded = f" {word} "
+        grams.update(padded[i:i + n] for i in range(max(1, len(padded) - n + 1)))
+    for i, word in enumerate(raw):
+        if word in QUESTION_WORDS:
+            grams.update(f"?{word}#{k}" for k in range(QUESTION_WEIGHT))
+        elif word in NEGATIONS and i + 1 < len(raw):
+            grams.update(f"!{stem(raw[i + 1])}#{k}" for k in range(QUESTION_WEIGHT))
+    return frozenset(grams)
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class MinHasher:
+    """Сигнатура MinHash множества строк; при одном seed сигнатуры совпадают между процессами"""
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+
+    def signature(self, items: FrozenSet[str]) -> Tuple[int, ...]:
+        hashes = [zlib.crc32(item.encode("utf-8")) for item in items] or [0]
+        return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in self._perms)
+
+
+class SemanticCache:
+    """
+    Кэш ответов на близкие по смыслу вопросы (переформулировки, словоформы, опечатки).
+
+    Вопрос сводится к множеству символьных n-грамм основ слов. По сигнатуре
+    MinHash через LSH (полосы сигнатуры как ключи корзин) находятся кандидаты,
+    для них считается точный коэффициент Жаккара, и лучший кандидат не ниже
+    threshold отдается как попадание. Записи вытесняются по LRU сверх
+    max_entries и по TTL. Кэш живет в памяти процесса.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+                 ttl_seconds: int = SEMANTIC_CACHE_TTL, num_perm: int = NUM_PERM, bands: int = BANDS):
+        if num_perm % bands:
+            raise ValueError("num_perm должно делиться на bands")
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._hasher = MinHasher(num_perm)
+
+        # id записи -> (вопрос, n-граммы, ключи корзин, ответ, срок годности)
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._buckets: Dict[tuple, Set[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0}
+
+    def _bucket_keys(self, grams: FrozenSet[str]) -> List[tuple]:
+        signature = self._hasher.signature(grams)
+        return [(band, signature[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+
+    def lookup(self, question: str) -> Optional[Tuple[str, str, float]]:
+        """Самый похожий закэшированный вопрос не ниже порога: (вопрос, ответ, сходство)"""
+        grams = shingles(question)
+        keys = self._bucket_keys(grams)
+        now = time.time()
+        with self._lock:
+            candidates = set()
+            for key in keys:
+                candidates |= self._buckets.get(key, set())
+            best, best_score = None, self.threshold
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if entry[4] <= now:
+                    self._remove(entry_id)
+                    continue
+                score = jaccard(grams, entry[1])
+                if score >= best_score:
+                    best, best_score = entry_id, score
+            if best is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(best)
+            self._stats["hits"] += 1
+            entry = self._entries[best]
+            return entry[0], entry[3], best_score
+
+    def get(self, question: str) -> Optional[str]:
+        match = self.lookup(question)
+        return match[1] if match is not None else None
+
+    def set(self, question: str, answer: str):
+        grams = shingles(question)
+        if not grams:
+            return
+        keys = self._bucket_keys(grams)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (question, grams, keys, answer, time.time() + self.ttl_seconds)
+            for key in keys:
+                self._buckets.setdefault(key, set()).add(entry_id)
+            self._stats["sets"] += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def _remove(self, entry_id: int):
+        """Удаляет запись и ее id из корзин (вызывается под self._lock)"""
+        entry = self._entries.pop(entry_id)
+        for key in entry[2]:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / total if total else 0.0
+        return stats
+
+
+_semantic_cache: Optional[SemanticCache] = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> SemanticCache:
+    """Общий для процесса кэш ответов коуча на первые вопросы"""
+    global _semantic_cache
+    with _semantic_cache_lock:
+        if _semantic_cache is None:
+            _semantic_cache = SemanticCache()
+        return _semantic_cache
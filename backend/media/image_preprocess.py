@@ -0,0 +1,115 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+from PIL import Image, ImageOps
+
+PREPROCESS_ENABLED = os.environ.get("PHOTO_PREPROCESS", "1") != "0"
+MAX_EDGE = int(os.environ.get("PHOTO_MAX_EDGE", 1280))
+THUMB_EDGE = int(os.environ.get("PHOTO_THUMB_EDGE", 320))
+QUALITY = int(os.environ.get("PHOTO_QUALITY", 85))
+# JPEG или WEBP
+OUTPUT_FORMAT = os.environ.get("PHOTO_FORMAT", "JPEG").upper()
+PREPROCESS_WORKERS = int(os.environ.get("PHOTO_PREPROCESS_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+
+EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp"}
+
+
+def output_extension(fmt: str = OUTPUT_FORMAT) -> str:
+    return EXTENSIONS.get(fmt, ".jpg")
+
+
+def _to_rgb(image: Image.Image) -> Image.Image:
+    """JPEG не умеет прозрачность: кладем картинку с альфа-каналом на белый фон"""
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def _save_atomic(image: Image.Image, path: str, fmt: str, **params):
+    """
+    Сохраняет картинку через временный файл в том же каталоге и os.replace:
+    параллельная обработка того же фото и сбой посреди записи не оставляют
+    обрезанный файл, который потом отдавался бы как готовый.
+    """
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex}.tmp")
+    try:
+        image.save(tmp_path, fmt, **params)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def preprocess_image(src_path: str, dst_path: str, thumb_path: str, max_edge: int = MAX_EDGE,
+                     thumb_edge: int = THUMB_EDGE, quality: int = QUALITY,
+                     fmt: str = OUTPUT_FORMAT) -> Dict:
+    """
+    Готовит фото к отправке в GigaChat: уменьшает до max_edge по длинной стороне,
+    убирает EXIF и пересжимает в JPEG/WebP. Заодно сохраняет превью для анкеты.
+
+    Функция выполняется в отдельном процессе, поэтому принимает и возвращает
+    только простые значения.
+    """
+    with Image.open(src_path) as source:
+        # Поворот из EXIF применяем до того, как выбросим метаданные
+        image = _to_rgb(ImageOps.exif_transpose(source))
+
+    image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    # exif не передаем — метаданные (в том числе геолокация) не попадают в файл
+    _save_atomic(image, dst_path, fmt, quality=quality, optimize=True)
+
+    thumb = image.copy()
+    thumb.thumbnail((thumb_edge, thumb_edge), Image.Resampling.LANCZOS)
+    _save_atomic(thumb, thumb_path, fmt, quality=quality, optimize=True)
+
+    return {
+        "path": dst_path,
+        "thumb_path": thumb_path,
+        "width": image.width,
+        "height": image.height,
+        "size": os.path.getsize(dst_path),
+        "thumb_size": os.path.getsize(thumb_path),
+    }
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """Пул процессов для декодирования и пересжатия, создается при первом обращении"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Не fork: процесс сервера уже многопоточный, и ребенок, скопированный в момент,
+            # когда чужой поток держит блокировку, может зависнуть на ней навсегда
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _executor = ProcessPoolExecutor(max_workers=PREPROCESS_WORKERS,
+                                            mp_context=multiprocessing.get_context(method))
+        return _executor
+
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+async def apreprocess_image(src_path: str, dst_path: str, thumb_path: str, **kwargs) -> Dict:
+    """preprocess_image в пуле процессов, не блокируя event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(), functools.partial(preprocess_image, src_path, dst_path, thumb_path, **kwargs)
+    )
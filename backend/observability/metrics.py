@@ -0,0 +1,230 @@
+"""
+Метрики приложения в текстовом формате Prometheus (/metrics).
+
+Реализация своя, без prometheus_client: счетчики и гистограммы с метками,
+запись — поиск ключа в словаре и bisect под общей блокировкой метрики
+(единицы микросекунд против сотен миллисекунд вызова GigaChat, см.
+benchmarks/bench_observability.py), так что метрики можно не выключать в проде.
+Показатели, которые уже считают сами компоненты (планировщик, кэш ответов,
+обертка вызовов GigaChat), не дублируются, а читаются из их stats() при
+каждом запросе /metrics через коллекторы.
+"""
+import bisect
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+PREFIX = "twinby_"
+
+# Границы корзин гистограмм
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+SIZE_BUCKETS = tuple(16 * 1024 * 4 ** i for i in range(6))  # 16 КБ .. 16 МБ
+
+# Сэмпл коллектора: (имя, тип, описание, метки, значение)
+Sample = Tuple[str, str, str, Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs: Iterable[Tuple[str, str]]) -> str:
+    body = ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs)
+    return f"{{{body}}}" if body else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Монотонный счетчик"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        # В формате 0.0.4 имя в HELP/TYPE совпадает с именем сэмпла
+        super().__init__(name + "_total", documentation, labelnames)
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = self._header()
+        for key, value in items:
+            lines.append(f"{self.name}{_labels(zip(self.labelnames, key))} {_number(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными корзинами; наблюдения хранятся только как счетчики корзин"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [счетчики корзин (последняя — +Inf), сумма, количество]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state[2] if state else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, ([*state[0]], state[1], state[2])) for key, state in self._values.items())
+        lines = self._header()
+        for key, (counts, total, count) in items:
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(pairs + [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(pairs)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(pairs)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Набор метрик процесса и коллекторов, опрашиваемых при выдаче /metrics"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collect: Callable[[], Iterable[Sample]]):
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+
+        families: Dict[str, Tuple[str, str, List[Tuple[Dict[str, str], float]]]] = {}
+        for collect in collectors:
+            try:
+                samples = list(collect())
+            except Exception as e:
+                print(f"[МЕТРИКИ] Коллектор {collect} упал: {e}")
+                continue
+            for name, kind, documentation, labels, value in samples:
+                name = PREFIX + name + ("_total" if kind == "counter" else "")
+                families.setdefault(name, (kind, documentation, []))[2].append((labels, value))
+        for name, (kind, documentation, samples) in families.items():
+            lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(labels.items())} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def stats_collector(prefix: str, stats: Callable[[], Dict], gauges: Iterable[str] = (),
+                    documentation: str = "") -> Callable[[], List[Sample]]:
+    """
+    Коллектор для словаря stats() компонента. Ключи из gauges становятся
+    gauge, остальные числа — счетчиками. Строковое значение выдается как
+    gauge со значением 1 и меткой state (например, состояние circuit breaker);
+    None и вложенные словари пропускаются.
+    """
+    gauges = set(gauges)
+
+    def collect() -> List[Sample]:
+        samples = []
+        for key, value in stats().items():
+            name = f"{prefix}_{key}"
+            doc = f"{documentation} ({key})".strip()
+            if isinstance(value, str):
+                samples.append((name, "gauge", doc, {"state": value}, 1))
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                samples.append((name, "gauge" if key in gauges else "counter", doc, {}, value))
+        return samples
+
+    return collect
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса до конца тела ответа",
+    ["endpoint", "method", "status"],
+)
+LLM_CALL_SECONDS = REGISTRY.histogram(
+    "llm_call_duration_seconds", "Длительность вызова GigaChat с очередью и повторами",
+    ["agent", "kind", "outcome"],
+)
+LLM_FIRST_TOKEN_SECONDS = REGISTRY.histogram(
+    "llm_first_token_seconds", "Время до первого куска потокового ответа GigaChat", ["agent"],
+)
+LLM_TOKENS = REGISTRY.counter("llm_tokens", "Токены по данным GigaChat (prompt/completion)", ["agent", "type"])
+LLM_CACHE_LOOKUPS = REGISTRY.counter("llm_cache_lookups", "Обращения к кэшу ответов LLM", ["agent", "result"])
+LLM_QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "llm_queue_wait_seconds", "Ожидание слота в планировщике вызовов GigaChat", ["endpoint"],
+)
+UPLOAD_BYTES = REGISTRY.histogram(
+    "upload_size_bytes", "Размер загрузок: photo — от пользователя, llm — отправлено в GigaChat", ["kind"],
+    buckets=SIZE_BUCKETS,
+)
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
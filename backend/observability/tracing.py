@@ -0,0 +1,200 @@
+"""
+Легковесные спаны в духе OpenTelemetry: HTTP-запрос и его вызовы GigaChat
+связаны общим trace_id.
+
+Включается TRACING_ENABLED=1. Входящий заголовок traceparent (W3C Trace
+Context) продолжает внешний трейс, id трейса возвращается в X-Trace-Id.
+Завершенные спаны лежат в кольцевом буфере (/traces) и, если задан
+TRACE_EXPORT_PATH, дописываются туда JSON-строками с полями OTLP
+(trace_id, span_id, parent_span_id, start/end_time_unix_nano, attributes).
+Файл пишет фоновый поток через одну открытую запись; спаны попадают к нему
+через очередь на TRACE_EXPORT_QUEUE_SIZE штук, а при ее переполнении
+отбрасываются (и считаются), чтобы запрос никогда не ждал диска.
+"""
+import contextlib
+import contextvars
+import json
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterator, List, Optional
+
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "0") == "1"
+TRACE_EXPORT_PATH = os.environ.get("TRACE_EXPORT_PATH")
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", 2000))
+TRACE_EXPORT_QUEUE_SIZE = int(os.environ.get("TRACE_EXPORT_QUEUE_SIZE", 10000))
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "start_ns", "end_ns", "status")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = "ok"
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3) if self.end_ns else None,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+class SpanExporter:
+    """Дописывает завершенные спаны в файл JSON-строками из фонового потока"""
+
+    _STOP = object()
+
+    def __init__(self, path: str, queue_size: int = TRACE_EXPORT_QUEUE_SIZE):
+        self.path = path
+        self.dropped = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                span = self._queue.get()
+                if span is self._STOP:
+                    return
+                try:
+                    f.write(json.dumps(span.to_dict(), ensure_ascii=False) + "\n")
+                    # Буфер сбрасывается, когда очередь разобрана, а не на каждый спан
+                    if self._queue.empty():
+                        f.flush()
+                except Exception as e:
+                    print(f"[ТРЕЙСЫ] Не удалось записать спан: {e}")
+
+    def close(self, timeout: float = 5.0):
+        """Дописывает очередь и закрывает файл"""
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+
+
+class Tracer:
+    """Создает спаны и хранит завершенные; при выключенной трассировке ничего не делает"""
+
+    def __init__(self, enabled: bool = TRACING_ENABLED, export_path: Optional[str] = TRACE_EXPORT_PATH,
+                 buffer_size: int = TRACE_BUFFER_SIZE):
+        self.enabled = enabled
+        self.export_path = export_path
+        self._exporter: Optional[SpanExporter] = None
+        self._finished = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+
+    def start_span(self, name: str, parent: Optional[Span] = None, traceparent: Optional[str] = None,
+                   **attributes) -> Optional[Span]:
+        """
+        Начинает спан; родитель — явный parent, иначе внешний traceparent,
+        иначе текущий спан контекста. Спан нужно завершить через end_span.
+        """
+        if not self.enabled:
+            return None
+        parent = parent or current_span()
+        if parent is not None:
+            return Span(name, parent.trace_id, parent.span_id, attributes)
+        match = _TRACEPARENT.match(traceparent or "")
+        if match:
+            return Span(name, match.group(1), match.group(2), attributes)
+        return Span(name, secrets.token_hex(16), None, attributes)
+
+    def end_span(self, span: Optional[Span], error: Optional[BaseException] = None):
+        if span is None or span.end_ns is not None:
+            return
+        span.end_ns = time.time_ns()
+        if error is not None:
+            span.status = f"error: {type(error).__name__}"
+        with self._lock:
+            self._finished.append(span)
+            if self.export_path and self._exporter is None:
+                self._exporter = SpanExporter(self.export_path)
+            exporter = self._exporter
+        if exporter is not None:
+            exporter.export(span)
+
+    def close(self):
+        """Дописывает в файл спаны из очереди экспорта (при остановке приложения)"""
+        with self._lock:
+            exporter, self._exporter = self._exporter, None
+        if exporter is not None:
+            exporter.close()
+
+    @contextlib.contextmanager
+    def span(self, name: str, activate: bool = True, **attributes) -> Iterator[Optional[Span]]:
+        """
+        Спан на время блока. activate=False не делает его текущим: так можно
+        оборачивать тело асинхронного генератора, где контекст между yield
+        может смениться.
+        """
+        span = self.start_span(name, **attributes)
+        token = _current_span.set(span) if span is not None and activate else None
+        try:
+            yield span
+        except BaseException as e:
+            self.end_span(span, e)
+            raise
+        finally:
+            if token is not None:
+                _current_span.reset(token)
+            self.end_span(span)
+
+    def activate(self, span: Optional[Span]) -> contextvars.Token:
+        """Делает спан текущим для кода и задач, запущенных дальше в этом контексте"""
+        return _current_span.set(span)
+
+    def deactivate(self, token: contextvars.Token):
+        _current_span.reset(token)
+
+    def recent(self, trace_id: Optional[str] = None, limit: int = 200) -> List[Dict]:
+        with self._lock:
+            spans = list(self._finished)
+        if trace_id:
+            spans = [s for s in spans if s.trace_id == trace_id]
+        return [s.to_dict() for s in spans[-limit:]]
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """Общий для процесса трассировщик"""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer()
+        return _tracer
@@ -0,0 +1,237 @@
+import asyncio
+import glob
+import hashlib
+import mimetypes
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+from .sqlite import ThreadLocalConnections
+
+DEFAULT_PHOTO_DIR = os.environ.get("PHOTO_DIR", "uploaded_photos")
+DEFAULT_PHOTO_DB_PATH = os.environ.get("PHOTO_DB_PATH", "data/photos.db")
+MAX_PHOTO_BYTES = int(os.environ.get("MAX_PHOTO_BYTES", 10 * 1024 * 1024))
+PHOTO_MAX_AGE_SECONDS = int(os.environ.get("PHOTO_MAX_AGE_DAYS", 30)) * 24 * 3600
+PHOTO_MAX_TOTAL_BYTES = int(os.environ.get("PHOTO_MAX_TOTAL_BYTES", 1024 * 1024 * 1024))
+
+CHUNK_SIZE = 64 * 1024
+# Раз во сколько сохранений запускать сборку мусора
+GC_EVERY = 100
+ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".heic"}
+
+
+class PhotoTooLargeError(Exception):
+    """Загружаемое фото больше MAX_PHOTO_BYTES"""
+
+
+class PhotoStore:
+    """
+    Контентно-адресуемое хранилище фотографий анкет.
+
+    Файл сохраняется под именем <sha256><расширение>, поэтому одинаковые фото
+    лежат на диске один раз: повторная загрузка тех же байт под другим
+    расширением получает уже сохраненный файл. Индекс в SQLite связывает хэш с
+    id файла в GigaChat и готовым разбором: повторное фото не загружается и не
+    анализируется заново. Сборка мусора идет в фоновом потоке раз в GC_EVERY
+    сохранений.
+    """
+
+    def __init__(self, root: str = DEFAULT_PHOTO_DIR, db_path: str = DEFAULT_PHOTO_DB_PATH,
+                 max_bytes: int = MAX_PHOTO_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._conn = ThreadLocalConnections(db_path).get
+        self._saves = 0
+        self._gc_running = False
+        self._lock = threading.Lock()
+        # Выбор имени файла и запись в индекс для одного хэша не должны чередоваться
+        self._publish_lock = threading.Lock()
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS photos (
+                hash TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                file_id TEXT,
+                feedback TEXT,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn().execute("CREATE INDEX IF NOT EXISTS idx_photos_access ON photos (last_access)")
+
+    @staticmethod
+    def _extension(filename: Optional[str], content_type: Optional[str]) -> str:
+        ext = os.path.splitext(filename or "")[1].lower()
+        if ext not in ALLOWED_EXTENSIONS:
+            ext = mimetypes.guess_extension(content_type or "") or ".jpg"
+        return ext if ext in ALLOWED_EXTENSIONS else ".jpg"
+
+    def _record(self, row) -> Dict:
+        return {
+            "hash": row["hash"],
+            "path": os.path.join(self.root, row["filename"]),
+            "filename": row["filename"],
+            "size": row["size"],
+            "file_id": row["file_id"],
+            "feedback": row["feedback"],
+        }
+
+    @staticmethod
+    def _append(f, hasher, chunk: bytes):
+        hasher.update(chunk)
+        f.write(chunk)
+
+    async def save_upload(self, upload) -> Dict:
+        """
+        Потоково сохраняет UploadFile на диск, попутно считая SHA-256.
+        Запись и хэширование идут в потоке, чтобы не держать цикл событий.
+
+        Raises:
+            PhotoTooLargeError: если файл больше self.max_bytes
+        """
+        hasher = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.root, f".upload-{uuid.uuid4().hex}")
+        try:
+            f = await asyncio.to_thread(open, tmp_path, "wb")
+            try:
+                while chunk := await upload.read(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise PhotoTooLargeError(f"Фото больше {self.max_bytes // (1024 * 1024)} МБ")
+                    await asyncio.to_thread(self._append, f, hasher, chunk)
+            finally:
+                await asyncio.to_thread(f.close)
+            ext = self._extension(upload.filename, upload.content_type)
+            return await asyncio.to_thread(self._publish, tmp_path, hasher.hexdigest(), ext, size)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def save_file(self, source: str) -> Dict:
+        """
+        Копирует в хранилище локальный файл (пакетный разбор анкет из CLI).
+
+        Raises:
+            PhotoTooLargeError: если файл больше self.max_bytes
+        """
+        size = os.path.getsize(source)
+        if size > self.max_bytes:
+            raise PhotoTooLargeError(f"Фото больше {self.max_bytes // (1024 * 1024)} МБ")
+        hasher = hashlib.sha256()
+        with open(source, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                hasher.update(chunk)
+        tmp_path = os.path.join(self.root, f".upload-{uuid.uuid4().hex}")
+        try:
+            shutil.copyfile(source, tmp_path)
+            ext = self._extension(source, mimetypes.guess_type(source)[0])
+            return self._publish(tmp_path, hasher.hexdigest(), ext, size)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _publish(self, tmp_path: str, digest: str, ext: str, size: int) -> Dict:
+        """
+        Кладет загруженный файл под именем по хэшу и индексирует его. Если те же
+        байты уже сохранены (возможно, с другим расширением), берется
+        сохраненный файл, а tmp_path остается вызывающему для удаления.
+        """
+        with self._publish_lock:
+            record = self.get(digest)
+            if record is not None and os.path.exists(record["path"]):
+                filename = record["filename"]
+            else:
+                filename = digest + ext
+                os.replace(tmp_path, os.path.join(self.root, filename))
+            now = time.time()
+            self._conn().execute(
+                "INSERT INTO photos (hash, filename, size, created_at, last_access) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(hash) DO UPDATE SET filename = excluded.filename, last_access = excluded.last_access",
+                (digest, filename, size, now, now),
+            )
+        with self._lock:
+            self._saves += 1
+            run_gc = self._saves % GC_EVERY == 0 and not self._gc_running
+            self._gc_running = self._gc_running or run_gc
+        if run_gc:
+            threading.Thread(target=self._background_gc, name="photo-gc", daemon=True).start()
+        return self.get(digest)
+
+    def _background_gc(self):
+        try:
+            self.gc()
+        except Exception as e:
+            print(f"[ФОТО] Ошибка сборки мусора: {e}")
+        finally:
+            with self._lock:
+                self._gc_running = False
+
+    def derived_path(self, digest: str, kind: str, ext: str) -> str:
+        """Путь производного файла (уменьшенная копия, превью) рядом с оригиналом"""
+        return os.path.join(self.root, f"{digest}.{kind}{ext}")
+
+    def get(self, digest: str) -> Optional[Dict]:
+        row = self._conn().execute("SELECT * FROM photos WHERE hash = ?", (digest,)).fetchone()
+        return self._record(row) if row is not None else None
+
+    def set_file_id(self, digest: str, file_id: Optional[str]):
+        self._conn().execute("UPDATE photos SET file_id = ? WHERE hash = ?", (file_id, digest))
+
+    def set_feedback(self, digest: str, feedback: str):
+        self._conn().execute("UPDATE photos SET feedback = ? WHERE hash = ?", (feedback, digest))
+
+    def gc(self, max_age_seconds: int = PHOTO_MAX_AGE_SECONDS,
+           max_total_bytes: int = PHOTO_MAX_TOTAL_BYTES) -> int:
+        """
+        Удаляет фото, к которым давно не обращались, и самые старые сверх общего лимита.
+
+        Returns:
+            Количество удаленных файлов
+        """
+        conn = self._conn()
+        rows = conn.execute("SELECT hash, filename, size, last_access FROM photos ORDER BY last_access DESC").fetchall()
+        cutoff = time.time() - max_age_seconds
+        total = 0
+        removed = 0
+        for row in rows:
+            total += row["size"]
+            if row["last_access"] >= cutoff and total <= max_total_bytes:
+                continue
+            total -= row["size"]
+            # Под _publish_lock: параллельная загрузка тех же байт не выберет файл, который сейчас удаляется
+            with self._publish_lock:
+                current = conn.execute("SELECT last_access FROM photos WHERE hash = ?", (row["hash"],)).fetchone()
+                if current is None or current["last_access"] != row["last_access"]:
+                    # Фото загрузили заново, пока шла сборка, — оно снова свежее и остается на диске
+                    total += row["size"]
+                    continue
+                conn.execute("DELETE FROM photos WHERE hash = ?", (row["hash"],))
+                # Оригинал и все производные файлы начинаются с хэша
+                for path in glob.glob(os.path.join(self.root, glob.escape(row["hash"]) + ".*")):
+                    os.remove(path)
+            removed += 1
+        if removed:
+            print(f"[ФОТО] Удалено {removed} старых фото")
+        return removed
+
+
+_default_store: Optional[PhotoStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_photo_store() -> PhotoStore:
+    """Общее для процесса хранилище фото по путям из PHOTO_DIR и PHOTO_DB_PATH"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = PhotoStore()
+        return _default_store
+
+
+if __name__ == "__main__":
+    get_photo_store().gc()
@@ -0,0 +1,214 @@
+import asyncio
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+from .sqlite import ThreadLocalConnections
+
+DEFAULT_DB_PATH = os.environ.get("SESSION_DB_PATH", "data/sessions.db")
+
+T = TypeVar("T")
+
+
+class SessionStore:
+    """
+    Хранилище истории диалогов по сессиям на SQLite в режиме WAL.
+
+    Каждое сообщение — одна строка, поэтому запись реплики — это O(1) INSERT,
+    а последние N сообщений сессии достаются по индексу (session_id, id).
+    База живет вне процесса, так что одну сессию могут обслуживать несколько
+    воркеров uvicorn.
+
+    Асинхронный код обращается к базе только через arun: запись может ждать
+    блокировку, занятую другим воркером или индексацией долговременной памяти,
+    и это ожидание не должно держать event loop.
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        self.path = path
+        self._conn = ThreadLocalConnections(path).get
+        # Один поток на хранилище: операции из arun выполняются в порядке вызова
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-store")
+        self._init_schema()
+
+    def arun(self, fn: Callable[..., T], *args, **kwargs) -> "asyncio.Future[T]":
+        """
+        Выполняет операцию с хранилищем (обычно его метод) в потоке хранилища.
+
+        Операция ставится в очередь сразу при вызове, поэтому порядок операций
+        совпадает с порядком вызовов arun, даже если future еще не дождались:
+        запись, отправленная раньше, всегда выполнится раньше следующего чтения.
+        """
+        return asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                message TEXT NOT NULL,
+                timestamp TEXT NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id)")
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(messages)")}
+        if "tokens" not in columns:
+            # Базы, созданные до подсчета токенов: для старых строк tokens останется NULL
+            conn.execute("ALTER TABLE messages ADD COLUMN tokens INTEGER")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS summaries (
+                session_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                upto_id INTEGER NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS advice (
+                session_id TEXT NOT NULL,
+                message_id INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                advice TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (session_id, message_id)
+            )
+        """)
+
+    @staticmethod
+    def _row_to_entry(row: sqlite3.Row) -> Dict:
+        return {"id": row["id"], "role": row["role"], "message": row["message"],
+                "timestamp": row["timestamp"], "tokens": row["tokens"]}
+
+    def append(self, session_id: str, role: str, message: str, timestamp: str = None,
+               tokens: Optional[int] = None) -> Dict:
+        """Добавляет сообщение в конец истории сессии"""
+        timestamp = timestamp or datetime.now().isoformat()
+        cur = self._conn().execute(
+            "INSERT INTO messages (session_id, role, message, timestamp, tokens) VALUES (?, ?, ?, ?, ?)",
+            (session_id, role, message, timestamp, tokens),
+        )
+        return {"id": cur.lastrowid, "role": role, "message": message, "timestamp": timestamp, "tokens": tokens}
+
+    def recent(self, session_id: str, limit: int) -> List[Dict]:
+        """Последние limit сообщений сессии в хронологическом порядке"""
+        rows = self._conn().execute(
+            "SELECT id, role, message, timestamp, tokens FROM messages "
+            "WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+            (session_id, limit),
+        ).fetchall()
+        return [self._row_to_entry(row) for row in reversed(rows)]
+
+    def history(self, session_id: str) -> List[Dict]:
+        """Вся история сессии в хронологическом порядке"""
+        return self.after(session_id, 0)
+
+    def after(self, session_id: str, after_id: int) -> List[Dict]:
+        """Сообщения сессии с id больше after_id в хронологическом порядке"""
+        rows = self._conn().execute(
+            "SELECT id, role, message, timestamp, tokens FROM messages "
+            "WHERE session_id = ? AND id > ? ORDER BY id",
+            (session_id, after_id),
+        ).fetchall()
+        return [self._row_to_entry(row) for row in rows]
+
+    def get_many(self, message_ids: List[int]) -> List[Dict]:
+        """Сообщения по списку id в хронологическом порядке"""
+        if not message_ids:
+            return []
+        placeholders = ", ".join("?" * len(message_ids))
+        rows = self._conn().execute(
+            f"SELECT id, role, message, timestamp, tokens FROM messages WHERE id IN ({placeholders}) ORDER BY id",
+            list(message_ids),
+        ).fetchall()
+        return [self._row_to_entry(row) for row in rows]
+
+    def set_tokens(self, message_id: int, tokens: int):
+        self._conn().execute("UPDATE messages SET tokens = ? WHERE id = ?", (tokens, message_id))
+
+    def get_summary(self, session_id: str) -> Tuple[str, int]:
+        """Сжатое содержание ранней части разговора и id последнего вошедшего в него сообщения"""
+        row = self._conn().execute(
+            "SELECT summary, upto_id FROM summaries WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return (row["summary"], row["upto_id"]) if row is not None else ("", 0)
+
+    def set_summary(self, session_id: str, summary: str, upto_id: int):
+        self._conn().execute(
+            "INSERT INTO summaries (session_id, summary, upto_id) VALUES (?, ?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET summary = excluded.summary, upto_id = excluded.upto_id "
+            "WHERE excluded.upto_id > summaries.upto_id",
+            (session_id, summary, upto_id),
+        )
+
+    def get_advice(self, session_id: str, message_id: int) -> Optional[Dict]:
+        """Совет к ответу message_id: статус (pending/ready/cancelled/failed) и текст"""
+        row = self._conn().execute(
+            "SELECT status, advice, updated_at FROM advice WHERE session_id = ? AND message_id = ?",
+            (session_id, message_id),
+        ).fetchone()
+        if row is None:
+            return None
+        return {"message_id": message_id, "status": row["status"], "advice": row["advice"],
+                "updated_at": row["updated_at"]}
+
+    def set_advice(self, session_id: str, message_id: int, status: str, advice: Optional[str] = None):
+        self._conn().execute(
+            "INSERT INTO advice (session_id, message_id, status, advice, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(session_id, message_id) DO UPDATE SET "
+            "status = excluded.status, advice = excluded.advice, updated_at = excluded.updated_at",
+            (session_id, message_id, status, advice, time.time()),
+        )
+
+    def count(self, session_id: str, role: Optional[str] = None) -> int:
+        if role is None:
+            row = self._conn().execute(
+                "SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        else:
+            row = self._conn().execute(
+                "SELECT COUNT(*) FROM messages WHERE session_id = ? AND role = ?", (session_id, role)
+            ).fetchone()
+        return row[0]
+
+    def clear(self, session_id: str):
+        self._conn().execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        self._conn().execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+        self._conn().execute("DELETE FROM advice WHERE session_id = ?", (session_id,))
+
+    def import_json(self, session_id: str, path: str) -> int:
+        """Импортирует историю из старого формата conversation_memory_<имя>.json"""
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT INTO messages (session_id, role, message, timestamp) VALUES (?, ?, ?, ?)",
+                [(session_id, e["role"], e["message"], e.get("timestamp") or datetime.now().isoformat())
+                 for e in entries],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return len(entries)
+
+
+_default_store: Optional[SessionStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_store() -> SessionStore:
+    """Общее для процесса хранилище по пути из SESSION_DB_PATH"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = SessionStore()
+        return _default_store
@@ -0,0 +1,29 @@
+import os
+import sqlite3
+import threading
+
+
+class ThreadLocalConnections:
+    """
+    Соединения с файлом SQLite по одному на поток (sqlite3-соединения не потокобезопасны).
+
+    База открывается в режиме WAL с autocommit: читатели не блокируют писателя,
+    и с одним файлом могут работать несколько процессов.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
@@ -0,0 +1,283 @@
+"""
+Отдача страницы, статики и фото: кэш в памяти, предсжатие, валидаторы кэша.
+
+  * CachedPage — index.html держится в памяти и перечитывается, только когда
+    изменился он сам или статика, на которую он ссылается (stat не чаще раза
+    в PAGE_RECHECK_INTERVAL секунд). Ссылки страницы на /static/... получают
+    версию ?v=<хэш содержимого>.
+  * PrecompressedStaticFiles — файлы /static до STATIC_CACHE_MAX_BYTES
+    сжимаются (zstd и gzip) один раз при старте или изменении файла (в
+    потоке, а не в event loop) и отдаются из памяти с ETag; по URL с
+    актуальной ?v= — с Cache-Control immutable на год, без версии — no-cache
+    с проверкой по ETag.
+  * PhotoFiles — фото в хранилище названы хэшем содержимого, поэтому они
+    отдаются immutable, остальные файлы каталога — no-cache; Range
+    обрабатывает FileResponse (перемотка и докачка больших фото).
+  * OrjsonResponse — JSON-ответы через orjson.
+
+brotli не входит в зависимости проекта, поэтому вместо него zstd
+(zstandard уже в requirements.txt); браузеры без zstd получают gzip.
+"""
+import asyncio
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import stat
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import orjson
+import zstandard
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Receive, Scope, Send
+
+# Файлы статики больше этого отдаются с диска через FileResponse (с поддержкой Range)
+STATIC_CACHE_MAX_BYTES = int(os.environ.get("STATIC_CACHE_MAX_BYTES", 1024 * 1024))
+# Как часто (в секундах) проверять, не изменился ли файл страницы или статики
+PAGE_RECHECK_INTERVAL = float(os.environ.get("PAGE_RECHECK_INTERVAL", 1.0))
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# Меньше этого сжатие не окупает заголовков и работы клиента
+COMPRESS_MIN_BYTES = 512
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml", "application/xml")
+# Порядок предпочтения при равном q в Accept-Encoding
+ENCODINGS = ("zstd", "gzip")
+
+_STATIC_REF_RE = re.compile(r"""(?P<quote>["'])/static/(?P<path>[^"'?#]+)(?P=quote)""")
+# Имена файлов PhotoStore: <sha256><расширение> и производные <sha256>.<вид><расширение>
+_CONTENT_ADDRESSED_RE = re.compile(r"[0-9a-f]{64}(\.\w+)+")
+
+
+class OrjsonResponse(JSONResponse):
+    """JSON-ответ через orjson: в разы быстрее json.dumps, UTF-8 без экранирования"""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _compress(data: bytes, media_type: str) -> Dict[str, bytes]:
+    variants = {"identity": data}
+    if len(data) < COMPRESS_MIN_BYTES or not media_type.startswith(COMPRESSIBLE_TYPES):
+        return variants
+    compressed = {
+        "zstd": zstandard.ZstdCompressor(level=19).compress(data),
+        "gzip": gzip.compress(data, compresslevel=9, mtime=0),
+    }
+    variants.update({name: body for name, body in compressed.items() if len(body) < len(data)})
+    return variants
+
+
+def choose_encoding(accept_encoding: str, available: Iterable[str]) -> str:
+    """Лучшее из доступных сжатий по заголовку Accept-Encoding (с учетом q, q=0 — запрет)"""
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        match = re.search(r"q=([0-9.]+)", params)
+        if match:
+            try:
+                q = float(match.group(1))
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    best, best_q = "identity", 0.0
+    for name in ENCODINGS:
+        q = weights.get(name, weights.get("*", 0.0))
+        if name in available and q > best_q:
+            best, best_q = name, q
+    return best
+
+
+class Asset:
+    """Содержимое файла в памяти: варианты сжатия, ETag и версия для URL"""
+
+    def __init__(self, data: bytes, media_type: str, signature: Tuple[int, int] = (0, 0)):
+        self.media_type = media_type
+        self.signature = signature
+        self.version = hashlib.sha256(data).hexdigest()[:16]
+        self.variants = _compress(data, media_type)
+
+    def etag(self, encoding: str) -> str:
+        return f'"{self.version}"' if encoding == "identity" else f'"{self.version}-{encoding}"'
+
+    def response(self, headers: Headers, cache_control: str) -> Response:
+        encoding = choose_encoding(headers.get("accept-encoding", ""), self.variants)
+        response_headers = {"etag": self.etag(encoding), "cache-control": cache_control}
+        if len(self.variants) > 1:
+            response_headers["vary"] = "Accept-Encoding"
+        if_none_match = headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or response_headers["etag"] in
+                              [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]):
+            return Response(status_code=304, headers=response_headers)
+        if encoding != "identity":
+            response_headers["content-encoding"] = encoding
+        return Response(self.variants[encoding], media_type=self.media_type, headers=response_headers)
+
+
+def _media_type(path: str) -> str:
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    return media_type + "; charset=utf-8" if media_type.startswith("text/") else media_type
+
+
+def _signature(stat_result: os.stat_result) -> Tuple[int, int]:
+    return stat_result.st_mtime_ns, stat_result.st_size
+
+
+class AssetCache:
+    """Файлы в памяти по полному пути; файл перечитывается и пересжимается, если изменился"""
+
+    def __init__(self):
+        self._assets: Dict[str, Asset] = {}
+        self._lock = threading.Lock()
+
+    def cached(self, path: str, stat_result: os.stat_result) -> Optional[Asset]:
+        """Файл из памяти, если он не изменился с момента чтения, иначе None"""
+        asset = self._assets.get(path)
+        return asset if asset is not None and asset.signature == _signature(stat_result) else None
+
+    def get(self, path: str, stat_result: Optional[os.stat_result] = None) -> Asset:
+        stat_result = stat_result or os.stat(path)
+        signature = _signature(stat_result)
+        asset = self._assets.get(path)
+        if asset is None or asset.signature != signature:
+            with open(path, "rb") as f:
+                asset = Asset(f.read(), _media_type(path), signature)
+            with self._lock:
+                self._assets[path] = asset
+        return asset
+
+    def warm(self, directory: str, max_bytes: int = STATIC_CACHE_MAX_BYTES) -> int:
+        """Сжимает заранее все файлы каталога, чтобы первый запрос не ждал сжатия; возвращает их число"""
+        count = 0
+        for root, _, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                stat_result = os.stat(path)
+                if stat_result.st_size <= max_bytes:
+                    self.get(path, stat_result)
+                    count += 1
+        return count
+
+
+class DeferredResponse(Response):
+    """Ответ, который строится только при отправке (подготовку можно увести в поток)"""
+
+    def __init__(self, build: Callable[[], Awaitable[Response]]):
+        super().__init__()
+        self._build = build
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        response = await self._build()
+        await response(scope, receive, send)
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles, отдающий небольшие файлы из AssetCache (см. описание модуля)"""
+
+    def __init__(self, *args, assets: Optional[AssetCache] = None, max_bytes: int = STATIC_CACHE_MAX_BYTES,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.assets = assets or AssetCache()
+        self.max_bytes = max_bytes
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        if status_code != 200 or stat_result.st_size > self.max_bytes:
+            response = super().file_response(full_path, stat_result, scope, status_code)
+            response.headers["cache-control"] = REVALIDATE
+            return response
+        request = Request(scope)
+        asset = self.assets.cached(str(full_path), stat_result)
+        if asset is not None:
+            return self._asset_response(asset, request)
+
+        async def build() -> Response:
+            # Новый или измененный файл: чтение и сжатие zstd level 19 не должны держать event loop
+            fresh = await asyncio.to_thread(self.assets.get, str(full_path), stat_result)
+            return self._asset_response(fresh, request)
+        return DeferredResponse(build)
+
+    @staticmethod
+    def _asset_response(asset: Asset, request: Request) -> Response:
+        versioned = request.query_params.get("v") == asset.version
+        return asset.response(request.headers, IMMUTABLE if versioned else REVALIDATE)
+
+    def signature(self, path: str) -> Optional[Tuple[int, int]]:
+        """Подпись (mtime, размер) файла статики; None, если файла нет"""
+        _, stat_result = self.lookup_path(path)
+        return _signature(stat_result) if stat_result is not None else None
+
+    def asset_url(self, prefix: str, path: str) -> str:
+        """URL файла статики с версией содержимого; для несуществующего — без версии"""
+        full_path, stat_result = self.lookup_path(path)
+        if stat_result is None or not stat.S_ISREG(stat_result.st_mode) or stat_result.st_size > self.max_bytes:
+            return f"{prefix}/{path}"
+        return f"{prefix}/{path}?v={self.assets.get(full_path, stat_result).version}"
+
+
+class PhotoFiles(StaticFiles):
+    """Фото из хранилища: имя — хэш содержимого, поэтому кэшируются навсегда"""
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        # Файлы, положенные в каталог не через PhotoStore (например, img.png), могут смениться под тем же именем
+        content_addressed = status_code == 200 and _CONTENT_ADDRESSED_RE.fullmatch(os.path.basename(full_path))
+        response.headers["cache-control"] = IMMUTABLE if content_addressed else REVALIDATE
+        return response
+
+
+class CachedPage:
+    """HTML-страница в памяти со сжатием и ETag; ссылки на статику получают версии"""
+
+    def __init__(self, path: str, static: Optional[PrecompressedStaticFiles] = None, static_prefix: str = "/static",
+                 recheck_interval: float = PAGE_RECHECK_INTERVAL):
+        self.path = path
+        self.static = static
+        self.static_prefix = static_prefix
+        self.recheck_interval = recheck_interval
+        self._asset: Optional[Asset] = None
+        # Подписи страницы и статики, на которую она ссылается, на момент сборки _asset
+        self._signature: Optional[tuple] = None
+        self._refs: List[str] = []
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _refs_signature(self) -> tuple:
+        return tuple(self.static.signature(path) for path in self._refs) if self.static is not None else ()
+
+    def _versioned(self, html: str) -> str:
+        if self.static is None:
+            return html
+
+        def replace(match: re.Match) -> str:
+            url = self.static.asset_url(self.static_prefix, match.group("path"))
+            return f"{match.group('quote')}{url}{match.group('quote')}"
+        return _STATIC_REF_RE.sub(replace, html)
+
+    def asset(self) -> Asset:
+        now = time.monotonic()
+        if self._asset is not None and now - self._checked_at < self.recheck_interval:
+            return self._asset
+        with self._lock:
+            # Смена файла статики меняет ее ?v=, поэтому страница пересобирается и тогда
+            page_signature = _signature(os.stat(self.path))
+            if self._asset is None or self._signature != (page_signature, self._refs_signature()):
+                with open(self.path, encoding="utf-8") as f:
+                    html = f.read()
+                self._refs = sorted({match.group("path") for match in _STATIC_REF_RE.finditer(html)})
+                # Подписи берутся до чтения и версий: файл, сменившийся во время сборки, вызовет еще одну
+                self._signature = (page_signature, self._refs_signature())
+                self._asset = Asset(self._versioned(html).encode("utf-8"), "text/html; charset=utf-8",
+                                    page_signature)
+            self._checked_at = now
+            return self._asset
+
+    def response(self, request: Request) -> Response:
+        # Страница меняется без смены URL — браузер перепроверяет ее по ETag
+        return self.asset().response(request.headers, REVALIDATE)
@@ -0,0 +1,94 @@
+"""
+Пул агентов RobotGirlAgent: память на 10 000 активных сессий и цена выдачи агента.
+
+Меряется (tracemalloc, хранилище во временном каталоге):
+  * прирост памяти от N агентов в пуле (по 4 персонам поровну) — с общим
+    системным промптом персоны и, для сравнения, с собственной копией
+    промпта у каждого агента, как было до пула;
+  * время выдачи агента из пула (попадание) и создания нового агента на
+    каждый запрос, как раньше делал app.py;
+  * вытеснение: пул на --max-agents агентов и вдвое больше пользователей,
+    у каждого по сообщению, которое при вытеснении дописывается в индекс
+    долговременной памяти.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_agent_pool [--sessions 10000] [--max-agents 1000]
+"""
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+from backend.llm.agent_pool import AgentPool
+from backend.llm.personas import PERSONAS
+from backend.storage.session_store import SessionStore
+
+PERSONA_IDS = list(PERSONAS)
+
+
+def _fill(pool: AgentPool, sessions: int):
+    return [pool.get(PERSONA_IDS[i % len(PERSONA_IDS)], f"user-{i}") for i in range(sessions)]
+
+
+def _measure(store: SessionStore, sessions: int, own_prompts: bool) -> int:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    pool = AgentPool(store, max_agents=sessions)
+    agents = _fill(pool, sessions)
+    if own_prompts:
+        for agent in agents:
+            agent.system_prompt = agent._create_system_prompt()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del agents, pool
+    return used
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=10_000)
+    parser.add_argument("--max-agents", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SessionStore(os.path.join(tmp, "sessions.db"))
+
+        shared = _measure(store, args.sessions, own_prompts=False)
+        own = _measure(store, args.sessions, own_prompts=True)
+        print(f"Память на {args.sessions} агентов:")
+        print(f"  общий промпт персоны      {shared / 2**20:7.1f} МБ ({shared / args.sessions / 1024:5.2f} КБ на агента)")
+        print(f"  свой промпт у агента      {own / 2**20:7.1f} МБ ({own / args.sessions / 1024:5.2f} КБ на агента)")
+
+        pool = AgentPool(store, max_agents=args.sessions)
+        _fill(pool, args.sessions)
+        start = time.perf_counter()
+        _fill(pool, args.sessions)
+        hit = (time.perf_counter() - start) / args.sessions
+        persona = PERSONAS[PERSONA_IDS[0]]
+        start = time.perf_counter()
+        for i in range(args.sessions):
+            persona.create_agent(f"user-{i}", store)
+        create = (time.perf_counter() - start) / args.sessions
+        print("Выдача агента:")
+        print(f"  из пула                   {hit * 1e6:7.1f} мкс")
+        print(f"  новый агент на запрос     {create * 1e6:7.1f} мкс")
+
+        users = args.max_agents * 2
+        pool = AgentPool(store, max_agents=args.max_agents)
+        start = time.perf_counter()
+        for i in range(users):
+            agent = pool.get(PERSONA_IDS[i % len(PERSONA_IDS)], f"evict-{i}")
+            agent._add_to_memory("user", f"Привет, я пользователь номер {i}, люблю походы и кино")
+        elapsed = time.perf_counter() - start
+        stats = pool.stats()
+        print(f"Вытеснение ({users} пользователей, пул на {args.max_agents}):")
+        print(f"  вытеснено {stats['evicted']}, в пуле {stats['size']}, {elapsed / users * 1e3:.2f} мс на сообщение "
+              f"с учетом записи в индекс при вытеснении")
+
+
+if __name__ == "__main__":
+    main()
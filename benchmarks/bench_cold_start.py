@@ -0,0 +1,80 @@
+"""
+Холодный старт: время импорта модулей и задержка первого запроса к GigaChat.
+
+Каждый замер идет в отдельном процессе интерпретатора, чтобы импорты не
+кэшировались между прогонами. Меряется:
+  * импорт backend.llm.agents и app (сюда раньше входило создание клиента);
+  * создание клиента GigaChat провайдером — работа, которая теперь
+    откладывается до первого вызова или прогрева в lifespan.
+С --live и GIGACHAT_TOKEN дополнительно сравнивается первый запрос к GigaChat
+без прогрева (включает обмен OAuth-токена) и после warm().
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_cold_start [--repeat 5] [--live]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+CLIENT_SNIPPET = """
+import time
+from backend.llm.provider import get_provider
+start = time.perf_counter()
+get_provider().get()
+print(time.perf_counter() - start)
+"""
+
+FIRST_REQUEST_SNIPPET = """
+import asyncio, time
+from backend.llm.llm_client import acall_llm
+from backend.llm.provider import get_provider
+
+async def main():
+    start = time.perf_counter()
+    if {warm}:
+        await get_provider().warm()
+    warmed = time.perf_counter()
+    await acall_llm("Скажи одно слово.", "Отвечай одним словом.", use_cache=False)
+    print(time.perf_counter() - warmed)
+    await get_provider().aclose()
+
+asyncio.run(main())
+"""
+
+
+def _run(snippet: str, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", snippet], capture_output=True, text=True, check=True)
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--live", action="store_true", help="мерить первый запрос к настоящему GigaChat")
+    args = parser.parse_args()
+
+    print(f"Медиана по {args.repeat} процессам:")
+    for module in ["backend.llm.agents", "app"]:
+        print(f"  import {module:<22} {_run(IMPORT_SNIPPET.format(module=module), args.repeat) * 1000:8.0f} мс")
+    print(f"  {'создание клиента GigaChat':<29} {_run(CLIENT_SNIPPET, args.repeat) * 1000:8.0f} мс")
+
+    if args.live:
+        cold = _run(FIRST_REQUEST_SNIPPET.format(warm=False), args.repeat)
+        warm = _run(FIRST_REQUEST_SNIPPET.format(warm=True), args.repeat)
+        print(f"  {'первый запрос без прогрева':<29} {cold * 1000:8.0f} мс")
+        print(f"  {'первый запрос после warm()':<29} {warm * 1000:8.0f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Сравнение отправки фото в GigaChat с предобработкой и без нее.
+
+Для каждого фото меряется объем загрузки и время от начала обработки до готового
+разбора. Без флага --live сеть моделируется: загрузка идет со скоростью
+--bandwidth-mbit, а разбор занимает --model-latency секунд плюс
+--latency-per-mpx на каждый мегапиксель. С --live и GIGACHAT_TOKEN фото
+действительно загружаются и разбираются GigaChat.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_image_preprocess [пути к фото] [--live]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from PIL import Image
+
+from backend.media.image_preprocess import output_extension, preprocess_image
+
+DEFAULT_PHOTOS = ["uploaded_photos/img.png"]
+
+
+def _simulated_inference(path, args):
+    with Image.open(path) as image:
+        megapixels = image.width * image.height / 1_000_000
+    upload = os.path.getsize(path) * 8 / (args.bandwidth_mbit * 1_000_000)
+    return upload + args.model_latency + megapixels * args.latency_per_mpx
+
+
+def _live_inference(path, args):
+    from backend.llm.llm_client import describe_image, upload_image
+
+    start = time.perf_counter()
+    describe_image(upload_image(path))
+    return time.perf_counter() - start
+
+
+def _measure(path, args, workdir):
+    infer = _live_inference if args.live else _simulated_inference
+    runs = {"raw": [], "prep": []}
+    for i in range(args.repeat):
+        runs["raw"].append(infer(path, args))
+
+        start = time.perf_counter()
+        ext = output_extension()
+        result = preprocess_image(path, os.path.join(workdir, f"prep{i}{ext}"),
+                                  os.path.join(workdir, f"thumb{i}{ext}"))
+        prep_time = time.perf_counter() - start
+        runs["prep"].append(prep_time + infer(result["path"], args))
+
+    return {
+        "raw_bytes": os.path.getsize(path),
+        "prep_bytes": result["size"],
+        "thumb_bytes": result["thumb_size"],
+        "prep_time": prep_time,
+        "raw_latency": statistics.median(runs["raw"]),
+        "prep_latency": statistics.median(runs["prep"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("photos", nargs="*", default=DEFAULT_PHOTOS)
+    parser.add_argument("--live", action="store_true", help="отправлять фото в настоящий GigaChat")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--bandwidth-mbit", type=float, default=10.0)
+    parser.add_argument("--model-latency", type=float, default=2.0)
+    parser.add_argument("--latency-per-mpx", type=float, default=0.5)
+    args = parser.parse_args()
+
+    mode = "GigaChat" if args.live else f"симуляция, {args.bandwidth_mbit} Мбит/с"
+    print(f"Режим: {mode}, повторов: {args.repeat}\n")
+    print(f"{'фото':<30} {'байт до':>10} {'байт после':>11} {'превью':>8} {'обработка':>10} "
+          f"{'без, с':>8} {'с, с':>8}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for path in args.photos:
+            r = _measure(path, args, workdir)
+            print(f"{os.path.basename(path):<30} {r['raw_bytes']:>10} {r['prep_bytes']:>11} "
+                  f"{r['thumb_bytes']:>8} {r['prep_time'] * 1000:>8.1f}мс "
+                  f"{r['raw_latency']:>8.3f} {r['prep_latency']:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Задержка и качество поиска по долгой памяти (BM25 по FTS5) на больших сессиях.
+
+Генерирует сессию из --messages сообщений (плюс --noise-sessions соседних сессий
+того же размера, чтобы индекс был общим, как в проде), меряет стоимость
+инкрементальной индексации одного сообщения и задержку search() по случайным
+запросам.
+
+Качество — recall@MEMORY_TOP_K по «фактам»: в целевую сессию один раз вписаны
+факты из NEEDLES («Мою собаку зовут Граф...»), и search() по вопросу о факте
+(«Как зовут твою собаку?») должен вернуть его среди MEMORY_TOP_K сообщений.
+В соседних сессиях те же вопросы и похожие факты встречаются часто, как в
+живом трафике, где все спрашивают про собак и работу: по всему индексу эти
+слова частые, а в целевой сессии — редкие.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_long_term_memory [--messages 30000]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from backend.llm.long_term_memory import MEMORY_TOP_K, LongTermMemory
+from backend.storage.session_store import SessionStore
+
+TOPICS = [
+    "путешествия в горы", "поход на Алтай", "любимые книги", "кулинария и выпечка", "йога по утрам",
+    "фотография на пленку", "концерт в субботу", "собака по кличке Граф", "работа программистом",
+    "учеба в университете", "кофе с корицей", "море и серфинг", "настольные игры", "бег в парке",
+    "сериалы про детективов", "поездка в Питер", "рисование акварелью", "велосипедные прогулки",
+    "театр и балет", "изучение испанского",
+]
+TEMPLATES = [
+    "Мне очень нравится {t}, а тебе?",
+    "Вчера вспоминала про {t}, было здорово",
+    "Расскажи, как ты относишься к теме: {t}",
+    "Кстати, {t} — это моя давняя мечта",
+    "Не знаю, как ты, но {t} меня всегда вдохновляет",
+    "Давай в выходные обсудим {t}",
+]
+
+# (факт в целевой сессии, вопрос о нем)
+NEEDLES = [
+    ("Мою собаку зовут Граф, ему три года", "Как зовут твою собаку?"),
+    ("Я работаю дизайнером в студии на Петроградке", "Кем ты работаешь?"),
+    ("Моя сестра живет в Казани и учится на врача", "Где живет твоя сестра?"),
+    ("Больше всего на свете я боюсь высоты", "Чего ты боишься больше всего?"),
+    ("Мой любимый фильм — Амели, пересматривала раз десять", "Какой у тебя любимый фильм?"),
+    ("В детстве я занималась плаванием шесть лет", "Чем ты занималась в детстве?"),
+    ("Мой день рождения в конце марта", "Когда у тебя день рождения?"),
+    ("Я выросла в маленьком городке под Тверью", "Где ты выросла?"),
+    ("Аллергия у меня только на кошек", "На что у тебя аллергия?"),
+    ("Мечтаю когда-нибудь побывать в Японии весной", "В какой стране мечтаешь побывать?"),
+    ("Из музыки больше всего слушаю джаз", "Какую музыку ты слушаешь?"),
+    ("Мой брат младше меня на пять лет", "Насколько младше тебя брат?"),
+]
+# Доля сообщений соседних сессий — вопросы и факты из NEEDLES
+NOISE_NEEDLE_SHARE = 0.6
+
+
+def _message(rng):
+    return rng.choice(TEMPLATES).format(t=rng.choice(TOPICS))
+
+
+def _noise_message(rng):
+    if rng.random() < NOISE_NEEDLE_SHARE:
+        return rng.choice(rng.choice(NEEDLES))
+    return _message(rng)
+
+
+def _fill(store, session_id, count, rng, make=_message):
+    conn = store._conn()
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO messages (session_id, role, message, timestamp) VALUES (?, ?, ?, '')",
+        [(session_id, "user" if i % 2 == 0 else "assistant", make(rng)) for i in range(count)],
+    )
+    conn.execute("COMMIT")
+
+
+def _recall(store, memory, session_id):
+    """Доля вопросов NEEDLES, для которых факт попал в выдачу search()"""
+    found = 0
+    for fact, question in NEEDLES:
+        found += any(entry["message"] == fact for entry in memory.search(session_id, question))
+    return found / len(NEEDLES)
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=30_000)
+    parser.add_argument("--noise-sessions", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--appends", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        store = SessionStore(os.path.join(workdir, "sessions.db"))
+        memory = LongTermMemory(store)
+
+        start = time.perf_counter()
+        for i in range(args.noise_sessions):
+            _fill(store, f"noise-{i}", args.messages, rng, _noise_message)
+            memory.index_new(f"noise-{i}")
+        # Факты разбросаны по сессии равномерно
+        chunk = args.messages // (len(NEEDLES) + 1)
+        _fill(store, "target", chunk, rng)
+        for fact, _ in NEEDLES:
+            store.append("target", "assistant", fact)
+            _fill(store, "target", chunk, rng)
+        memory.index_new("target")
+        total = args.messages * (args.noise_sessions + 1)
+        print(f"Начальная индексация {total} сообщений: {time.perf_counter() - start:.1f} с")
+
+        append_times = []
+        for _ in range(args.appends):
+            start = time.perf_counter()
+            store.append("target", "user", _message(rng))
+            memory.index_new("target")
+            append_times.append(time.perf_counter() - start)
+
+        search_times = []
+        for _ in range(args.queries):
+            query = _message(rng)
+            start = time.perf_counter()
+            memory.search("target", query)
+            search_times.append(time.perf_counter() - start)
+        recall = _recall(store, memory, "target")
+
+    print(f"Запись + индексация одного сообщения: p50 {statistics.median(append_times) * 1000:.2f} мс, "
+          f"p99 {_percentile(append_times, 0.99) * 1000:.2f} мс")
+    size = (len(NEEDLES) + 1) * (args.messages // (len(NEEDLES) + 1)) + len(NEEDLES) + args.appends
+    print(f"search() по сессии из {size} сообщений: "
+          f"p50 {statistics.median(search_times) * 1000:.2f} мс, "
+          f"p95 {_percentile(search_times, 0.95) * 1000:.2f} мс, "
+          f"p99 {_percentile(search_times, 0.99) * 1000:.2f} мс")
+    print(f"recall@{MEMORY_TOP_K} по фактам ({len(NEEDLES)} вопросов): {recall:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Стоимость инструментирования: запись в метрики, спаны и выдача /metrics.
+
+Меряется среднее время одной операции в горячем цикле:
+  * Counter.inc и Histogram.observe с метками;
+  * обертка вызова GigaChat (_observed в llm_client) с выключенной и
+    включенной трассировкой — столько добавляется к каждому вызову LLM;
+  * спан запроса со спаном LLM без экспорта и с экспортом в файл
+    (TRACE_EXPORT_PATH): запись идет в фоновом потоке, в запросе остается
+    постановка в очередь; выводится и время дописать очередь при закрытии;
+  * render() реестра с заполненными рядами — цена одного опроса Prometheus.
+Для сравнения: вызов GigaChat длится сотни миллисекунд.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_observability [--iterations 200000]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from backend.llm import llm_client
+from backend.observability.metrics import MetricsRegistry
+from backend.observability.tracing import Tracer
+
+AGENTS = ["RobotGirlAgent", "MessageReplyAdvisor", "DatingAnalyzer", "GeneralDatingAdvisor", "image"]
+
+
+def _per_op(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200_000)
+    args = parser.parse_args()
+    n = args.iterations
+
+    registry = MetricsRegistry()
+    counter = registry.counter("bench_calls", "bench", ["agent", "type"])
+    histogram = registry.histogram("bench_seconds", "bench", ["agent", "kind", "outcome"])
+
+    print(f"Среднее время операции ({n} повторов):")
+    inc = _per_op(lambda i: counter.inc(1, agent=AGENTS[i % 5], type="prompt"), n)
+    print(f"  Counter.inc                    {inc * 1e6:8.2f} мкс")
+    observe = _per_op(lambda i: histogram.observe(i % 1000 / 100, agent=AGENTS[i % 5], kind="chat", outcome="ok"), n)
+    print(f"  Histogram.observe              {observe * 1e6:8.2f} мкс")
+
+    def observed(_):
+        with llm_client._observed("RobotGirlAgent", "chat"):
+            pass
+
+    for enabled in (False, True):
+        llm_client.get_tracer().enabled = enabled
+        llm_client.get_tracer()._finished.clear()
+        cost = _per_op(observed, n // 4)
+        print(f"  обертка вызова LLM, спаны {'вкл ' if enabled else 'выкл'} {cost * 1e6:8.2f} мкс")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        export_path = os.path.join(tmp, "spans.jsonl")
+        for label, path in (("без экспорта", None), ("с экспортом ", export_path)):
+            tracer = Tracer(enabled=True, export_path=path)
+
+            def nested(_):
+                with tracer.span("http"):
+                    with tracer.span("llm.chat", activate=False):
+                        pass
+
+            cost = _per_op(nested, n // 4)
+            print(f"  спан запроса + спан LLM, {label} {cost * 1e6:8.2f} мкс")
+        exporter = tracer._exporter
+        start = time.perf_counter()
+        tracer.close()
+        with open(export_path, encoding="utf-8") as f:
+            written = sum(1 for _ in f)
+        print(f"    записано {written} спанов, отброшено при полной очереди {exporter.dropped}, "
+              f"дописать очередь при закрытии {(time.perf_counter() - start) * 1e3:.0f} мс")
+
+    # Ряды, как у приложения под нагрузкой: эндпоинты x статусы, агенты x виды вызовов x исходы
+    for agent in AGENTS:
+        for kind in ("chat", "stream", "upload", "describe"):
+            for outcome in ("ok", "LLMTimeoutError", "LLMUpstreamError", "cancelled"):
+                histogram.observe(0.5, agent=agent, kind=kind, outcome=outcome)
+    series = len(histogram._values) + len(counter._values)
+    render = _per_op(lambda _: registry.render(), 200)
+    print(f"  render() на {series} рядов          {render * 1e3:8.2f} мс "
+          f"({len(registry.render()) // 1024} КБ текста)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Отдача страницы, статики, фото и JSON: до и после backend/web/serving.py.
+
+Собирает приложение из этого модуля в двух вариантах: old — как было в
+app.py (index.html читается с диска на каждый запрос, StaticFiles без сжатия
+и валидаторов кэша, JSONResponse), new — CachedPage, PrecompressedStaticFiles,
+PhotoFiles и OrjsonResponse. Запросы идут прямо в ASGI-приложение, без сети:
+на машине с парой ядер HTTP-клиент на Python сам упирается в процессор
+раньше сервера и уравнивает варианты. --concurrency корутин в течение
+--duration секунд шлют запросы с Accept-Encoding браузера; выводятся запросы
+в секунду, p50 и байты тела ответа (столько уйдет в сеть).
+
+Маршруты: / (index.html), /static/index.html, /uploaded_photos/<фото> с
+Range на первые 64 КБ (как запрашивает браузер при перемотке/докачке),
+/json — 200 результатов пакетного разбора анкет.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_serving [--duration 3] [--concurrency 16]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse
+from fastapi.staticfiles import StaticFiles
+
+from backend.web.serving import CachedPage, OrjsonResponse, PhotoFiles, PrecompressedStaticFiles
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHOTO = os.path.join(ROOT, "backend", "llm", "img.png")
+PHOTO_NAME = "bench.png"
+ACCEPT_ENCODING = "gzip, deflate, br, zstd"
+ROUTES = [
+    ("/", {}),
+    ("/static/index.html", {}),
+    (f"/uploaded_photos/{PHOTO_NAME}", {"range": "bytes=0-65535"}),
+    ("/json", {}),
+]
+
+JSON_PAYLOAD = [
+    {"type": "result", "id": str(i), "status": "ok", "elapsed": 1.234,
+     "feedback": "Анкета живая и с юмором, но про работу ни слова — добавь одну деталь о себе. " * 3}
+    for i in range(200)
+]
+
+
+def make_app(mode: str, static_dir: str, photo_dir: str) -> FastAPI:
+    index_path = os.path.join(static_dir, "index.html")
+    if mode == "old":
+        app = FastAPI()
+        app.mount("/static", StaticFiles(directory=static_dir), name="static")
+        app.mount("/uploaded_photos", StaticFiles(directory=photo_dir), name="uploaded_photos")
+
+        @app.get("/", response_class=HTMLResponse)
+        def index():
+            with open(index_path, encoding="utf-8") as f:
+                return f.read()
+    else:
+        app = FastAPI(default_response_class=OrjsonResponse)
+        static_files = PrecompressedStaticFiles(directory=static_dir)
+        index_page = CachedPage(index_path, static_files)
+        static_files.assets.warm(static_dir)
+        app.mount("/static", static_files, name="static")
+        app.mount("/uploaded_photos", PhotoFiles(directory=photo_dir), name="uploaded_photos")
+
+        @app.get("/", response_class=HTMLResponse)
+        def index(request: Request):
+            return index_page.response(request)
+
+    @app.get("/json")
+    def json_payload():
+        return JSON_PAYLOAD
+
+    return app
+
+
+async def _request(app, path: str, headers: dict) -> int:
+    """GET прямо в ASGI-приложение; возвращает размер тела ответа"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(k.encode(), v.encode()) for k, v in {"accept-encoding": ACCEPT_ENCODING, **headers}.items()],
+        "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 8000),
+    }
+    status, size = 0, 0
+    requested = False
+    disconnected = asyncio.Event()
+
+    async def receive():
+        # Как у настоящего сервера: тело запроса один раз, дальше ждем разрыва соединения
+        # (его слушает FileResponse, пока отдает файл)
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status, size
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            size += len(message.get("body", b""))
+
+    await app(scope, receive, send)
+    if status not in (200, 206):
+        raise RuntimeError(f"{path}: статус {status}")
+    return size
+
+
+async def _hammer(app, path: str, headers: dict, concurrency: int, duration: float):
+    latencies = []
+    total = 0
+    deadline = time.perf_counter() + duration
+
+    async def user():
+        nonlocal total
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            size = await _request(app, path, headers)
+            latencies.append(time.perf_counter() - start)
+            total += size
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1e3,
+        "bytes": total / len(latencies),
+    }
+
+
+async def run_mode(mode: str, args, static_dir: str, photo_dir: str):
+    app = make_app(mode, static_dir, photo_dir)
+    results = {}
+    for route, headers in ROUTES:
+        await _hammer(app, route, headers, args.concurrency, 0.5)  # прогрев
+        results[route] = await _hammer(app, route, headers, args.concurrency, args.duration)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=3)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as photo_dir:
+        shutil.copy(PHOTO, os.path.join(photo_dir, PHOTO_NAME))
+        static_dir = os.path.join(ROOT, "static")
+        results = {mode: asyncio.run(run_mode(mode, args, static_dir, photo_dir)) for mode in ("old", "new")}
+
+    print(f"{'маршрут':<34} {'было, rps':>10} {'стало, rps':>11} {'p50 было/стало, мс':>19} {'байт было/стало':>17}")
+    for route, _ in ROUTES:
+        old, new = results["old"][route], results["new"][route]
+        print(f"{route:<34} {old['rps']:>10.0f} {new['rps']:>11.0f} "
+              f"{old['p50_ms']:>9.1f} / {new['p50_ms']:<7.1f} {old['bytes']:>8.0f} / {new['bytes']:<7.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Офлайн-оценка семантического кэша вопросов коуча (backend/llm/semantic_cache.py).
+
+Выборка — benchmarks/fixtures/coach_questions.json: вопросы, размеченные по
+намерению (переформулировки одного вопроса), включая близкие по словам, но
+разные по смыслу («куда пойти» и «куда не стоит ходить» на первое свидание).
+Вопросы подаются в кэш в случайном порядке, как поток первых вопросов
+пользователей: промах кладет в кэш ответ с намерением вопроса, попадание
+считается релевантным, если намерение совпало.
+
+Для каждого порога выводятся:
+  hit rate  — доля вопросов, отвеченных из кэша;
+  точность  — доля попаданий с ответом на тот же вопрос по смыслу;
+  полнота   — доля релевантных попаданий среди вопросов, у которых
+              переформулировка уже была в кэше (потолок для любого порога).
+Плюс время lookup/set на кэше из --size записей.
+
+Запуск из корня репозитория:
+    python -m benchmarks.eval_semantic_cache [--orders 20] [--size 5000]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+
+from backend.llm.semantic_cache import SEMANTIC_CACHE_THRESHOLD, SemanticCache
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "coach_questions.json")
+
+
+def load_questions():
+    with open(FIXTURE, encoding="utf-8") as f:
+        return [(question, group["intent"]) for group in json.load(f) for question in group["questions"]]
+
+
+def evaluate(questions, threshold: float, orders: int):
+    hits = relevant = reachable = 0
+    total = len(questions) * orders
+    for seed in range(orders):
+        stream = questions[:]
+        random.Random(seed).shuffle(stream)
+        cache = SemanticCache(threshold=threshold)
+        seen = set()
+        for question, intent in stream:
+            reachable += intent in seen
+            seen.add(intent)
+            match = cache.lookup(question)
+            if match is None:
+                cache.set(question, intent)
+                continue
+            hits += 1
+            relevant += match[1] == intent
+    return {
+        "hit_rate": hits / total,
+        "precision": relevant / hits if hits else 1.0,
+        "recall": relevant / reachable if reachable else 0.0,
+        "false_hits": (hits - relevant) / orders,
+    }
+
+
+def timing(questions, size: int):
+    """lookup и set на кэше, заполненном size вопросами-вариациями из выборки"""
+    rng = random.Random(0)
+    words = sorted({w for question, _ in questions for w in question.lower().strip("?!.").split()})
+    cache = SemanticCache(max_entries=size)
+    set_times = []
+    for _ in range(size):
+        question = " ".join(rng.sample(words, rng.randint(4, 9)))
+        start = time.perf_counter()
+        cache.set(question, question)
+        set_times.append(time.perf_counter() - start)
+    lookup_times = []
+    for question, _ in questions:
+        start = time.perf_counter()
+        cache.lookup(question)
+        lookup_times.append(time.perf_counter() - start)
+    lookup_times.sort()
+    return {
+        "set_ms": statistics.median(set_times) * 1e3,
+        "lookup_p50_ms": lookup_times[len(lookup_times) // 2] * 1e3,
+        "lookup_p99_ms": lookup_times[int(len(lookup_times) * 0.99)] * 1e3,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=20, help="Сколько случайных порядков вопросов усреднять")
+    parser.add_argument("--size", type=int, default=5000, help="Размер кэша для замера времени")
+    parser.add_argument("--thresholds", default="0.3,0.35,0.4,0.45,0.5,0.55,0.6,0.7,0.8")
+    args = parser.parse_args()
+
+    questions = load_questions()
+    print(f"Вопросов: {len(questions)}, намерений: {len({intent for _, intent in questions})}, "
+          f"порядков: {args.orders}; текущий порог SEMANTIC_CACHE_THRESHOLD={SEMANTIC_CACHE_THRESHOLD}")
+    print(f"{'порог':>6} {'hit rate':>9} {'точность':>9} {'полнота':>8} {'ложных на прогон':>17}")
+    for threshold in (float(t) for t in args.thresholds.split(",")):
+        r = evaluate(questions, threshold, args.orders)
+        print(f"{threshold:>6.2f} {r['hit_rate']:>9.1%} {r['precision']:>9.1%} {r['recall']:>8.1%} "
+              f"{r['false_hits']:>17.1f}")
+
+    t = timing(questions, args.size)
+    print(f"Кэш на {args.size} записей: set {t['set_ms']:.2f} мс, "
+          f"lookup p50 {t['lookup_p50_ms']:.2f} мс, p99 {t['lookup_p99_ms']:.2f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""
+Нагрузочный тест приложения без расхода квоты GigaChat.
+
+Поднимает app в отдельном процессе uvicorn с заглушкой вместо GigaChat
+(--backend mock — в процессе приложения, http-mock — настоящий клиент
+GigaChat против локального HTTP-сервера backend.llm.mock_gigachat), данные
+приложения кладет во временный каталог. Затем --users виртуальных
+пользователей в течение --duration секунд шлют запросы в пропорции --mix:
+/chat и /chat/stream проигрывают реплики из conversation_memory_*.json
+(у каждого пользователя своя сессия), /analyze-profile берет анкеты из
+fixtures/bios.json, /analyze-photo — фото (--photos) в --photo-variants
+вариантах, чтобы часть загрузок была новой.
+
+Для каждого эндпоинта печатаются пропускная способность, ошибки по статусам и
+p50/p95/p99 задержки (для /chat/stream — еще время до первого токена).
+--save пишет результат в JSON, --compare сравнивает с сохраненным и
+завершается с кодом 1, если p95 или пропускная способность хуже более чем на
+--tolerance.
+
+Запуск из корня репозитория:
+    python -m benchmarks.load_test --save benchmarks/baselines/load_test_mock.json
+    python -m benchmarks.load_test --compare benchmarks/baselines/load_test_mock.json
+    python -m benchmarks.load_test --url http://127.0.0.1:8000   # уже запущенный сервер
+Настройки заглушки и приложения передаются через --server-env, например
+--server-env MOCK_LLM_ERROR_RATE=0.05 --server-env LLM_RATE_PER_SECOND=20
+"""
+import argparse
+import asyncio
+import glob
+import io
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import httpx
+from PIL import Image
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+DEFAULT_MIX = "chat=5,chat/stream=3,analyze-profile=2,analyze-photo=1"
+DEFAULT_PHOTOS = ["uploaded_photos/img.png"]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Процесс {process.args} завершился с кодом {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} не ответил за {timeout} с")
+
+
+def _start_servers(args, workdir: str):
+    """Запускает приложение (и HTTP-заглушку GigaChat) и возвращает (url, процессы)"""
+    env = dict(os.environ)
+    env.update({
+        "SESSION_DB_PATH": os.path.join(workdir, "sessions.db"),
+        "LLM_CACHE_PATH": os.path.join(workdir, "llm_cache.db"),
+        "PHOTO_DIR": os.path.join(workdir, "photos"),
+        "PHOTO_DB_PATH": os.path.join(workdir, "photos.db"),
+    })
+    processes = []
+    if args.backend == "http-mock":
+        mock_port = _free_port()
+        mock = subprocess.Popen([sys.executable, "-m", "backend.llm.mock_gigachat", "--port", str(mock_port)], env=env)
+        processes.append(mock)
+        _wait_ready(f"http://127.0.0.1:{mock_port}/docs", mock)
+        env.update({
+            "LLM_BACKEND": "gigachat",
+            "GIGACHAT_BASE_URL": f"http://127.0.0.1:{mock_port}/api/v1",
+            "GIGACHAT_AUTH_URL": f"http://127.0.0.1:{mock_port}/api/v2/oauth",
+            "GIGACHAT_TOKEN": "bW9jazptb2Nr",
+        })
+    else:
+        env["LLM_BACKEND"] = "mock"
+    for item in args.server_env:
+        key, value = item.split("=", 1)
+        env[key] = value
+
+    port = _free_port()
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"], env=env,
+    )
+    processes.append(app)
+    url = f"http://127.0.0.1:{port}"
+    _wait_ready(f"{url}/cache/stats", app)
+    return url, processes
+
+
+def _parse_mix(spec: str):
+    mix = {}
+    for item in spec.split(","):
+        name, weight = item.split("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def _load_dialogues():
+    """Реплики пользователя из conversation_memory_*.json в корне и в fixtures"""
+    dialogues = []
+    for path in sorted(glob.glob("conversation_memory_*.json") + glob.glob(os.path.join(FIXTURES_DIR, "conversation_memory_*.json"))):
+        with open(path, encoding="utf-8") as f:
+            messages = [entry["message"] for entry in json.load(f) if entry.get("role") == "user"]
+        if messages:
+            dialogues.append(messages)
+    return dialogues
+
+
+def _photo_variants(paths, count: int):
+    """PNG-варианты фото с измененным пикселем: у каждого свой хэш, как у разных загрузок"""
+    variants = []
+    for i in range(count):
+        with Image.open(paths[i % len(paths)]) as image:
+            image = image.convert("RGB")
+            image.putpixel((0, 0), (i % 256, (i // 256) % 256, 7))
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+        variants.append(buffer.getvalue())
+    return variants
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.first_tokens = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def add(self, endpoint: str, status: int, latency: float, first_token: float = None):
+        self.statuses[endpoint][status] += 1
+        if status == 200:
+            self.latencies[endpoint].append(latency)
+            if first_token is not None:
+                self.first_tokens[endpoint].append(first_token)
+
+    def summary(self, duration: float):
+        result = {}
+        for endpoint, statuses in sorted(self.statuses.items()):
+            latencies = self.latencies[endpoint]
+            total = sum(statuses.values())
+            row = {
+                "requests": total,
+                "ok": len(latencies),
+                "errors": {str(status): n for status, n in statuses.items() if status != 200},
+                "error_rate": round(1 - len(latencies) / total, 4),
+                "throughput_rps": round(len(latencies) / duration, 3),
+            }
+            if latencies:
+                row.update({f"p{q}_ms": round(_percentile(latencies, q / 100) * 1000, 1) for q in (50, 95, 99)})
+            if self.first_tokens[endpoint]:
+                row["first_token_p50_ms"] = round(statistics.median(self.first_tokens[endpoint]) * 1000, 1)
+                row["first_token_p95_ms"] = round(_percentile(self.first_tokens[endpoint], 0.95) * 1000, 1)
+            result[endpoint] = row
+        return result
+
+
+class VirtualUser:
+    def __init__(self, index: int, dialogue, bios, photos, rng: random.Random):
+        self.session_id = f"load-{index}-{uuid.uuid4().hex[:8]}"
+        self.dialogue = dialogue
+        self.bios = bios
+        self.photos = photos
+        self.rng = rng
+        self.turn = 0
+
+    def next_message(self) -> str:
+        message = self.dialogue[self.turn % len(self.dialogue)]
+        self.turn += 1
+        return message
+
+    async def request(self, client: httpx.AsyncClient, endpoint: str):
+        """Выполняет запрос, возвращает (статус, задержка, время до первого токена)"""
+        start = time.perf_counter()
+        first_token = None
+        if endpoint == "chat":
+            response = await client.post("/chat", json={"user_message": self.next_message(),
+                                                        "session_id": self.session_id})
+            status = response.status_code
+        elif endpoint == "chat/stream":
+            body = {"user_message": self.next_message(), "session_id": self.session_id}
+            async with client.stream("POST", "/chat/stream", json=body) as response:
+                status = response.status_code
+                async for chunk in response.aiter_text():
+                    if first_token is None and "event: reply" in chunk:
+                        first_token = time.perf_counter() - start
+                    if "event: error" in chunk:
+                        status = 599
+        elif endpoint == "analyze-profile":
+            response = await client.post("/analyze-profile", json={"bio": self.rng.choice(self.bios)})
+            status = response.status_code
+        elif endpoint == "analyze-photo":
+            photo = self.rng.choice(self.photos)
+            response = await client.post("/analyze-photo", files={"photo": ("photo.png", photo, "image/png")})
+            status = response.status_code
+        else:
+            raise ValueError(f"Неизвестный эндпоинт {endpoint}")
+        return status, time.perf_counter() - start, first_token
+
+
+async def _run_user(user: VirtualUser, client, mix, recorder: Recorder, measure_from: float, deadline: float,
+                    think_time: float):
+    endpoints, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        endpoint = user.rng.choices(endpoints, weights)[0]
+        started = time.perf_counter()
+        try:
+            status, latency, first_token = await user.request(client, endpoint)
+        except httpx.HTTPError:
+            status, latency, first_token = 0, time.perf_counter() - started, None
+        if started >= measure_from:
+            recorder.add(endpoint, status, latency, first_token)
+        if think_time:
+            await asyncio.sleep(user.rng.expovariate(1 / think_time))
+
+
+async def _run(url: str, args):
+    mix = _parse_mix(args.mix)
+    dialogues = _load_dialogues()
+    with open(os.path.join(FIXTURES_DIR, "bios.json"), encoding="utf-8") as f:
+        bios = json.load(f)
+    photos = _photo_variants(args.photos, args.photo_variants) if "analyze-photo" in mix else []
+    rng = random.Random(args.seed)
+    users = [VirtualUser(i, dialogues[i % len(dialogues)], bios, photos, random.Random(rng.random()))
+             for i in range(args.users)]
+
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.users * 2)
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        start = time.perf_counter()
+        measure_from = start + args.warmup
+        deadline = measure_from + args.duration
+        await asyncio.gather(*[
+            _run_user(user, client, mix, recorder, measure_from, deadline, args.think_time) for user in users
+        ])
+        elapsed = time.perf_counter() - measure_from
+        server = (await client.get("/scheduler/stats")).json()
+
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "backend": args.backend if not args.url else "external",
+            "users": args.users, "duration": args.duration, "warmup": args.warmup,
+            "mix": args.mix, "think_time": args.think_time, "server_env": args.server_env,
+        },
+        "endpoints": recorder.summary(elapsed),
+        "server": server,
+    }
+
+
+def _print_report(result):
+    print(f"\n{'эндпоинт':<16} {'запросов':>8} {'ошибок':>7} {'rps':>7} {'p50, мс':>9} {'p95, мс':>9} "
+          f"{'p99, мс':>9} {'1-й токен p50':>14}")
+    for endpoint, row in result["endpoints"].items():
+        errors = sum(row["errors"].values())
+        first = row.get("first_token_p50_ms")
+        print(f"{endpoint:<16} {row['requests']:>8} {errors:>7} {row['throughput_rps']:>7.2f} "
+              f"{row.get('p50_ms', 0):>9.0f} {row.get('p95_ms', 0):>9.0f} {row.get('p99_ms', 0):>9.0f} "
+              f"{(f'{first:.0f}' if first is not None else '-'):>14}")
+        if row["errors"]:
+            print(f"{'':<16} статусы ошибок: {row['errors']}")
+    print(f"\nПланировщик: {result['server']}")
+
+
+def _compare(result, baseline, tolerance: float) -> bool:
+    """Печатает изменения относительно baseline; True, если есть регрессия"""
+    regression = False
+    print(f"\nСравнение с baseline от {baseline['created']} (допуск {tolerance:.0%}):")
+    if baseline["config"] != result["config"]:
+        print(f"  ВНИМАНИЕ: параметры прогона отличаются от baseline: {baseline['config']}")
+    for endpoint, base in baseline["endpoints"].items():
+        row = result["endpoints"].get(endpoint)
+        if row is None or "p95_ms" not in row or "p95_ms" not in base:
+            print(f"  {endpoint:<16} нет данных для сравнения")
+            continue
+        p95_change = row["p95_ms"] / base["p95_ms"] - 1
+        rps_change = row["throughput_rps"] / base["throughput_rps"] - 1 if base["throughput_rps"] else 0.0
+        worse = p95_change > tolerance or rps_change < -tolerance
+        regression |= worse
+        print(f"  {endpoint:<16} p95 {base['p95_ms']:.0f} -> {row['p95_ms']:.0f} мс ({p95_change:+.0%}), "
+              f"rps {base['throughput_rps']:.2f} -> {row['throughput_rps']:.2f} ({rps_change:+.0%})"
+              f"{'  РЕГРЕССИЯ' if worse else ''}")
+    return regression
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="тестировать уже запущенный сервер вместо локального")
+    parser.add_argument("--backend", choices=["mock", "http-mock"], default="mock")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--think-time", type=float, default=0.0, help="средняя пауза пользователя между запросами, с")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--photos", nargs="+", default=DEFAULT_PHOTOS)
+    parser.add_argument("--photo-variants", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE")
+    parser.add_argument("--save", help="сохранить результат в JSON")
+    parser.add_argument("--compare", help="сравнить с сохраненным JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    processes = []
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            url = args.url
+            if url is None:
+                url, processes = _start_servers(args, workdir)
+            print(f"Нагрузка на {url}: {args.users} пользователей, {args.duration:.0f} с, смесь {args.mix}")
+            result = asyncio.run(_run(url, args))
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+
+    _print_report(result)
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or ".", exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультат сохранен в {args.save}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if _compare(result, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()